@@ -1,7 +1,10 @@
 import pandas as pd
-import requests
 from io import StringIO
 import os 
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+import general_input
 
 # Base da dados do GitHub
 #https://github.com/diegonerii/Dados-Abertos-Setor-Eletrico-Brasileiro/blob/main/dadosAbertosSetorEletrico/app.ipynb
@@ -16,6 +19,27 @@ url_geracao_2024 = r'https://pda-download.ccee.org.br/H1uCbMTQS6uf3-5Dy7xkng/con
 
 url_list = [url_pld_2023,url_pld_2024,url_geracao_2023,url_geracao_2024]
 
+url_dict = {
+    'pld_2023': url_pld_2023,
+    'pld_2024': url_pld_2024,
+    'geracao_2023': url_geracao_2023,
+    'geracao_2024': url_geracao_2024,
+}
+
+# Fontes mantidas nos CSVs de geração
+FONTES_RENOVAVEIS = ['Eólica', 'Solar Fotovoltaica']
+
+# Tipos das colunas conhecidas dos CSVs da CCEE (as demais são inferidas)
+CSV_DTYPES = {
+    'MES_REFERENCIA': 'int32',
+    'PERIODO_COMERCIALIZACAO': 'int32',
+    'DIA': 'int8',
+    'HORA': 'int8',
+    'SUBMERCADO': 'category',
+    'FONTE_PRIMARIA': 'category',
+    'PLD_HORA': 'float64',
+}
+
 def fetch_csv_from_api(url):
     """
     Faz uma requisição GET para a URL da API e retorna o conteúdo CSV como DataFrame
@@ -26,6 +50,8 @@ def fetch_csv_from_api(url):
     Retorna:
     pd.DataFrame: DataFrame contendo os dados do CSV
     """
+    import requests
+
     try:
         # Faz a requisição GET para a API
         response = requests.get(url)
@@ -59,4 +85,228 @@ def fetch_csv_from_api(url):
         print(df)
         print(df['FONTE_PRIMARIA'].unique())
         df_final = df[df['FONTE_PRIMARIA'].isin(['Eólica', 'Solar Fotovoltaica'])]
-        df_final.groupby(["FONTE_PRIMARIA","SUBMERCADO","PERIODO_COMERCIALIZACAO","MES_REFERENCIA"]).sum()
\ No newline at end of file
+        df_final.groupby(["FONTE_PRIMARIA","SUBMERCADO","PERIODO_COMERCIALIZACAO","MES_REFERENCIA"]).sum()
+
+
+def download_csv_to_disk(url: str, destination: Path, chunk_size: int = 1 << 20) -> Optional[Path]:
+    """
+    Baixa o CSV da URL direto para o disco, em blocos de chunk_size bytes, sem carregar o texto inteiro em memória
+
+    Parâmetros:
+    url (str): URL da API que retorna um arquivo CSV
+    destination (Path): Arquivo de destino
+    chunk_size (int): Tamanho dos blocos gravados
+
+    Retorna:
+    Path: Caminho do arquivo baixado (None em caso de erro)
+    """
+    import requests
+
+    destination = Path(destination)
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    partial = destination.with_suffix(destination.suffix + '.part')
+
+    try:
+        with requests.get(url, stream=True, timeout=60) as response:
+            response.raise_for_status()
+
+            with open(partial, 'wb') as file:
+                for block in response.iter_content(chunk_size=chunk_size):
+                    file.write(block)
+
+        # Só substitui o destino quando o download termina
+        os.replace(partial, destination)
+        return destination
+
+    except requests.exceptions.RequestException as e:
+        print(f"Erro na requisição à API ({url}): {e}")
+        partial.unlink(missing_ok=True)
+        return None
+
+
+def _promote_type(current, new):
+    """
+    Retorna o tipo Arrow que comporta os dois tipos inferidos de uma coluna: inteiro e float viram float (NaN em um
+    bloco posterior), uma coluna nula ou toda NaN assume o tipo do outro bloco e os demais conflitos viram texto
+    """
+    import pyarrow as pa
+
+    def numeric(data_type):
+        return pa.types.is_integer(data_type) or pa.types.is_floating(data_type)
+
+    if current.equals(new) or pa.types.is_null(new):
+        return current
+    if pa.types.is_null(current):
+        return new
+    if pa.types.is_dictionary(current) and pa.types.is_dictionary(new):
+        return pa.dictionary(pa.int32(), current.value_type)
+    if numeric(current) and numeric(new):
+        return pa.float64()
+
+    return pa.string()
+
+
+def _write_csv_chunks(csv_path: Path, partial: Path, dtypes: dict, schema, fontes: Optional[List[str]],
+                      filter_fontes: bool, chunksize: int, encoding: str):
+    """
+    Grava os blocos do CSV em partial com o esquema informado (None: o do primeiro bloco). Se um bloco não couber no
+    esquema, para e retorna o esquema promovido para uma nova leitura; retorna None quando o arquivo foi gravado
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+
+    try:
+        for chunk in pd.read_csv(csv_path, sep=";", dtype=dtypes, chunksize=chunksize, encoding=encoding): # type: ignore
+            if filter_fontes:
+                chunk = chunk[chunk['FONTE_PRIMARIA'].isin(fontes)]
+
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+
+            if schema is None:
+                schema = table.schema
+
+            promoted = pa.schema([field.with_type(_promote_type(field.type, table.schema.field(field.name).type))
+                                  for field in schema])
+
+            if not promoted.equals(schema):
+                return promoted
+
+            if writer is None:
+                writer = pq.ParquetWriter(partial, schema, compression='zstd')
+
+            writer.write_table(table.cast(schema))
+
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if writer is None:
+        partial.unlink(missing_ok=True)
+        return pa.schema([])
+
+    return None
+
+
+def csv_to_parquet(csv_path: Path, parquet_path: Path, fontes: Optional[List[str]] = None,
+                   chunksize: int = 500_000, encoding: str = 'utf-8') -> Optional[Path]:
+    """
+    Converte o CSV baixado para Parquet lendo em blocos de chunksize linhas, com as colunas tipadas por CSV_DTYPES
+    e, se o arquivo tiver a coluna FONTE_PRIMARIA, mantendo apenas as fontes informadas durante a leitura. As demais
+    colunas são inferidas; se o tipo de uma delas mudar entre blocos (ex.: inteiro -> float quando aparecem NaN, ou um
+    primeiro bloco todo nulo), o tipo é promovido e o arquivo é lido de novo com o esquema promovido
+
+    Parâmetros:
+    csv_path (Path): CSV baixado
+    parquet_path (Path): Arquivo Parquet de destino
+    fontes (list): Valores de FONTE_PRIMARIA mantidos (None mantém todos)
+    chunksize (int): Linhas lidas por bloco
+    encoding (str): Codificação do CSV (ex.: 'latin-1')
+
+    Retorna:
+    Path: Caminho do arquivo Parquet (None em caso de erro)
+    """
+    import pyarrow as pa
+
+    try:
+        header = pd.read_csv(csv_path, sep=";", nrows=0, encoding=encoding).columns
+    except pd.errors.EmptyDataError:
+        print(f"O arquivo CSV {csv_path} está vazio.")
+        return None
+
+    dtypes = {column: dtype for column, dtype in CSV_DTYPES.items() if column in header}
+    filter_fontes = fontes is not None and 'FONTE_PRIMARIA' in header
+
+    parquet_path = Path(parquet_path)
+    partial = parquet_path.with_suffix(parquet_path.suffix + '.part')
+    schema = None
+
+    try:
+        while True:
+            promoted = _write_csv_chunks(csv_path, partial, dtypes, schema, fontes, filter_fontes, chunksize, encoding)
+
+            if promoted is None or not len(promoted):
+                break
+
+            # Colunas promovidas a texto são lidas como texto na nova leitura (inteiros viram float no cast)
+            for field in promoted:
+                if field.name not in CSV_DTYPES and pa.types.is_string(field.type):
+                    dtypes[field.name] = str
+
+            schema = promoted.remove_metadata()
+
+    except Exception as e:
+        print(f"Erro inesperado ao converter {csv_path}: {e}")
+        partial.unlink(missing_ok=True)
+        return None
+
+    if promoted is not None:
+        print(f"O arquivo CSV {csv_path} está vazio.")
+        return None
+
+    os.replace(partial, parquet_path)
+
+    return parquet_path
+
+
+def bulk_download(urls: Dict[str, str] = url_dict, cache_dir: Path = general_input.ccee_pda_cache_path,
+                  fontes: Optional[List[str]] = FONTES_RENOVAVEIS, workers: int = 4,
+                  overwrite: bool = False, keep_csv: bool = False, encoding: str = 'utf-8') -> Dict[str, Path]:
+    """
+    Baixa em paralelo os CSVs da CCEE e os converte para um cache Parquet (um arquivo por nome em urls). Cada
+    CSV é gravado em disco durante o download e lido em blocos, sem manter o texto inteiro em memória
+
+    Parâmetros:
+    urls (dict): Nome do arquivo no cache -> URL do CSV
+    cache_dir (Path): Diretório do cache
+    fontes (list): Valores de FONTE_PRIMARIA mantidos nos CSVs de geração
+    workers (int): Downloads simultâneos
+    overwrite (bool): Baixa de novo os arquivos que já estão no cache
+    keep_csv (bool): Mantém os CSVs baixados
+    encoding (str): Codificação dos CSVs (ex.: 'latin-1')
+
+    Retorna:
+    dict: Nome -> caminho do Parquet de cada arquivo convertido
+    """
+    cache_dir = Path(cache_dir)
+
+    def process(name: str, url: str) -> Optional[Path]:
+        parquet_path = cache_dir / f"{name}.parquet"
+
+        if parquet_path.exists() and not overwrite:
+            print(f"[{name}] Encontrado no cache.")
+            return parquet_path
+
+        csv_path = download_csv_to_disk(url, cache_dir / f"{name}.csv")
+
+        if csv_path is None:
+            return None
+
+        parquet_path = csv_to_parquet(csv_path, parquet_path, fontes=fontes, encoding=encoding)
+
+        if not keep_csv:
+            csv_path.unlink(missing_ok=True)
+
+        print(f"[{name}] Baixado e convertido.")
+        return parquet_path
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {name: executor.submit(process, name, url) for name, url in urls.items()}
+
+    return {name: future.result() for name, future in futures.items() if future.result() is not None}
+
+
+def read_cached(name: str, cache_dir: Path = general_input.ccee_pda_cache_path,
+                columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Lê um arquivo do cache Parquet criado por bulk_download
+
+    Parâmetros:
+    name (str): Nome do arquivo no cache (ex.: 'geracao_2024')
+    columns (list): Colunas lidas (None lê todas)
+
+    Retorna:
+    pd.DataFrame: DataFrame com os dados do arquivo
+    """
+    return pd.read_parquet(Path(cache_dir) / f"{name}.parquet", columns=columns)
@@ -1,17 +1,25 @@
 import asyncio
-import httpx
 import pandas as pd
 from datetime import datetime
 from io import BytesIO
 from typing import List, Union, Optional
+from http_transport import HttpTransport, shared_transport
 
 class ONSHourlyGeneration:
 
-    def __init__(self):
+    def __init__(self, transport: Optional[HttpTransport] = None):
         """
         Initializes the ONSHourlyGeneration class to fetch hourly generation data from ONS.
+        Files are downloaded through the given HttpTransport (default: the shared one).
         """
         self._cache = {}
+        self.transport = transport or shared_transport()
+
+    def clear_cache(self) -> None:
+        """
+        Drops the downloaded files kept in memory (e.g. once they are written to a persistent cache).
+        """
+        self._cache.clear()
 
     def _get_url(self, year: int, month: Optional[int] = None) -> str:
         """
@@ -31,16 +39,18 @@ class ONSHourlyGeneration:
         else:
             return f"{base_url}{year}.parquet"
 
-    async def _fetch_and_cache_data(self, client: httpx.AsyncClient, url: str) -> pd.DataFrame:
+    async def _fetch_and_cache_data(self, url: str) -> pd.DataFrame:
         """
         Asynchronously fetches a single Parquet file and caches it.
         """
+        import httpx
+
         if url in self._cache:
             print(f"[{url}] Data found in cache. Skipping download.")
             return self._cache[url]
 
         try:
-            response = await client.get(url, timeout=30)
+            response = await self.transport.get(url, timeout=30)
             response.raise_for_status()
             data = BytesIO(response.content)
             df = pd.read_parquet(data)
@@ -79,8 +89,9 @@ class ONSHourlyGeneration:
             print("No URLs to fetch. Check your year/month selection.")
             return pd.DataFrame()
 
-        async with httpx.AsyncClient() as client:
-            tasks = [self._fetch_and_cache_data(client, url) for url in urls]
+        # The transport bounds how many files are downloaded at once, on one pooled client closed at the end
+        tasks = [self._fetch_and_cache_data(url) for url in urls]
+        async with self.transport.session():
             results = await asyncio.gather(*tasks)
         
         return pd.concat(results, ignore_index=True)
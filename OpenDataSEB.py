@@ -1,7 +1,7 @@
 import asyncio
-import httpx
 import pandas as pd
-import requests
+from typing import Optional
+from http_transport import HttpTransport, shared_transport
 
 
 class ElectricSectorOpenData:
@@ -9,11 +9,14 @@ class ElectricSectorOpenData:
     A class to fetch open data from the Brazilian Electric Sector.
     """
 
-    def __init__(self, institution: str):
+    def __init__(self, institution: str, transport: Optional[HttpTransport] = None):
         """
         Initializes the class with the desired institution: CCEE, ONS, or ANEEL.
         Sets the base URL (host) from where the data will be fetched.
+        Requests go through the given HttpTransport (default: the shared one), which pools the connections and
+        adapts the number of concurrent requests to the server.
         """
+        self.transport = transport or shared_transport()
         self.api_path = '/api/3/action/'  # Common CKAN API path used by all institutions
 
         # Sets the base host URL depending on the provided institution
@@ -31,7 +34,7 @@ class ElectricSectorOpenData:
         Returns a list of all available products (datasets) from the API.
         Each product represents a public dataset that can be queried.
         """
-        response = requests.get(self.host + self.api_path + "package_list")
+        response = self.transport.get_sync(self.host + self.api_path + "package_list")
         return response.json()
 
     def __get_resource_ids_by_product(self, product: str):
@@ -39,24 +42,24 @@ class ElectricSectorOpenData:
         Returns the IDs of the files (resources) related to a product.
         Each resource_id represents a table accessible via the API.
         """
-        response = requests.get(self.host + self.api_path + f"package_show?id={product}")
+        response = self.transport.get_sync(self.host + self.api_path + f"package_show?id={product}")
         return [item['id'] for item in response.json()['result']['resources'] if 'id' in item]
 
-    async def __fetch_offset(self, client, resource_id, offset, limit):
+    async def __fetch_offset(self, resource_id, offset, limit):
         """
         Asynchronous function that fetches a chunk (page) of data from a specific resource_id.
         It works with pagination (offset) and a maximum number of records (limit).
         """
         url = f"{self.host}{self.api_path}datastore_search?resource_id={resource_id}&limit={limit}&offset={offset}"
         try:
-            response = await client.get(url, timeout=30)  # Performs the request asynchronously
+            response = await self.transport.get(url, timeout=30)  # Performs the request asynchronously
             data = response.json()
             return data.get("result", {}).get("records", [])  # Returns only the data (records)
         except Exception as e:
             print(f"[{resource_id}] Offset {offset} failed: {e}")
             return []  # Returns an empty list in case of an error
 
-    async def __download_full_resource(self, client, resource_id, limit=10000):
+    async def __download_full_resource(self, resource_id, limit=10000):
         """
         Asynchronous function that downloads all data from a single resource_id, handling pagination.
         """
@@ -65,7 +68,7 @@ class ElectricSectorOpenData:
 
         # Loop that fetches page by page (10,000 records at a time)
         while True:
-            records = await self.__fetch_offset(client, resource_id, offset, limit)
+            records = await self.__fetch_offset(resource_id, offset, limit)
             if not records:
                 break  # Stops when there is no more data
             all_records.extend(records)  # Appends the new data
@@ -81,11 +84,11 @@ class ElectricSectorOpenData:
         print("Starting asynchronous download...")
         resource_ids = self.__get_resource_ids_by_product(product)  # Fetches the resource IDs
 
-        # Creates an asynchronous HTTP client
-        async with httpx.AsyncClient() as client:
-            # Creates a list of asynchronous tasks, one for each resource_id
-            tasks = [self.__download_full_resource(client, res_id) for res_id in resource_ids]
-            # Executes all tasks concurrently
+        # Creates a list of asynchronous tasks, one for each resource_id
+        tasks = [self.__download_full_resource(res_id) for res_id in resource_ids]
+        # Executes the tasks concurrently, as many at a time as the transport's limiter allows for the host,
+        # on one pooled client that is closed when the download ends
+        async with self.transport.session():
             results = await asyncio.gather(*tasks)
 
         # Flattens the list of lists into a single list of records
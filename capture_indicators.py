@@ -0,0 +1,543 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, Optional, Sequence, Tuple, Union
+import general_input
+from scenario_sketches import ScenarioRiskSketch
+
+
+class CaptureIndicators:
+
+    ASSET_LEVEL_KEYS = {
+        'plant': ['ceg'],
+        'state': ['id_estado', 'gen_technology'],
+    }
+
+    # def __init__(self, historical_data_processor_client, future_data_processor_client):
+    def __init__(self, historical_data_processor_client):
+        self.historical_data_processor = historical_data_processor_client
+        # self.future_data_processor = future_data_processor_client
+
+
+    def capture_prices_calculate(self,hourly_data_raw: pd.DataFrame, start_date: str = '2010-01-01', end_date: str = '2025-07-01'):
+
+        hourly_data = hourly_data_raw.query(
+                                        "@start_date <= date <= @end_date"
+                                        ).copy()
+
+        # Reduced (representative-day) data carries the number of days each hour stands for
+        weight = hourly_data['weight'] if 'weight' in hourly_data.columns else 1
+        
+        hourly_data["cap_pric_wind"] = hourly_data['wind_generation_MWh'] * hourly_data['Hourly_PLD'] * weight
+        wind_cap_prices = hourly_data['cap_pric_wind'].groupby(['submarket']).sum()/(hourly_data['wind_generation_MWh'] * weight).groupby(['submarket']).sum()
+
+
+        hourly_data["cap_pric_sol"] = hourly_data['solar_generation_MWh'] * hourly_data['Hourly_PLD'] * weight
+        solar_cap_prices = hourly_data['cap_pric_sol'].groupby(['submarket']).sum()/(hourly_data['solar_generation_MWh'] * weight).groupby(['submarket']).sum()
+
+        return wind_cap_prices, solar_cap_prices, hourly_data
+    
+
+    def capture_rate_calculate(self, hourly_data_raw: pd.DataFrame, start_date: str = '2010-01-01', end_date: str = '2025-07-01'):
+
+        wind_cap_prices, solar_cap_prices, hourly_data = self.capture_prices_calculate(hourly_data_raw, start_date, end_date)
+
+        if 'weight' in hourly_data.columns:
+            base_prices = (hourly_data['Hourly_PLD'] * hourly_data['weight']).groupby(['submarket']).sum()/hourly_data['weight'].groupby(['submarket']).sum()
+        else:
+            base_prices = hourly_data['Hourly_PLD'].groupby(['submarket']).mean()
+
+        solar_cap_rate = solar_cap_prices/base_prices
+        wind_cap_rate = wind_cap_prices/base_prices
+
+        return wind_cap_rate, solar_cap_rate, wind_cap_prices, solar_cap_prices
+    
+
+    def capture_partial_aggregates(self, hourly_data_raw: pd.DataFrame, start_date: str = '2010-01-01', end_date: str = '2025-07-01',
+                                   freq: Optional[str] = None) -> pd.DataFrame:
+        """
+        Additive partial aggregates behind capture_rate_calculate, per submarket: generation-weighted price sums
+        (wind_gp, solar_gp), generation sums (wind_g, solar_g), price sums (price_sum) and counts (count). Weights of
+        reduced data are applied as in capture_prices_calculate. Partials of disjoint windows are merged exactly by
+        summing them (merge_capture_aggregates). freq (e.g. 'M') also splits them by period, in a 'period' level.
+        """
+
+        hourly_data = hourly_data_raw.query("@start_date <= date <= @end_date")
+
+        weight = hourly_data['weight'] if 'weight' in hourly_data.columns else pd.Series(1.0, index=hourly_data.index)
+
+        partial = pd.DataFrame({
+            'wind_gp': hourly_data['wind_generation_MWh'] * hourly_data['Hourly_PLD'] * weight,
+            'wind_g': hourly_data['wind_generation_MWh'] * weight,
+            'solar_gp': hourly_data['solar_generation_MWh'] * hourly_data['Hourly_PLD'] * weight,
+            'solar_g': hourly_data['solar_generation_MWh'] * weight,
+            'price_sum': hourly_data['Hourly_PLD'] * weight,
+            'count': weight,
+        })
+
+        if freq is None:
+            partial = partial.groupby(['submarket']).sum()
+        else:
+            period = pd.DatetimeIndex(hourly_data.index.get_level_values('date')).to_period(freq).rename('period')
+            partial = partial.groupby([hourly_data.index.get_level_values('submarket'), period]).sum()
+
+        return partial
+
+
+    def merge_capture_aggregates(self, partials: List[pd.DataFrame]) -> Tuple[pd.Series, pd.Series, pd.Series, pd.Series]:
+        """
+        Merges partial aggregates of disjoint windows and returns (wind_cap_rate, solar_cap_rate, wind_cap_prices,
+        solar_cap_prices) as capture_rate_calculate would on the whole window.
+        """
+
+        totals = pd.concat(partials).groupby(level='submarket').sum()
+
+        wind_cap_prices = totals['wind_gp'] / totals['wind_g']
+        solar_cap_prices = totals['solar_gp'] / totals['solar_g']
+        base_prices = totals['price_sum'] / totals['count']
+
+        return wind_cap_prices / base_prices, solar_cap_prices / base_prices, wind_cap_prices, solar_cap_prices
+
+
+    def sharded_capture_rate_calculate(self, start_date: str = '2010-01-01', end_date: str = '2025-07-01',
+                                       workers: Optional[int] = None) -> Tuple[pd.Series, pd.Series, pd.Series, pd.Series]:
+        """
+        Runs the historical pipeline (generation download and processing, hourly_data_treatment and capture
+        aggregates) split by calendar year over a process pool of `workers` processes (default: all cores; 1 runs
+        in-process), and merges the per-year partial aggregates exactly. Each process holds one year of plant-hour
+        data at a time; the hourly PLD is downloaded once and each shard receives only its year.
+        """
+
+        start_date, end_date = pd.to_datetime(start_date), pd.to_datetime(end_date) # type: ignore
+
+        hourly_prices = self.historical_data_processor.historical_hourly_pld_processing()
+
+        shards = []
+        for year in range(start_date.year, end_date.year + 1):
+            shard_start = max(start_date, pd.Timestamp(year=year, month=1, day=1))
+            shard_end = min(end_date, pd.Timestamp(year=year + 1, month=1, day=1) - pd.Timedelta(1, 'ns'))
+            shard_prices = hourly_prices.loc[(hourly_prices.index >= shard_start) & (hourly_prices.index <= shard_end)]
+            shards.append((self.historical_data_processor, shard_prices, shard_start, shard_end))
+
+        if workers == 1:
+            partials = [_capture_shard(*shard) for shard in shards]
+
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                partials = list(executor.map(_capture_shard, *zip(*shards)))
+
+        partials = [partial for partial in partials if not partial.empty]
+
+        if not partials:
+            print("No capture aggregates were computed for the given dates. Returning empty Series.")
+            empty = pd.Series(dtype='float64')
+            return empty, empty, empty, empty
+
+        return self.merge_capture_aggregates(partials)
+
+
+    def penetration_sweep(self, hourly_data_raw: pd.DataFrame, wind_scales: Sequence[float], solar_scales: Sequence[float],
+                          start_date: str = '2010-01-01', end_date: str = '2025-07-01', price_response: bool = False,
+                          response_anchors: Optional[List[List[float]]] = None,
+                          response_penetrations: Optional[Sequence[float]] = None) -> pd.DataFrame:
+        """
+        Capture prices and rates for every (wind scale, solar scale) pair of the grid and every submarket.
+
+        hourly_data is factorized once into per-(submarket, hour of day) sums of wind and solar generation,
+        generation-weighted prices and prices, so each grid point only rescales 24 hourly terms.
+
+        The VRE penetration of each grid point is its share of the scaled generation mix:
+
+            (wind scale x wind + solar scale x solar) / (total + (wind scale - 1) x wind + (solar scale - 1) x solar)
+
+        i.e. the energy added (or removed) by the scales is added to the total generation as well, so the penetration
+        stays within [0, 1] and equals the observed share at scales (1, 1). It is NaN if hourly_data has no
+        total_generation_MWh column.
+
+        Without price_response (the default) the prices are the observed ones, and capture prices do not depend on the
+        scales. With price_response, which requires total_generation_MWh, the penetration of each grid point moves the PU price profile of the submarket along the
+        path observed profile -> response_anchors (default: duck and canyon curves), reached at the increasing
+        response_penetrations (default: general_input.PRICE_RESPONSE_PENETRATION); anchors at or below the observed
+        penetration are skipped. Prices at hour h are scaled by target profile[h] / observed profile[h].
+        """
+
+        if price_response and 'total_generation_MWh' not in hourly_data_raw.columns:
+            raise ValueError("price_response needs the total_generation_MWh column to compute the penetration.")
+
+        hourly_data = hourly_data_raw.query("@start_date <= date <= @end_date")
+
+        if hourly_data.empty:
+            print("Hourly data is empty in the given window. Returning an empty DataFrame.")
+            return pd.DataFrame()
+
+        weight = hourly_data['weight'].to_numpy(dtype='float64') if 'weight' in hourly_data.columns else np.ones(len(hourly_data))
+
+        submarket_codes, submarkets = pd.factorize(hourly_data.index.get_level_values('submarket'))
+        hours = pd.DatetimeIndex(hourly_data.index.get_level_values('date')).hour.to_numpy()
+        cells = submarket_codes * 24 + hours
+        n_cells = len(submarkets) * 24
+
+        def hourly_sum(values) -> np.ndarray:
+            return np.bincount(cells, weights=np.asarray(values, dtype='float64') * weight, minlength=n_cells).reshape(-1, 24)
+
+        price = hourly_data['Hourly_PLD'].to_numpy(dtype='float64')
+        wind = hourly_data['wind_generation_MWh'].to_numpy(dtype='float64')
+        solar = hourly_data['solar_generation_MWh'].to_numpy(dtype='float64')
+
+        wind_gp, wind_g = hourly_sum(wind * price), hourly_sum(wind)     # [submarket, hour]
+        solar_gp, solar_g = hourly_sum(solar * price), hourly_sum(solar)
+        price_sum, count = hourly_sum(price), hourly_sum(np.ones(len(price)))
+
+        wind_scale, solar_scale = np.meshgrid(np.asarray(wind_scales, dtype='float64'), np.asarray(solar_scales, dtype='float64'), indexing='ij')
+        wind_scale, solar_scale = wind_scale.ravel(), solar_scale.ravel()     # [grid]
+
+        total = hourly_sum(hourly_data['total_generation_MWh']).sum(axis=1) if 'total_generation_MWh' in hourly_data.columns else np.full(len(submarkets), np.nan)
+
+        wind_total, solar_total = wind_g.sum(axis=1), solar_g.sum(axis=1)
+        scaled_vre = wind_scale[:, None] * wind_total + solar_scale[:, None] * solar_total     # [grid, submarket]
+        scaled_total = total + (wind_scale[:, None] - 1) * wind_total + (solar_scale[:, None] - 1) * solar_total
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            penetration = scaled_vre / scaled_total
+
+        response = np.ones((len(wind_scale), len(submarkets), 24))
+
+        if price_response:
+            anchors = np.asarray(response_anchors if response_anchors is not None
+                                 else [general_input.duck_curve_scenario, general_input.canyon_curve_scenario], dtype='float64')
+            knots = np.asarray(response_penetrations if response_penetrations is not None
+                               else general_input.PRICE_RESPONSE_PENETRATION, dtype='float64')
+
+            with np.errstate(invalid='ignore', divide='ignore'):
+                observed_profile = price_sum / count
+                observed_profile = observed_profile / np.nanmean(observed_profile, axis=1, keepdims=True)
+                observed_penetration = (wind_total + solar_total) / total
+
+            for s in range(len(submarkets)):
+                if not np.isfinite(observed_penetration[s]) or not np.isfinite(observed_profile[s]).all():
+                    print(f"No total generation or complete prices for submarket {submarkets[s]}. Skipping its price response.")
+                    continue
+
+                # Piecewise-linear path observed profile -> anchors not yet reached by the observed penetration
+                ahead = knots > observed_penetration[s]
+
+                if not ahead.any():
+                    continue
+
+                path = np.vstack([observed_profile[s], anchors[ahead]])
+                path_knots = np.concatenate([[observed_penetration[s]], knots[ahead]])
+
+                position = np.clip(penetration[:, s], path_knots[0], path_knots[-1])
+                segment = np.clip(np.searchsorted(path_knots, position, side='right') - 1, 0, len(path_knots) - 2)
+                span = path_knots[segment + 1] - path_knots[segment]
+                step = np.divide(position - path_knots[segment], span, out=np.zeros_like(position), where=span > 0)
+
+                target_profile = (1 - step)[:, None] * path[segment] + step[:, None] * path[segment + 1]
+                response[:, s, :] = target_profile / observed_profile[s]
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            base_prices = (response * price_sum).sum(axis=2) / count.sum(axis=1)
+            wind_cap_prices = (response * wind_gp).sum(axis=2) / wind_g.sum(axis=1)
+            solar_cap_prices = (response * solar_gp).sum(axis=2) / solar_g.sum(axis=1)
+
+        index = pd.MultiIndex.from_arrays([
+            np.repeat(wind_scale, len(submarkets)),
+            np.repeat(solar_scale, len(submarkets)),
+            np.tile(np.asarray(submarkets), len(wind_scale)),
+        ], names=['wind_scale', 'solar_scale', 'submarket'])
+
+        sweep = pd.DataFrame({
+            'penetration': penetration.ravel(),
+            'base_price': base_prices.ravel(),
+            'wind_cap_price': wind_cap_prices.ravel(),
+            'solar_cap_price': solar_cap_prices.ravel(),
+            'wind_cap_rate': (wind_cap_prices / base_prices).ravel(),
+            'solar_cap_rate': (solar_cap_prices / base_prices).ravel(),
+        }, index=index)
+
+        return sweep
+
+
+    @staticmethod
+    def _asset_partials(generation: pd.DataFrame, keys: List[str], attributes: List[str], price_matrix: np.ndarray,
+                        price_submarkets: pd.Index, first_hour: pd.Timestamp) -> pd.DataFrame:
+        """Additive capture sums per asset of one frame of generation rows (see asset_capture_rate_calculate)."""
+
+        # Align every generation row with the PLD of its submarket and hour
+        submarket_codes = price_submarkets.get_indexer(generation['submarket'])
+        hours = ((generation.index - first_hour) // pd.Timedelta(hours=1)).to_numpy()
+        aligned = (submarket_codes >= 0) & (hours >= 0) & (hours < len(price_matrix))
+
+        hourly_price = np.full(len(generation), np.nan)
+        hourly_price[aligned] = price_matrix[hours[aligned], submarket_codes[aligned]]
+
+        energy = pd.to_numeric(generation['generation_MWh'], errors='coerce').to_numpy(dtype='float64')
+        valid = ~np.isnan(hourly_price) & ~np.isnan(energy)
+
+        # Integer-coded asset keys
+        key_codes, key_uniques = zip(*(pd.factorize(generation[key], use_na_sentinel=False) for key in keys))
+        combined, codes = np.unique(np.ravel_multi_index(key_codes, [len(uniques) for uniques in key_uniques]), return_inverse=True)
+        n_assets = len(combined)
+
+        assets = pd.MultiIndex.from_arrays(
+            [np.asarray(uniques.take(level_codes), dtype=object) for uniques, level_codes in
+             zip(key_uniques, np.unravel_index(combined, [len(uniques) for uniques in key_uniques]))],
+            names=keys
+        )
+
+        asset_submarket = np.full(n_assets, -1)
+        asset_submarket[codes[aligned]] = submarket_codes[aligned]
+
+        partials = pd.DataFrame({
+            'energy_price': np.bincount(codes[valid], weights=energy[valid] * hourly_price[valid], minlength=n_assets),
+            'generation_MWh': np.bincount(codes[valid], weights=energy[valid], minlength=n_assets),
+            'hours': np.bincount(codes[valid], minlength=n_assets),
+            'submarket_code': asset_submarket,
+        }, index=assets)
+
+        # Descriptive attributes of each asset (last value seen)
+        for column in attributes:
+            attribute = np.empty(n_assets, dtype=object)
+            attribute[codes] = generation[column].to_numpy(dtype=object)
+            partials[column] = attribute
+
+        return partials
+
+    def asset_capture_rate_calculate(self, hourly_generation: Union[pd.DataFrame, Iterable[pd.DataFrame]], hourly_prices: pd.DataFrame,
+                                     level: str = 'plant', start_date: str = '2010-01-01', end_date: str = '2025-07-01') -> pd.DataFrame:
+        """
+        Capture prices and rates per plant (level='plant', keyed by ceg) or per state and technology (level='state').
+
+        hourly_generation is the plant-hour frame of HistoricalDataProcessor.historical_hourly_generation_processing
+        with keep_plant_keys=True, or the iterator of monthly frames it returns with lazy=True, and hourly_prices the
+        frame of historical_hourly_pld_processing. Keys are integer-coded, every generation row is aligned with the PLD
+        of its submarket and hour through a dense (hour x submarket) price matrix, and the weighted sums are
+        scatter-added with np.bincount, so all plants of a frame are evaluated in one pass and the additive sums of
+        successive frames are merged. The base price is the average PLD of the asset's submarket over the window.
+        """
+
+        if level not in self.ASSET_LEVEL_KEYS:
+            raise ValueError(f"Level {level} not found! Use 'plant' or 'state'.")
+
+        start_date, end_date = pd.to_datetime(start_date), pd.to_datetime(end_date) # type: ignore
+
+        prices = hourly_prices.loc[(hourly_prices.index >= start_date) & (hourly_prices.index <= end_date)]
+        frames = [hourly_generation] if isinstance(hourly_generation, pd.DataFrame) else hourly_generation
+
+        if prices.empty:
+            print("Hourly prices are empty in the given window. Returning an empty DataFrame.")
+            return pd.DataFrame()
+
+        # Dense (hour x submarket) PLD matrix, NaN where the price is missing
+        price_submarkets = pd.Index(prices['submarket'].unique())
+        price_submarket_codes = price_submarkets.get_indexer(prices['submarket'])
+        first_hour = prices.index.min().floor('h')
+        price_hours = ((prices.index - first_hour) // pd.Timedelta(hours=1)).to_numpy()
+
+        price_matrix = np.full((price_hours.max() + 1, len(price_submarkets)), np.nan)
+        price_matrix[price_hours, price_submarket_codes] = prices['Hourly_PLD'].to_numpy(dtype='float64')
+
+        base_prices = np.nanmean(price_matrix, axis=0)
+
+        keys = self.ASSET_LEVEL_KEYS[level]
+        partials = []
+
+        for generation in frames:
+            generation = generation.loc[(generation.index >= start_date) & (generation.index <= end_date)]
+
+            if generation.empty:
+                continue
+
+            attributes = [column for column in ['nom_usina', 'id_estado', 'gen_technology'] if column in generation.columns] if level == 'plant' else []
+            partials.append(self._asset_partials(generation, keys, attributes, price_matrix, price_submarkets, first_hour))
+
+        if not partials:
+            print("Hourly generation is empty in the given window. Returning an empty DataFrame.")
+            return pd.DataFrame()
+
+        attributes = [column for column in partials[-1].columns if column not in ['energy_price', 'generation_MWh', 'hours', 'submarket_code']]
+        aggregation = dict({'energy_price': 'sum', 'generation_MWh': 'sum', 'hours': 'sum', 'submarket_code': 'max'},
+                           **{column: 'last' for column in attributes})
+        totals = pd.concat(partials).groupby(level=keys, sort=False).agg(aggregation) if len(partials) > 1 else partials[0]
+
+        asset_submarket = totals['submarket_code'].to_numpy()
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            capture_prices = totals['energy_price'].to_numpy() / totals['generation_MWh'].to_numpy()
+            base_price = np.where(asset_submarket >= 0, base_prices[asset_submarket], np.nan)
+
+        capture = pd.DataFrame({
+            'submarket': np.where(asset_submarket >= 0, np.asarray(price_submarkets)[asset_submarket], None),
+            'generation_MWh': totals['generation_MWh'].to_numpy(),
+            'hours': totals['hours'].to_numpy(),
+            'capture_price': capture_prices,
+            'base_price': base_price,
+            'capture_rate': capture_prices / base_price,
+        }, index=totals.index if len(keys) > 1 else totals.index.get_level_values(0))
+
+        for position, column in enumerate(attributes):
+            capture.insert(position, column, totals[column].to_numpy())
+
+        return capture.sort_index()
+
+
+    def representative_days_error_report(self, hourly_data: pd.DataFrame, reduced_hourly_data: pd.DataFrame,
+                                         start_date: str = '2010-01-01', end_date: str = '2025-07-01') -> pd.DataFrame:
+        """
+        Compares capture prices and rates computed on the representative days (EnergyAnalysisService.reduce_hourly_data)
+        against the full-resolution result between start_date and end_date, per submarket. The representative days
+        stand for the window they were selected from, so they are taken whole (from their first to their last hour).
+        """
+
+        indicators = ['wind_cap_rate', 'solar_cap_rate', 'wind_cap_price', 'solar_cap_price']
+
+        reduced_dates = pd.DatetimeIndex(reduced_hourly_data.index.get_level_values('date'))
+
+        full = pd.DataFrame(dict(zip(indicators, self.capture_rate_calculate(hourly_data, start_date, end_date))))
+        reduced = pd.DataFrame(dict(zip(indicators, self.capture_rate_calculate(reduced_hourly_data, reduced_dates.min(), reduced_dates.max())))) # type: ignore
+
+        report = pd.concat({'full': full, 'reduced': reduced, 'relative_error': (reduced - full) / full}, axis=1)
+
+        return report
+
+
+    def future_capture_prices_calculate(self, future_hourly_re_gen: pd.DataFrame,
+                                        future_prices: Union[pd.DataFrame, Iterable[pd.DataFrame]],
+                                        sketch: Optional[ScenarioRiskSketch] = None,
+                                        freq: Union[str, Sequence[str]] = 'M') -> ScenarioRiskSketch:
+        """
+        Streams the price scenarios into a ScenarioRiskSketch keyed by (metric, submarket, period) and returns it.
+        Periods follow freq ('M' months, 'Q' quarters, 'Y' years, or several of them in the same pass).
+
+        future_hourly_re_gen is the (date, submarket) frame of EnergyAnalysisService.calculate_final_monthly_generation
+        and future_prices one frame or the lazy iterator of frames of consolidate_future_price_scenarios. For every
+        (scenario_nw, simulated_scenario) pair and period, the base price, the wind and solar capture prices and rates
+        are one sample of their distribution; every hourly price is a sample of 'hourly_price'. NEWAVE submarkets are
+        matched to the generation through general_input.NEWAVE_RE_SUBMARKET_MAP; frames without a submarket column (legacy
+        price_scenario_*.parquet layout) are of general_input.LEGACY_PRICE_SCENARIO_SUBMARKET.
+
+        Each (scenario_nw, simulated_scenario) of a submarket must come whole in one frame, as the frames of
+        consolidate_future_price_scenarios do (one per scenario_nw); a scenario_nw seen again in a later frame raises,
+        since its partial periods would be counted as separate samples. consolidate_future_price_scenarios reads only
+        day 1 of each month by default: pass days=None to it for capture prices over whole months.
+
+        Memory depends on the number of (metric, submarket, period) keys only. Sketches of different scenario files or
+        workers are combined with ScenarioRiskSketch.merge, or by passing an existing sketch to update.
+        """
+
+        sketch = sketch if sketch is not None else ScenarioRiskSketch()
+        frames = [future_prices] if isinstance(future_prices, pd.DataFrame) else future_prices
+        freqs = [freq] if isinstance(freq, str) else list(freq)
+
+        generation_submarkets = future_hourly_re_gen.index.get_level_values('submarket')
+
+        # Frames of the same submarket share their dates, so the alignment with the generation is computed once
+        alignment = {}
+        seen_scenarios = {}
+
+        for frame in frames:
+            if 'submarket' not in frame.columns:
+                frame = frame.assign(submarket=general_input.LEGACY_PRICE_SCENARIO_SUBMARKET)
+
+            for submarket, prices in frame.groupby('submarket', sort=False):
+                scenarios = set(np.unique(prices['scenario_nw'].to_numpy()).tolist())
+                seen = seen_scenarios.setdefault(submarket, set())
+
+                if seen & scenarios:
+                    raise ValueError(f"scenario_nw {sorted(seen & scenarios)[:5]} of submarket {submarket} split across frames. "
+                                     "Pass frames holding whole scenarios (e.g. consolidate_future_price_scenarios(lazy=True)).")
+                seen |= scenarios
+
+                dates = prices.index.to_numpy()
+                cached = alignment.get(submarket)
+
+                if cached is None or not np.array_equal(cached['dates'], dates):
+                    re_submarket = general_input.NEWAVE_RE_SUBMARKET_MAP.get(submarket, submarket)
+                    generation = future_hourly_re_gen.loc[generation_submarkets == re_submarket].droplevel('submarket')
+
+                    if generation.empty:
+                        print(f"No future RE generation for submarket {submarket}. Skipping its capture prices.")
+
+                    position = generation.index.get_indexer(dates)
+                    aligned = position >= 0
+
+                    periods = {}
+                    for period_freq in freqs:
+                        period_codes, period_index = pd.factorize(pd.DatetimeIndex(dates).to_period(period_freq), sort=True)
+                        periods[period_freq] = (period_codes, period_index.astype(str))
+
+                    cached = alignment[submarket] = {
+                        'dates': dates,
+                        'wind': np.where(aligned, generation['wind_generation_MWh'].to_numpy(dtype='float64')[position], np.nan),
+                        'solar': np.where(aligned, generation['solar_generation_MWh'].to_numpy(dtype='float64')[position], np.nan),
+                        'periods': periods,
+                    }
+
+                wind, solar = cached['wind'], cached['solar']
+                price = prices['hourly_price'].to_numpy(dtype='float64')
+
+                sample_codes, _ = pd.factorize(prices['scenario_nw'].to_numpy().astype('int64') * 1_000_000
+                                               + prices['simulated_scenario'].to_numpy().astype('int64'))
+
+                for period_codes, period_labels in cached['periods'].values():
+                    n_periods = len(period_labels)
+                    n_cells = (sample_codes.max() + 1) * n_periods
+                    cells = sample_codes * n_periods + period_codes
+
+                    def cell_sum(values) -> np.ndarray:
+                        values = np.asarray(values, dtype='float64')
+                        known = ~np.isnan(values)
+                        return np.bincount(cells[known], weights=values[known], minlength=n_cells)
+
+                    with np.errstate(invalid='ignore', divide='ignore'):
+                        base_price = cell_sum(price) / np.bincount(cells, minlength=n_cells)
+                        wind_cap_price = cell_sum(wind * price) / cell_sum(wind)
+                        solar_cap_price = cell_sum(solar * price) / cell_sum(solar)
+
+                    metrics = {
+                        'base_price': base_price,
+                        'wind_cap_price': wind_cap_price,
+                        'solar_cap_price': solar_cap_price,
+                        'wind_cap_rate': wind_cap_price / base_price,
+                        'solar_cap_rate': solar_cap_price / base_price,
+                    }
+
+                    cell_period = np.tile(np.arange(n_periods), n_cells // n_periods)
+
+                    sketch.update([('hourly_price', submarket, period) for period in period_labels], period_codes, price)
+
+                    for metric, values in metrics.items():
+                        sketch.update([(metric, submarket, period) for period in period_labels], cell_period, values)
+
+        return sketch
+
+    def future_capture_rate_calculate(self, future_hourly_re_gen: pd.DataFrame,
+                                      future_prices: Union[pd.DataFrame, Iterable[pd.DataFrame]],
+                                      quantiles: Sequence[float] = (0.05, 0.5, 0.95), alpha: float = 0.05) -> pd.DataFrame:
+        """
+        Distribution of future prices, capture prices and capture rates per metric, submarket and month (count, mean,
+        std, min, max, quantiles P5/P50/P95 and lower/upper tail means at level alpha), computed in constant memory by
+        future_capture_prices_calculate.
+        """
+
+        sketch = self.future_capture_prices_calculate(future_hourly_re_gen, future_prices)
+
+        if not sketch.keys:
+            print("No price scenarios were summarized. Returning an empty DataFrame.")
+            return pd.DataFrame()
+
+        return sketch.to_frame(quantiles=quantiles, alpha=alpha)
+
+
+def _capture_shard(historical_data_processor, hourly_prices: pd.DataFrame, start_date, end_date) -> pd.DataFrame:
+    """Worker of CaptureIndicators.sharded_capture_rate_calculate: runs the pipeline on one shard and returns its partial aggregates."""
+
+    hourly_generation = historical_data_processor.historical_hourly_generation_processing(start_date=start_date, end_date=end_date)
+
+    treated = historical_data_processor.hourly_data_treatment(hourly_generation, hourly_prices)
+
+    if not isinstance(treated, tuple) or treated[2].empty:
+        print(f"Shard {start_date} - {end_date} returned no hourly data.")
+        return pd.DataFrame()
+
+    return CaptureIndicators(historical_data_processor).capture_partial_aggregates(treated[2], start_date, end_date)
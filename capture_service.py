@@ -0,0 +1,367 @@
+import json
+import threading
+import numpy as np
+import pandas as pd
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence, Tuple, Union
+from urllib.parse import parse_qs, urlparse
+import general_input
+from capture_indicators import CaptureIndicators
+from historical_data import HistoricalDataProcessor
+from shape_analisys import EnergyAnalysisService
+
+
+class CaptureQueryService:
+    """
+    Long-running query service over the historical and scenario data.
+
+    The processed hourly data is loaded once and reduced to additive monthly aggregates: the capture partials of
+    CaptureIndicators.capture_partial_aggregates per (submarket, month) and the sums and counts of every series per
+    (submarket, month, hour). Capture prices/rates and hourly shapes of any range of whole months are then sums over a
+    few rows. Future distributions come from a ScenarioRiskSketch built once from the price scenarios. Results are
+    kept in an LRU cache keyed on the data generation, which is bumped (and the cache cleared) whenever new data is
+    loaded, so a query computed on the old data and stored after a reload is never served again.
+    """
+
+    SERIES = ['Hourly_PLD', 'total_generation_MWh', 'wind_generation_MWh', 'solar_generation_MWh']
+    SCENARIO_FREQS = ('M', 'Q', 'Y')
+
+    def __init__(self, historical_data_processor: HistoricalDataProcessor, analysis_service: EnergyAnalysisService,
+                 capture_indicators: Optional[CaptureIndicators] = None, cache_size: int = 1024,
+                 quantiles: Sequence[float] = (0.05, 0.1, 0.5, 0.9, 0.95), alpha: float = 0.05):
+        """
+        Args:
+            cache_size (int): Number of query results kept in the LRU cache.
+            quantiles (list): Quantiles reported by scenario queries.
+            alpha (float): Tail level of the scenario CVaR and tail means.
+        """
+        self.historical_data_processor = historical_data_processor
+        self.analysis_service = analysis_service
+        self.capture_indicators = capture_indicators or CaptureIndicators(historical_data_processor)
+        self.quantiles = tuple(quantiles)
+        self.alpha = alpha
+
+        self.capture_aggregates = pd.DataFrame()
+        self.hourly_sums = pd.DataFrame()
+        self.scenario_summary = pd.DataFrame()
+        self.loaded_until: Optional[pd.Timestamp] = None
+
+        self._lock = threading.RLock()
+        self._generation = 0
+        self._cached_query = lru_cache(maxsize=cache_size)(self._query)
+
+    # Loading
+
+    def _aggregate(self, hourly_data: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """Reduces hourly data to the monthly capture partials and the (submarket, month, hour) sums and counts."""
+        capture = self.capture_indicators.capture_partial_aggregates(hourly_data, '1900-01-01', '2100-01-01', freq='M')
+
+        dates = pd.DatetimeIndex(hourly_data.index.get_level_values('date'))
+        keys = [hourly_data.index.get_level_values('submarket'), dates.to_period('M').rename('period'), dates.hour.rename('hour')]
+
+        series = hourly_data[[column for column in self.SERIES if column in hourly_data.columns]]
+        grouped = series.groupby(keys)
+        hourly_sums = pd.concat({'sum': grouped.sum(), 'count': grouped.count()}, axis=1)
+
+        return capture, hourly_sums
+
+    def load(self, start_date: str = '2010-01-01', end_date: str = '2025-07-01') -> None:
+        """Loads the historical data between start_date and end_date and builds the aggregates."""
+        hourly_data = self._historical_hourly_data(start_date, end_date)
+
+        if hourly_data.empty:
+            print("No historical hourly data was loaded.")
+            return
+
+        capture, hourly_sums = self._aggregate(hourly_data)
+
+        with self._lock:
+            self.capture_aggregates, self.hourly_sums = capture.sort_index(), hourly_sums.sort_index()
+            self.loaded_until = pd.DatetimeIndex(hourly_data.index.get_level_values('date')).max()
+            self._data_changed()
+
+    def reload(self, end_date: Optional[str] = None) -> int:
+        """
+        Incremental reload: processes only the data after the last loaded hour up to end_date (default: now), replaces
+        the months it touches in the aggregates and clears the result cache. Returns the number of new hourly rows.
+        """
+        if self.loaded_until is None:
+            print("Nothing loaded yet. Use load first.")
+            return 0
+
+        start_date = self.loaded_until.to_period('M').to_timestamp()  # Reprocess the last, possibly partial, month
+        end_date = pd.Timestamp(end_date) if end_date is not None else pd.Timestamp.now().floor('h')
+
+        if end_date <= self.loaded_until:
+            return 0
+
+        hourly_data = self._historical_hourly_data(str(start_date), str(end_date))
+
+        if hourly_data.empty:
+            return 0
+
+        new_rows = int((pd.DatetimeIndex(hourly_data.index.get_level_values('date')) > self.loaded_until).sum())
+        capture, hourly_sums = self._aggregate(hourly_data)
+
+        with self._lock:
+            months = capture.index.get_level_values('period').unique()
+
+            kept_capture = self.capture_aggregates.loc[~self.capture_aggregates.index.get_level_values('period').isin(months)]
+            kept_sums = self.hourly_sums.loc[~self.hourly_sums.index.get_level_values('period').isin(months)]
+
+            self.capture_aggregates = pd.concat([kept_capture, capture]).sort_index()
+            self.hourly_sums = pd.concat([kept_sums, hourly_sums]).sort_index()
+            self.loaded_until = max(self.loaded_until, pd.DatetimeIndex(hourly_data.index.get_level_values('date')).max())
+            self._data_changed()
+
+        return new_rows
+
+    def _historical_hourly_data(self, start_date: str, end_date: str) -> pd.DataFrame:
+        processor = self.historical_data_processor
+
+        hourly_prices = processor.historical_hourly_pld_processing()
+        hourly_generation = processor.historical_hourly_generation_processing(start_date=start_date, end_date=end_date)
+        treated = processor.hourly_data_treatment(hourly_generation, hourly_prices)
+
+        if not isinstance(treated, tuple):
+            return pd.DataFrame()
+
+        return treated[2]
+
+    def load_scenarios(self, path_scenarios: Union[str, Path] = general_input.price_factors_path,
+                       future_hourly_re_gen: Optional[pd.DataFrame] = None,
+                       shape_start_date: str = '2024-01-01', shape_end_date: str = '2024-12-31') -> None:
+        """
+        Builds the future price and capture distributions (per metric, submarket and month, quarter and year) from the
+        price scenarios in path_scenarios. The future RE generation defaults to
+        EnergyAnalysisService.calculate_final_monthly_generation with shapes of the given historical window.
+        """
+        if future_hourly_re_gen is None:
+            future_hourly_re_gen = self.analysis_service.calculate_final_monthly_generation(
+                solar_shape=pd.DataFrame(), wind_shape=pd.DataFrame(), start_date=shape_start_date, end_date=shape_end_date
+            )
+
+        frames = self.analysis_service.consolidate_future_price_scenarios(path_scenarios, days=None, lazy=True)
+        sketch = self.capture_indicators.future_capture_prices_calculate(future_hourly_re_gen, frames, freq=self.SCENARIO_FREQS) # type: ignore
+
+        summary = sketch.to_frame(key_names=('metric', 'submarket', 'period'), quantiles=self.quantiles, alpha=self.alpha)
+
+        with self._lock:
+            self.scenario_summary = summary
+            self._data_changed()
+
+    def _data_changed(self) -> None:
+        """Moves to a new data generation (called under the lock), so results of the previous one are never served."""
+        self._generation += 1
+        self._cached_query.cache_clear()
+
+    # Queries
+
+    @staticmethod
+    def _period_window(start_date: Optional[str], end_date: Optional[str]) -> Tuple[Optional[pd.Period], Optional[pd.Period]]:
+        start = pd.Period(start_date, freq='M') if start_date else None
+        end = pd.Period(end_date, freq='M') if end_date else None
+        return start, end
+
+    @staticmethod
+    def _window_mask(periods: pd.PeriodIndex, start: Optional[pd.Period], end: Optional[pd.Period]) -> np.ndarray:
+        mask = np.ones(len(periods), dtype=bool)
+        if start is not None:
+            mask &= np.asarray(periods >= start)
+        if end is not None:
+            mask &= np.asarray(periods <= end)
+        return mask
+
+    def capture(self, submarket: Optional[str] = None, start_date: Optional[str] = None, end_date: Optional[str] = None) -> Dict[str, Any]:
+        """Historical wind/solar capture prices and rates and base price per submarket over whole months."""
+        return self._cached('capture', (submarket, start_date, end_date))
+
+    def shape(self, series: str = 'Hourly_PLD', submarket: Optional[str] = None,
+              start_date: Optional[str] = None, end_date: Optional[str] = None) -> Dict[str, Any]:
+        """Average hourly values and PU shape (hourly average / overall average) of a series over whole months."""
+        return self._cached('shape', (series, submarket, start_date, end_date))
+
+    def scenarios(self, metric: str = 'wind_cap_price', submarket: Optional[str] = None, period: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Distribution of a future metric (hourly_price, base_price, wind/solar_cap_price, wind/solar_cap_rate) per
+        submarket and period (e.g. '2027-03', '2027Q3', '2027'; all periods if None).
+        """
+        return self._cached('scenarios', (metric, submarket, period))
+
+    def _cached(self, kind: str, arguments: Tuple) -> Dict[str, Any]:
+        with self._lock:
+            generation = self._generation
+
+        return self._cached_query(kind, arguments, generation)
+
+    def _query(self, kind: str, arguments: Tuple, generation: int) -> Dict[str, Any]:
+        """
+        Computes a query on the current data (generation is only part of the cache key). Only the snapshot of the
+        frames is taken under the lock: loads swap in new frames instead of changing them in place, so queries run
+        concurrently on the snapshot.
+        """
+        with self._lock:
+            capture_aggregates, hourly_sums, scenario_summary = self.capture_aggregates, self.hourly_sums, self.scenario_summary
+
+        if kind == 'capture':
+            return self._capture(capture_aggregates, *arguments)
+        if kind == 'shape':
+            return self._shape(hourly_sums, *arguments)
+        if kind == 'scenarios':
+            return self._scenarios(scenario_summary, *arguments)
+
+        raise ValueError(f"Query {kind} not found!")
+
+    def _capture(self, aggregates: pd.DataFrame, submarket: Optional[str], start_date: Optional[str],
+                 end_date: Optional[str]) -> Dict[str, Any]:
+
+        if submarket is not None:
+            aggregates = aggregates.loc[aggregates.index.get_level_values('submarket') == submarket]
+
+        start, end = self._period_window(start_date, end_date)
+        aggregates = aggregates.loc[self._window_mask(aggregates.index.get_level_values('period'), start, end)] # type: ignore
+
+        if aggregates.empty:
+            return {}
+
+        wind_cap_rate, solar_cap_rate, wind_cap_prices, solar_cap_prices = self.capture_indicators.merge_capture_aggregates([aggregates])
+        totals = aggregates.groupby(level='submarket').sum()
+
+        result = pd.DataFrame({
+            'base_price': totals['price_sum'] / totals['count'],
+            'wind_cap_price': wind_cap_prices,
+            'solar_cap_price': solar_cap_prices,
+            'wind_cap_rate': wind_cap_rate,
+            'solar_cap_rate': solar_cap_rate,
+        })
+
+        return _records(result)
+
+    def _shape(self, hourly_sums: pd.DataFrame, series: str, submarket: Optional[str], start_date: Optional[str],
+               end_date: Optional[str]) -> Dict[str, Any]:
+        if series not in hourly_sums.columns.get_level_values(1):
+            raise ValueError(f"Series {series} not found!")
+
+        sums = hourly_sums.xs(series, axis=1, level=1)
+
+        if submarket is not None:
+            sums = sums.loc[sums.index.get_level_values('submarket') == submarket]
+
+        start, end = self._period_window(start_date, end_date)
+        sums = sums.loc[self._window_mask(sums.index.get_level_values('period'), start, end)] # type: ignore
+
+        if sums.empty:
+            return {}
+
+        hourly = sums.groupby(level=['submarket', 'hour']).sum()
+        average = (hourly['sum'] / hourly['count']).unstack('hour')
+        shape = average.div(average.mean(axis=1), axis=0)
+
+        return {submarket_name: {'average': _values(average.loc[submarket_name]), 'shape': _values(shape.loc[submarket_name])}
+                for submarket_name in average.index}
+
+    def _scenarios(self, summary: pd.DataFrame, metric: str, submarket: Optional[str], period: Optional[str]) -> Dict[str, Any]:
+        if summary.empty:
+            return {}
+
+        summary = summary.xs(metric, level='metric') if metric in summary.index.get_level_values('metric') else summary.iloc[0:0]
+
+        if submarket is not None:
+            summary = summary.loc[summary.index.get_level_values('submarket') == submarket]
+        if period is not None:
+            summary = summary.loc[summary.index.get_level_values('period') == str(pd.Period(period, freq=_period_freq(period)))]
+
+        return {f"{sub}|{per}": _values(row) for (sub, per), row in summary.iterrows()}
+
+
+def _period_freq(period: str) -> str:
+    """Frequency of a period label: '2027' -> 'Y', '2027Q3' -> 'Q', otherwise 'M'."""
+    if 'Q' in period.upper():
+        return 'Q'
+    return 'Y' if len(period) == 4 else 'M'
+
+
+def _values(series: pd.Series) -> Dict[str, Optional[float]]:
+    return {str(key): (None if pd.isna(value) else float(value)) for key, value in series.items()}
+
+
+def _records(frame: pd.DataFrame) -> Dict[str, Any]:
+    return {str(index): _values(row) for index, row in frame.iterrows()}
+
+
+def serve(service: CaptureQueryService, host: str = '127.0.0.1', port: int = 8050) -> ThreadingHTTPServer:
+    """
+    Serves the queries as JSON over HTTP (GET /capture, /shape, /scenarios with the query methods' arguments as
+    query-string parameters; POST /reload?end_date=...; GET /health). Returns the server; call serve_forever on it.
+    """
+
+    class CaptureQueryHandler(BaseHTTPRequestHandler):
+
+        def _send(self, status: int, payload: Any) -> None:
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _arguments(self) -> Tuple[str, Dict[str, str]]:
+            url = urlparse(self.path)
+            return url.path.strip('/'), {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        def do_GET(self):
+            route, arguments = self._arguments()
+
+            try:
+                if route == 'health':
+                    self._send(200, {'loaded_until': str(service.loaded_until), 'scenarios': not service.scenario_summary.empty})
+                elif route in ('capture', 'shape', 'scenarios'):
+                    self._send(200, getattr(service, route)(**arguments))
+                else:
+                    self._send(404, {'error': f"Route {route} not found"})
+            except (TypeError, ValueError, KeyError) as e:
+                self._send(400, {'error': str(e)})
+            except Exception as e:
+                self._send(500, {'error': f"{type(e).__name__}: {e}"})
+
+        def do_POST(self):
+            route, arguments = self._arguments()
+
+            if route != 'reload':
+                self._send(404, {'error': f"Route {route} not found"})
+                return
+
+            try:
+                self._send(200, {'new_rows': service.reload(**arguments), 'loaded_until': str(service.loaded_until)})
+            except (TypeError, ValueError) as e:
+                self._send(400, {'error': str(e)})
+            except Exception as e:
+                self._send(500, {'error': f"{type(e).__name__}: {e}"})
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), CaptureQueryHandler)
+
+
+if __name__ == "__main__":
+
+    from OpenDataSEB import ElectricSectorOpenData
+    from ONS_Hourly_Generation import ONSHourlyGeneration
+    from NEWAVE_Outputs_Data import NewaveDataProcessor
+
+    historical_data_processor = HistoricalDataProcessor(ElectricSectorOpenData("ccee"), ElectricSectorOpenData("ons"), ONSHourlyGeneration())
+    newave_processor = NewaveDataProcessor(newave_csv_path=general_input.newave_csv, re_excel_path=general_input.re_excel)
+    analysis_service = EnergyAnalysisService(historical_data_processor=historical_data_processor, newave_processor=newave_processor)
+
+    service = CaptureQueryService(historical_data_processor, analysis_service)
+    service.load()
+
+    if Path(general_input.price_factors_path).exists():
+        service.load_scenarios()
+
+    server = serve(service)
+    print(f"Serving capture queries on http://{server.server_address[0]}:{server.server_address[1]}")
+    server.serve_forever()
@@ -8,6 +8,10 @@ average_scenario_full = [1.1105875161947654, 0.9704884329087026, 0.9618176207875
                             0.9404274468830461, 0.9346605534368068, 0.9429359913986054, 0.9536265905416006, 0.9591119411716951, 0.9589997335595153, 0.9696335207933574,
                             0.983790882492203, 1.0035882318408613, 1.0367657686976557, 1.0594602900238148, 1.1146174346261308, 1.0966346890132126, 1.0651845997372231, 
                             1.0601827043185628, 1.0371567243698134, 1.0045997590529285]
+# Submarket and historical window of the average anchor derived from the Hourly_PLD statistics of the shape statistics
+# store (ScenarioGenerator.average_anchor); average_scenario_full above is used while the store holds none
+average_scenario_submarket = 'SE'
+average_scenario_window = ('2024-01-01', '2024-12-31')
 scenarios_n = 21
 base_scenario = [1] * 24
 duck_curve_scenario = [1.171741055, 1.137828773, 1.111666567, 1.102689792, 1.133085536, 1.233355995, 1.275684022, 1.012023572, 0.648603192, 0.502583005, 0.450235673, 0.421525523,
@@ -16,8 +20,35 @@ canyon_curve_scenario = [1.721430317, 1.704336392, 1.685400875, 1.691909491, 1.6
                             0.000000000, 0.009760425, 0.046013915, 0.025077403, 0.135418899, 0.645644685, 1.538757645, 1.744430676, 1.786880575, 1.713726435, 1.684768389, 1.674525975]
 
 
+# Submarket of the legacy price_scenario_*.parquet files, which have no submarket column
+LEGACY_PRICE_SCENARIO_SUBMARKET = 'SE/CO'
+
+# NEWAVE submarket -> submarket of the RE generation (ONS/EPE) series
+NEWAVE_RE_SUBMARKET_MAP = {'SE/CO': 'SE', 'S': 'S', 'NE': 'NE', 'N': 'N'}
+
+# VRE share of total generation at which the PU price profile reaches the duck and the canyon curves (price-response
+# assumption of CaptureIndicators.penetration_sweep)
+PRICE_RESPONSE_PENETRATION = [0.35, 0.60]
+
 newave_csv = Path("Data/dados_nwlistop062025_totais.csv")
 re_excel = Path("Data/Generation_NEWAVE_EOL_UFV.xlsx")
+price_scenarios_path = Path("cenarios_horarios_finais")
+price_factors_path = Path("Data/price_scenario_factors.npz")
+shape_statistics_path = Path("Data/shape_statistics.parquet")
+historical_cache_path = Path("Data/historical_cache")
+# Last hour (exclusive) of the historical hourly PLD and minimum age, in hours, of a cached PLD before it is
+# downloaded again when it misses published hours
+HISTORICAL_PLD_END_DATE = '2025-07-01'
+PLD_CACHE_MAX_AGE_HOURS = 24
+ccee_pda_cache_path = Path("Data/ccee_pda")
+charts_path = Path("graficos")
+scenario_results_path = Path("Data/scenario_results")
+
 
 
 
+# Shared HTTP transport of the downloaders (http_transport.HttpTransport): connection pool size, bounds of the adaptive
+# per-host concurrency and maximum requests per second per host
+HTTP_MAX_CONNECTIONS = 64
+HTTP_CONCURRENCY_LIMITS = {'initial': 4, 'min': 1, 'max': 32}
+HTTP_HOST_RATE_LIMITS = {'dadosabertos.ccee.org.br': 20.0, 'dados.ons.org.br': 20.0, 'dadosabertos.aneel.gov.br': 10.0}
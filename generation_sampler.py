@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+from typing import Iterator, Optional, Sequence, Tuple
+
+
+class GenerationPathSampler:
+    """
+    Block-bootstrap sampler of hourly wind and solar generation paths per submarket.
+
+    The library holds the complete historical days common to all submarkets as (days x 24 x submarkets x
+    technologies) float32 profiles, each divided by the mean daily energy of its historical month, which removes
+    the installed capacity of that year and keeps the day-to-day and hourly variability. A path draws, for each
+    month of the horizon, blocks of block_length consecutive library days starting on days of the same calendar
+    month, and rescales the month so that it sums to the NEWAVE monthly total of each submarket and technology.
+    All submarkets and technologies of a path share the same historical days, which keeps their correlation.
+
+    Paths are produced in batches of float32 arrays (paths x hours x submarkets x technologies).
+    """
+
+    TECHNOLOGIES = {'EOL': 'wind_generation_MWh', 'UFV': 'solar_generation_MWh'}
+
+    def __init__(self, historical_generation: pd.DataFrame, monthly_totals: pd.DataFrame, block_length: int = 3, seed: int = 0,
+                 submarkets: Optional[Sequence[str]] = None):
+        """
+        Args:
+            historical_generation (pd.DataFrame): (date, submarket) hourly frame with wind_generation_MWh and
+                solar_generation_MWh (generation_RE or hourly_data of HistoricalDataProcessor.hourly_data_treatment).
+            monthly_totals (pd.DataFrame): NEWAVE RE generation (NewaveDataProcessor.re_generation_data): month start
+                index, Tecnology ('EOL', 'UFV'), Submarket and generation_MWh columns.
+            block_length (int): Number of consecutive historical days per bootstrap block.
+            seed (int): Seed of the random generator.
+            submarkets (list): Submarkets to sample (default: all submarkets in both frames).
+        """
+        self.block_length = block_length
+        self.seed = seed
+        self.technologies = list(self.TECHNOLOGIES.values())
+
+        totals = monthly_totals.rename(columns={'Submarket': 'submarket'})
+        totals = totals.assign(technology=totals['Tecnology'].map(self.TECHNOLOGIES)).dropna(subset=['technology'])
+        totals = totals.pivot_table(index=totals.index, columns=['submarket', 'technology'], values='generation_MWh', aggfunc='sum')
+
+        historical_submarkets = set(historical_generation.index.get_level_values('submarket'))
+        available = [sub for sub in totals.columns.get_level_values('submarket').unique() if sub in historical_submarkets]
+        self.submarkets = [sub for sub in (submarkets or available) if sub in available]
+
+        if not self.submarkets:
+            raise ValueError("No submarket in common between the historical generation and the monthly totals.")
+
+        self.months = pd.DatetimeIndex(totals.index).to_period('M').to_timestamp().sort_values()
+        columns = pd.MultiIndex.from_product([self.submarkets, self.technologies])
+        self.monthly_totals = totals.reindex(columns=columns).fillna(0).sort_index().to_numpy(dtype='float64').reshape(
+            len(self.months), len(self.submarkets), len(self.technologies))
+
+        self.days_in_month = self.months.days_in_month.to_numpy()
+        self.dates = pd.DatetimeIndex(np.concatenate([pd.date_range(month, periods=n_days * 24, freq='h').to_numpy()
+                                                      for month, n_days in zip(self.months, self.days_in_month)]), name='date')
+
+        self._build_library(historical_generation)
+
+    def _build_library(self, historical_generation: pd.DataFrame) -> None:
+        """Relative daily profiles of the complete historical days common to all submarkets."""
+        data = historical_generation[self.technologies]
+        data = data.loc[data.index.get_level_values('submarket').isin(self.submarkets)].fillna(0)
+
+        # (hour, submarket x technology)
+        data = data.unstack('submarket').reorder_levels([1, 0], axis=1).reindex(
+            columns=pd.MultiIndex.from_product([self.submarkets, self.technologies])).sort_index()
+
+        # Days where every submarket has all 24 hours
+        days = pd.DatetimeIndex(data.index).normalize()
+        complete_hours = pd.Series(data.notna().all(axis=1).to_numpy(), index=days).groupby(level=0).sum()
+        day_list = pd.DatetimeIndex(complete_hours.index[complete_hours == 24])
+        data = data.loc[days.isin(day_list)]
+
+        profiles = data.to_numpy(dtype='float64').reshape(len(day_list), 24, len(self.submarkets), len(self.technologies))
+
+        # Mean daily energy of each historical (year, month)
+        month_codes, _ = pd.factorize(day_list.to_period('M'))
+        daily_energy = profiles.sum(axis=1)
+        month_days = np.bincount(month_codes)
+        month_energy = np.stack([np.bincount(month_codes, weights=daily_energy[:, s, t]) / month_days
+                                 for s in range(len(self.submarkets)) for t in range(len(self.technologies))], axis=1)
+        month_energy = month_energy.reshape(-1, len(self.submarkets), len(self.technologies))
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            relative = profiles / month_energy[month_codes][:, None, :, :]
+
+        # (submarket, technology) pairs without generation in a historical month keep zero profiles
+        self.library = np.nan_to_num(relative, nan=0.0, posinf=0.0).astype('float32')
+        self.library_days = day_list
+        self.library_months = day_list.month.to_numpy()
+
+        empty = np.argwhere(profiles.sum(axis=(0, 1)) == 0)
+        for s, t in empty:
+            print(f"No historical {self.technologies[t]} in submarket {self.submarkets[s]}. Its paths are zero.")
+
+        if not len(day_list):
+            raise ValueError("No complete historical day common to all submarkets.")
+
+    def _day_indices(self, rng: np.random.Generator, n_paths: int, month_position: int) -> np.ndarray:
+        """(paths x days of the month) library positions drawn in blocks starting on days of the same calendar month."""
+        n_days = self.days_in_month[month_position]
+        n_blocks = -(-n_days // self.block_length)
+
+        pool = np.flatnonzero(self.library_months == self.months[month_position].month)
+        pool = pool[pool + self.block_length <= len(self.library_days)]
+
+        if not len(pool):
+            pool = np.arange(max(len(self.library_days) - self.block_length + 1, 1))
+
+        starts = pool[rng.integers(0, len(pool), size=(n_paths, n_blocks))]
+        days = (starts[:, :, None] + np.arange(self.block_length)).reshape(n_paths, -1)[:, :n_days]
+
+        return np.minimum(days, len(self.library_days) - 1)
+
+    def sample(self, n_paths: int, batch: int = 0) -> np.ndarray:
+        """
+        Returns a (paths x hours x submarkets x technologies) float32 array of n_paths paths over the horizon
+        (hours in self.dates). batch selects an independent, reproducible random stream.
+        """
+        rng = np.random.default_rng([self.seed, batch])
+        paths = np.empty((n_paths, len(self.dates), len(self.submarkets), len(self.technologies)), dtype='float32')
+
+        hour = 0
+        for month_position, n_days in enumerate(self.days_in_month):
+            month_profiles = self.library[self._day_indices(rng, n_paths, month_position)]  # (paths, days, 24, sub, tech)
+
+            month_sum = month_profiles.sum(axis=(1, 2), dtype='float64')
+            with np.errstate(invalid='ignore', divide='ignore'):
+                scale = np.where(month_sum > 0, self.monthly_totals[month_position] / month_sum, 0.0).astype('float32')
+
+            paths[:, hour:hour + n_days * 24] = (month_profiles * scale[:, None, None]).reshape(n_paths, n_days * 24, *scale.shape[1:])
+            hour += n_days * 24
+
+        return paths
+
+    def iter_batches(self, n_paths: int, batch_size: int = 128) -> Iterator[Tuple[int, np.ndarray]]:
+        """Yields (first path number, paths array) in batches of at most batch_size paths, n_paths in total."""
+        for batch, first in enumerate(range(0, n_paths, batch_size)):
+            yield first, self.sample(min(batch_size, n_paths - first), batch=batch)
+
+    def to_frame(self, paths: np.ndarray, first_path: int = 0) -> pd.DataFrame:
+        """
+        Long (path, date, submarket) frame of a paths array with wind_generation_MWh and solar_generation_MWh columns.
+        A single path, after droplevel('path'), has the layout of EnergyAnalysisService.calculate_final_monthly_generation.
+        """
+        n_paths, n_hours, n_submarkets, _ = paths.shape
+
+        index = pd.MultiIndex.from_arrays([
+            np.repeat(np.arange(first_path, first_path + n_paths), n_hours * n_submarkets),
+            np.tile(np.repeat(self.dates.to_numpy(), n_submarkets), n_paths),
+            np.tile(np.asarray(self.submarkets, dtype=object), n_paths * n_hours),
+        ], names=['path', 'date', 'submarket'])
+
+        return pd.DataFrame(paths.reshape(-1, len(self.technologies)), index=index, columns=self.technologies)
@@ -0,0 +1,257 @@
+import time
+import pandas as pd
+from pathlib import Path
+from typing import Iterator, List, Tuple, Union
+import general_input
+
+
+class HistoricalParquetBackend:
+    """
+    Out-of-core backend of HistoricalDataProcessor over a local Parquet cache.
+
+    Layout (under path):
+        generation/year=<y>/month=<m>/part-0.parquet    ONS plant-hour generation, one partition per month
+        pld.parquet                                      processed hourly PLD
+        hour_coverage.npz                                hour bitmaps of the ingested data (HourCoverageIndex)
+
+    Each ONS file is written to the cache as soon as it is downloaded, so the history is never held in memory
+    at once. Queries push the date filter and the column projection down to the Parquet scan and aggregate one
+    month at a time with pyarrow (engine='arrow') or in a single out-of-core DuckDB query (engine='duckdb',
+    used only if duckdb is installed).
+    """
+
+    GENERATION_DIR = 'generation'
+    PLD_FILE = 'pld.parquet'
+    COVERAGE_FILE = 'hour_coverage.npz'
+
+    GENERATION_COLUMNS = ['din_instante', 'id_subsistema', 'id_estado', 'cod_modalidadeoperacao',
+                          'nom_tipousina', 'nom_usina', 'id_ons', 'ceg', 'val_geracao']
+    PLANT_COLUMNS = ['nom_usina', 'id_ons']
+    GROUP_KEYS = ['din_instante', 'id_subsistema', 'cod_modalidadeoperacao', 'nom_tipousina']
+
+    RENAME_COLUMNS = {"din_instante": "date", "id_subsistema": "submarket",
+                      "val_geracao": "generation_MWh", 'nom_tipousina': "gen_technology"}
+
+    def __init__(self, path: Union[str, Path] = general_input.historical_cache_path, engine: str = 'arrow'):
+        """
+        Args:
+            path (Path): Root directory of the cache.
+            engine (str): 'arrow' (pyarrow compute) or 'duckdb'. Falls back to 'arrow' if duckdb is not installed.
+        """
+        self.path = Path(path)
+        self.engine = engine
+
+        if engine == 'duckdb':
+            try:
+                import duckdb  # noqa: F401
+            except ImportError:
+                print("duckdb is not installed. Using the pyarrow engine.")
+                self.engine = 'arrow'
+
+        elif engine != 'arrow':
+            raise ValueError(f"Engine {engine} not found! Use 'arrow' or 'duckdb'.")
+
+    @property
+    def generation_path(self) -> Path:
+        return self.path / self.GENERATION_DIR
+
+    @property
+    def pld_path(self) -> Path:
+        return self.path / self.PLD_FILE
+
+    @property
+    def coverage_path(self) -> Path:
+        return self.path / self.COVERAGE_FILE
+
+    @staticmethod
+    def _months(start_date, end_date) -> List[Tuple[int, int]]:
+        """Returns the (year, month) pairs between start_date and end_date, both included."""
+        months = pd.period_range(pd.Timestamp(start_date), pd.Timestamp(end_date), freq='M')
+        return list(zip(months.year, months.month))
+
+    def _month_path(self, year: int, month: int) -> Path:
+        return self.generation_path / f"year={year}" / f"month={month}"
+
+    def cached_months(self) -> List[Tuple[int, int]]:
+        """Returns the (year, month) partitions already in the cache."""
+        if not self.generation_path.exists():
+            return []
+
+        return sorted(
+            (int(year_dir.name.split('=')[1]), int(month_dir.name.split('=')[1]))
+            for year_dir in self.generation_path.glob('year=*')
+            for month_dir in year_dir.glob('month=*')
+            if any(month_dir.glob('*.parquet'))
+        )
+
+    def missing_months(self, start_date, end_date) -> List[Tuple[int, int]]:
+        """Returns the (year, month) pairs between start_date and end_date that are not cached yet."""
+        cached = set(self.cached_months())
+        return [month for month in self._months(start_date, end_date) if month not in cached]
+
+    def write_generation(self, hourly_generation_raw: pd.DataFrame) -> None:
+        """
+        Writes raw ONS generation rows to the cache, replacing the months they cover. Only the columns used by
+        the historical processing are kept, with repeated labels stored as dictionary-encoded categories.
+        """
+        if hourly_generation_raw is None or hourly_generation_raw.empty:
+            return
+
+        generation = hourly_generation_raw.reindex(columns=self.GENERATION_COLUMNS)
+        generation['din_instante'] = pd.to_datetime(generation['din_instante'])
+        generation['val_geracao'] = pd.to_numeric(generation['val_geracao'], errors='coerce')
+
+        for column in ['id_subsistema', 'id_estado', 'cod_modalidadeoperacao', 'nom_tipousina', 'nom_usina', 'id_ons', 'ceg']:
+            generation[column] = generation[column].astype('string')
+
+        month_start = generation['din_instante'].dt.to_period('M')
+
+        for period, month_generation in generation.groupby(month_start):
+            month_path = self._month_path(period.year, period.month) # type: ignore
+            month_path.mkdir(parents=True, exist_ok=True)
+
+            month_generation = month_generation.sort_values('din_instante')
+            month_generation.to_parquet(month_path / 'part-0.parquet', index=False, compression='zstd')
+
+    def sync_generation(self, ons_generation_client, start_date, end_date, coverage=None) -> None:
+        """
+        Downloads the ONS files covering the months missing between start_date and end_date, one file at a time,
+        writing each one to the cache before the next download. With an HourCoverageIndex, cached months that were
+        written before they were complete (last hour missing) are fetched again, and the downloaded hours are
+        added to the index.
+        """
+        import asyncio
+
+        missing = self.missing_months(start_date, end_date)
+
+        if coverage is not None:
+            last_hour = min(pd.Timestamp(end_date), pd.Timestamp.now().floor('h') - pd.Timedelta(1, 'h'))
+            stale = coverage.incomplete_months('generation', start_date, last_hour, trailing_only=True)
+            missing = sorted(set(missing) | set(stale))
+
+        # Files before 2022 are annual, later ones are monthly
+        requests = sorted({(year, None if year < 2022 else month) for year, month in missing})
+
+        for year, month in requests:
+            months = [month] if month is not None else None
+
+            try:
+                hourly_generation_raw = asyncio.run(ons_generation_client.get_generation_data(years=[year], months=months))
+            except ValueError as e:
+                print(f"Error in download data: {e}")
+                continue
+
+            self.write_generation(hourly_generation_raw)
+
+            if coverage is not None and hourly_generation_raw is not None and not hourly_generation_raw.empty:
+                coverage.add('generation', hourly_generation_raw['id_subsistema'], pd.to_datetime(hourly_generation_raw['din_instante']),
+                             flag_duplicates=False)
+
+            # The Parquet cache replaces the client's in-memory cache of whole files
+            ons_generation_client.clear_cache()
+
+    def _iter_month_tables(self, start_date, end_date, columns: List[str]) -> Iterator:
+        """Yields the cached rows of each month between start_date and end_date as pyarrow tables."""
+        import pyarrow.dataset as ds
+
+        start_date, end_date = pd.Timestamp(start_date), pd.Timestamp(end_date)
+
+        for year, month in self._months(start_date, end_date):
+            month_path = self._month_path(year, month)
+
+            if not month_path.exists():
+                continue
+
+            dataset = ds.dataset(month_path, format='parquet')
+            date = ds.field('din_instante')
+
+            yield dataset.to_table(columns=columns, filter=(date >= start_date) & (date <= end_date))
+
+    def _generation_columns(self, aggregate: bool, keep_plant_keys: bool) -> List[str]:
+        if aggregate:
+            return self.GROUP_KEYS + ['val_geracao']
+        if keep_plant_keys:
+            return self.GENERATION_COLUMNS
+        return [column for column in self.GENERATION_COLUMNS if column not in self.PLANT_COLUMNS]
+
+    def iter_generation(self, start_date, end_date, clean_version: bool = True, keep_plant_keys: bool = False) -> Iterator[pd.DataFrame]:
+        """
+        Yields the cached generation between start_date and end_date (both included) one month at a time, in the
+        format of generation. Repeated labels are returned as categories, so a month of plant-level rows stays compact.
+        """
+        aggregate = clean_version and not keep_plant_keys
+
+        for table in self._iter_month_tables(start_date, end_date, self._generation_columns(aggregate, keep_plant_keys)):
+            if not table.num_rows:
+                continue
+
+            if aggregate:
+                table = table.group_by(self.GROUP_KEYS, use_threads=False).aggregate([('val_geracao', 'sum')])
+                table = table.rename_columns(self.GROUP_KEYS + ['val_geracao'])
+
+            yield table.to_pandas(strings_to_categorical=True).rename(columns=self.RENAME_COLUMNS).set_index('date').sort_index()
+
+    def generation(self, start_date, end_date, clean_version: bool = True, keep_plant_keys: bool = False) -> pd.DataFrame:
+        """
+        Returns the cached generation between start_date and end_date (both included) in the format of
+        HistoricalDataProcessor.historical_hourly_generation_processing.
+
+        With clean_version, plants are summed per (date, submarket, modality, technology) inside the scan of each
+        month, which leaves the results of hourly_data_treatment unchanged while returning a compact frame.
+        Plant-level rows (clean_version=False, or keep_plant_keys) are better consumed month by month through
+        iter_generation, since this method has to gather the whole window in memory.
+        """
+        if clean_version and not keep_plant_keys and self.engine == 'duckdb':
+            return self._duckdb_generation(start_date, end_date).rename(columns=self.RENAME_COLUMNS).set_index('date').sort_index()
+
+        frames = list(self.iter_generation(start_date, end_date, clean_version, keep_plant_keys))
+
+        if not frames:
+            print("No cached generation between the given dates. Returning an empty DataFrame.")
+            return pd.DataFrame()
+
+        # Categories differ between months, so labels go back to strings when the months are gathered
+        hourly_generation = pd.concat([frame.astype({column: 'string' for column in frame.select_dtypes('category').columns})
+                                       for frame in frames])
+
+        return hourly_generation.sort_index()
+
+    def _duckdb_generation(self, start_date, end_date) -> pd.DataFrame:
+        """Aggregates the cached generation in a single DuckDB query, which spills to disk when needed."""
+        import duckdb
+
+        keys = ', '.join(self.GROUP_KEYS)
+        query = f"""
+            SELECT {keys}, SUM(val_geracao) AS val_geracao
+            FROM read_parquet('{(self.generation_path / '**' / '*.parquet').as_posix()}', hive_partitioning = true)
+            WHERE din_instante BETWEEN ? AND ?
+            GROUP BY {keys}
+        """
+
+        with duckdb.connect() as connection:
+            return connection.execute(query, [pd.Timestamp(start_date), pd.Timestamp(end_date)]).df()
+
+    def has_pld(self, last_hour=None, max_age_hours: float = general_input.PLD_CACHE_MAX_AGE_HOURS) -> bool:
+        """
+        Returns True if the PLD is cached and, given last_hour (the last hour the source should hold), the cache
+        reaches it or was written less than max_age_hours ago (the source may not have published it yet).
+        """
+        if not self.pld_path.exists():
+            return False
+
+        if last_hour is None:
+            return True
+
+        cached_last_hour = pd.read_parquet(self.pld_path, columns=[]).index.max()
+        age_hours = (time.time() - self.pld_path.stat().st_mtime) / 3600
+
+        return cached_last_hour >= pd.Timestamp(last_hour) or age_hours < max_age_hours
+
+    def write_pld(self, hourly_pld: pd.DataFrame) -> None:
+        """Writes the processed hourly PLD (date index, submarket and Hourly_PLD columns) to the cache."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        hourly_pld.to_parquet(self.pld_path, compression='zstd')
+
+    def pld(self) -> pd.DataFrame:
+        """Reads the cached hourly PLD."""
+        return pd.read_parquet(self.pld_path)
@@ -0,0 +1,299 @@
+import numpy as np
+import pandas as pd
+import asyncio
+from typing import Optional, Sequence
+import general_input
+from historical_backend import HistoricalParquetBackend
+from hour_coverage import HourCoverageIndex
+
+
+class HistoricalDataProcessor:
+
+    def __init__(self, electric_sector_client_ccee, electric_sector_client_ons, ons_hourly_generation_client,
+                 backend: Optional[HistoricalParquetBackend] = None, coverage: Optional[HourCoverageIndex] = None):
+        """
+        backend optionally switches the historical queries to the out-of-core Parquet cache (HistoricalParquetBackend),
+        which downloads each source file once and returns the same frames without holding the whole history in memory.
+
+        coverage is the HourCoverageIndex of the hours ingested per series ('Hourly_PLD', 'generation') and submarket,
+        filled by the processing methods (default: a new index, or the one saved in the backend cache).
+        """
+
+        self.ccee_client = electric_sector_client_ccee
+        self.ons_client = electric_sector_client_ons
+        self.ons_generation_client = ons_hourly_generation_client
+        self.backend = backend
+
+        if coverage is None and backend is not None and backend.coverage_path.exists():
+            coverage = HourCoverageIndex.load(backend.coverage_path)
+
+        self.coverage = coverage if coverage is not None else HourCoverageIndex()
+
+    def historical_hourly_pld_processing(self, refresh: bool = False):
+        """
+        With a backend, the cached PLD is returned unless refresh is set or it misses hours the source should
+        already hold (HistoricalParquetBackend.has_pld), in which case it is downloaded again.
+        """
+
+        last_hour = min(pd.Timestamp(general_input.HISTORICAL_PLD_END_DATE), pd.Timestamp.now().floor('h')) - pd.Timedelta(1, 'h')
+
+        if self.backend is not None and not refresh and self.backend.has_pld(last_hour):
+            hourly_pld = self.backend.pld()
+            self.coverage.add_frame('Hourly_PLD', hourly_pld)
+            return hourly_pld
+
+        hourly_pld_raw = self.ccee_client.download_full_product_data("pld_horario")
+
+        hourly_pld = hourly_pld_raw.copy()
+
+        hourly_pld['MES_REFERENCIA'] = pd.to_datetime(hourly_pld['MES_REFERENCIA'], format='%Y%m')
+
+        dates = {
+            'year': hourly_pld['MES_REFERENCIA'].dt.year,
+            'month': hourly_pld['MES_REFERENCIA'].dt.month,
+            'day': hourly_pld['DIA'],
+            'hour': hourly_pld['HORA']
+        }
+
+        hourly_pld['date'] = pd.to_datetime(dates) # type: ignore
+
+        hourly_pld.set_index('date', inplace=True)
+
+        hourly_pld.drop(columns=['MES_REFERENCIA', 'DIA', 'HORA','_id','PERIODO_COMERCIALIZACAO'], inplace=True)
+
+        hourly_pld.rename(columns={"SUBMERCADO": "submarket","PLD_HORA": "Hourly_PLD"}, inplace=True)
+
+        submarket_map = {
+        'NORDESTE': 'NE',
+        'NORTE': 'N',
+        'SUL': 'S',
+        'SUDESTE': 'SE'
+        }
+
+        hourly_pld['submarket'] = hourly_pld['submarket'].map(submarket_map)
+
+        hourly_pld = hourly_pld.loc[hourly_pld.index < general_input.HISTORICAL_PLD_END_DATE]
+
+        # Indexes the hours held and keeps the last published row of repeated (date, submarket) cells
+        if self.coverage.add_frame('Hourly_PLD', hourly_pld):
+            repeated = hourly_pld.set_index('submarket', append=True).index.duplicated(keep='last')
+            print(f"{repeated.sum()} repeated hourly PLD rows were dropped.")
+            hourly_pld = hourly_pld.loc[~repeated]
+
+        if hourly_pld is None or hourly_pld.empty:
+
+            print("Hourly PLD DataFrame is empty after processing. Returning an empty DataFrame.")
+
+        elif self.backend is not None:
+            self.backend.write_pld(hourly_pld)
+
+        return hourly_pld
+    
+
+    def download_hourly_generation(self, start_date: str = '2010-01-01', end_date: str = '2025-07-01'):
+
+        date_range = pd.date_range(start=start_date, end=end_date, freq='MS')
+
+        years_gen = date_range.year.unique().tolist()
+
+        months_gen = date_range.month.unique().tolist()
+
+        async def main():
+
+            try:
+                hourly_generation_downloading = await self.ons_generation_client.get_generation_data(years=years_gen, months=months_gen)
+                
+                return hourly_generation_downloading
+
+            except ValueError as e:
+                print(f"Error in download data: {e}")
+
+        hourly_generation_raw = asyncio.run(main())
+
+        if hourly_generation_raw is None or hourly_generation_raw.empty:
+
+            print("Hourly Generation DataFrame is empty after processing. Returning an empty DataFrame.")
+
+        return hourly_generation_raw
+    
+
+    def historical_hourly_generation_processing(self, clean_version: bool = True, start_date: str = '2010-01-01', end_date: str = '2025-07-01',
+                                               keep_plant_keys: bool = False, lazy: bool = False):
+
+        """ Start and end date included. keep_plant_keys keeps the plant and state keys (ceg, nom_usina, id_ons, id_estado)
+        used by the plant- and state-level capture prices. With a backend, lazy=True returns an iterator of monthly
+        frames instead of one frame (for plant-level rows, which CaptureIndicators.asset_capture_rate_calculate
+        consumes month by month)."""
+
+        start_date = pd.to_datetime(start_date) # type: ignore
+        end_date = pd.to_datetime(end_date) # type: ignore
+
+        if self.backend is not None:
+            self.backend.sync_generation(self.ons_generation_client, start_date, end_date, coverage=self.coverage)
+
+            if lazy:
+                self.coverage.save(self.backend.coverage_path)
+                return self.backend.iter_generation(start_date, end_date, clean_version=clean_version, keep_plant_keys=keep_plant_keys)
+
+            hourly_generation = self.backend.generation(start_date, end_date, clean_version=clean_version, keep_plant_keys=keep_plant_keys)
+
+            if not hourly_generation.empty:
+                self.coverage.add_frame('generation', hourly_generation, flag_duplicates=False)
+
+            self.coverage.save(self.backend.coverage_path)
+            return hourly_generation
+
+        hourly_generation_raw = self.download_hourly_generation(start_date,end_date)
+        
+        hourly_generation = hourly_generation_raw.copy() # type: ignore
+
+        # power_plant_type = [
+        #     'TIPO I', 
+        #     'TIPO II-A', 
+        #     'TIPO II-B', 
+        #     'TIPO II-C'
+        # ]
+
+        # hourly_generation = hourly_generation.query( "cod_modalidadeoperacao in @power_plant_type")
+        
+        if keep_plant_keys:
+            drop_cols = ['nom_subsistema', 'nom_estado', 'nom_tipocombustivel']
+
+        elif clean_version:
+            drop_cols = ['nom_subsistema', 'nom_estado', #'cod_modalidadeoperacao',
+                                            'nom_tipocombustivel','nom_usina','id_ons','id_estado','ceg']
+        
+        else:
+            drop_cols = ['nom_subsistema', 'nom_estado', #'cod_modalidadeoperacao',
+                                            'nom_tipocombustivel','nom_usina','id_ons']
+        
+        rename_cols = {"din_instante": "date","id_subsistema": "submarket",
+                                            "val_geracao": "generation_MWh", 'nom_tipousina': "gen_technology"}
+
+        hourly_generation = (
+            hourly_generation
+            .drop(columns=drop_cols)          
+            .rename(columns=rename_cols)     
+        )
+
+        hourly_generation.set_index('date', inplace=True)
+
+        hourly_generation = hourly_generation.loc[(hourly_generation.index >= start_date) & (hourly_generation.index <= end_date)]
+
+        if hourly_generation is None or hourly_generation.empty:
+
+            print("Hourly Generation DataFrame is empty after processing. Returning an empty DataFrame.")
+
+        else:
+            self.coverage.add_frame('generation', hourly_generation, flag_duplicates=False)
+
+        return hourly_generation
+
+
+    def complete_hours(self, hourly_data: pd.DataFrame, series: Sequence[str] = ('Hourly_PLD', 'generation')) -> pd.Series:
+        """
+        Boolean mask of the (date, submarket) rows of hourly_data whose hours were ingested for every series, read
+        from the coverage bitmaps. Use it to leave out hours that hourly_data_treatment filled with 0.
+        """
+        submarkets = hourly_data.index.get_level_values('submarket')
+        dates = hourly_data.index.get_level_values('date')
+
+        complete = np.ones(len(hourly_data), dtype=bool)
+        for name in series:
+            complete &= self.coverage.mask(name, submarkets, dates)
+
+        return pd.Series(complete, index=hourly_data.index)
+
+
+    def hourly_data_treatment(self,hourly_generation: pd.DataFrame = pd.DataFrame(), hourly_prices: pd.DataFrame = pd.DataFrame(),
+                              mask_incomplete: bool = False):
+
+        """ Hours without price or total generation are filled with 0 (with a warning), or dropped with mask_incomplete."""
+
+        total_generation = pd.DataFrame()
+        generation_RE = pd.DataFrame()
+
+        try:
+            generation = hourly_generation.copy()   
+
+            # power_plant_type = [
+            # 'TIPO I', 
+            # 'TIPO II-A', 
+            # 'TIPO II-B', 
+            # 'TIPO II-C'
+            # ]
+
+            # generation = generation.query( "cod_modalidadeoperacao in @power_plant_type")
+
+            generation.drop(columns='cod_modalidadeoperacao', inplace=True)
+
+            generation['generation_MWh'] = pd.to_numeric(generation['generation_MWh'], errors='coerce')
+
+            grouped_by_tech = generation.groupby(
+                            [generation.index, 'submarket', 'gen_technology']
+                        ).sum()
+
+
+            total_generation = grouped_by_tech.groupby(level=['date', 'submarket']).sum()
+            # total_generation.reset_index('submarket', inplace=True)
+            total_generation.rename(columns={"generation_MWh": "total_generation_MWh"}, inplace=True)
+
+            wind_generation = grouped_by_tech.query("gen_technology == 'EOLIELÉTRICA'")
+            wind_generation = wind_generation.droplevel('gen_technology')
+            # wind_generation.reset_index('submarket', inplace=True)
+            wind_generation.rename(columns={"generation_MWh": "wind_generation_MWh"}, inplace=True)
+
+            solar_generation = grouped_by_tech.query("gen_technology == 'FOTOVOLTAICA'")
+            solar_generation = solar_generation.droplevel('gen_technology')
+            # solar_generation.reset_index('submarket', inplace=True)
+            solar_generation.rename(columns={"generation_MWh": "solar_generation_MWh"}, inplace=True)
+
+            generation_RE = wind_generation.join(solar_generation, how='outer')
+
+        except:
+            if hourly_generation is None or hourly_generation.empty:
+                print("Hourly Generation DataFrame is empty. Trying to continue the process using only prices.")
+            
+            else:
+                print("Error in processing hourly generation data. Returning an empty DataFrame.")
+                return pd.DataFrame()           
+
+
+        try:
+
+            prices = hourly_prices.copy()
+
+            prices = prices.loc[(prices.index >= total_generation.index.min()[0]) & (prices.index <= total_generation.index.max()[0])]
+
+            prices = prices.groupby([prices.index, 'submarket']
+                                        ).sum()
+
+            price_gen = prices.join(total_generation, how='outer')
+
+            hourly_data = price_gen.join(generation_RE, how='outer')
+
+            incomplete = hourly_data[['Hourly_PLD', 'total_generation_MWh']].isna().any(axis=1)
+
+            if incomplete.any():
+                if mask_incomplete:
+                    print(f"{incomplete.sum()} hours without price or generation were dropped.")
+                    hourly_data = hourly_data.loc[~incomplete]
+                else:
+                    print(f"{incomplete.sum()} hours without price or generation were filled with 0. Use mask_incomplete=True to drop them.")
+
+            hourly_data = hourly_data.fillna(0)
+
+        except:
+            if hourly_prices is None or hourly_prices.empty:
+                print("Hourly Prices DataFrame is empty. Returning only generation data.")
+                return total_generation, generation_RE, pd.DataFrame()
+
+            else:
+                print("Error in processing hourly prices data. Returning an empty DataFrame.")
+                return pd.DataFrame()
+
+        if hourly_data is None or hourly_data.empty:
+
+            print("Hourly Data DataFrame is empty after processing. Returning an empty DataFrame.")
+
+        return total_generation, generation_RE, hourly_data
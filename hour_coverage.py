@@ -0,0 +1,273 @@
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+
+HOUR = pd.Timedelta(1, 'h')
+FULL_WORD = np.uint64(0xFFFFFFFFFFFFFFFF)
+_POPCOUNT8 = np.array([bin(byte).count('1') for byte in range(256)], dtype='int64')
+
+
+def _popcount(words: np.ndarray) -> np.ndarray:
+    """Number of set bits of each uint64 word."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).astype('int64')
+    return _POPCOUNT8[words.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+class HourCoverageIndex:
+    """
+    Bitmap index of the hours held per (series, submarket).
+
+    Hour h of the timeline (hours since origin) is bit h % 64 of word h // 64 of the series' uint64 array, so 16
+    years of hourly data take about 2 kB per (series, submarket). A second bitmap marks the hours that arrived more
+    than once in the same ingestion batch. Gaps, duplicates and coverage reports scan whole words and only unpack
+    the words that are not full (or not empty), i.e. they run in O(timeline / 64).
+    """
+
+    def __init__(self, origin: str = '2000-01-01'):
+        """
+        Args:
+            origin (str): First hour of the timeline. Earlier hours are ignored.
+        """
+        self.origin = pd.Timestamp(origin)
+        self.held: Dict[Tuple[str, str], np.ndarray] = {}
+        self.duplicated: Dict[Tuple[str, str], np.ndarray] = {}
+
+    # Building
+
+    def _hours(self, dates) -> np.ndarray:
+        """Hours since origin of each date (floored to the hour)."""
+        dates = pd.DatetimeIndex(dates).floor('h')
+        return np.asarray((dates - self.origin) // HOUR, dtype='int64')
+
+    def _words(self, bitmaps: Dict[Tuple[str, str], np.ndarray], key: Tuple[str, str], n_words: int) -> np.ndarray:
+        words = bitmaps.get(key, np.zeros(0, dtype='uint64'))
+
+        if len(words) < n_words:
+            words = np.concatenate([words, np.zeros(n_words - len(words), dtype='uint64')])
+            bitmaps[key] = words
+
+        return words
+
+    @staticmethod
+    def _set_bits(words: np.ndarray, hours: np.ndarray) -> None:
+        np.bitwise_or.at(words, hours >> 6, np.left_shift(np.uint64(1), (hours & 63).astype('uint64')))
+
+    def add(self, series: str, submarkets, dates, flag_duplicates: bool = True) -> int:
+        """
+        Marks the (submarket, hour) cells of rows with the given submarkets and dates as held for series. With
+        flag_duplicates, cells that appear in more than one row are also marked as duplicated (use False for
+        plant-level rows, where several rows per cell are expected). Returns the number of duplicated cells.
+        """
+        hours = self._hours(dates)
+        submarket_codes, submarket_names = pd.factorize(np.asarray(submarkets))
+
+        valid = (hours >= 0) & (submarket_codes >= 0)
+        if not valid.all():
+            print(f"{(~valid).sum()} rows before {self.origin} or without submarket were not indexed.")
+
+        n_duplicated = 0
+
+        for code, submarket in enumerate(submarket_names):
+            submarket_hours = hours[valid & (submarket_codes == code)]
+
+            if not len(submarket_hours):
+                continue
+
+            unique_hours, counts = np.unique(submarket_hours, return_counts=True)
+            n_words = int(unique_hours[-1] >> 6) + 1
+
+            self._set_bits(self._words(self.held, (series, submarket), n_words), unique_hours)
+
+            if flag_duplicates and (counts > 1).any():
+                duplicated_hours = unique_hours[counts > 1]
+                self._set_bits(self._words(self.duplicated, (series, submarket), n_words), duplicated_hours)
+                n_duplicated += len(duplicated_hours)
+
+        return n_duplicated
+
+    def add_frame(self, series: str, frame: pd.DataFrame, submarket_column: str = 'submarket', flag_duplicates: bool = True) -> int:
+        """add for a frame with the dates in the index (or a 'date' level) and the submarket in a column or index level."""
+        if submarket_column in frame.columns:
+            submarkets = frame[submarket_column].to_numpy()
+        else:
+            submarkets = frame.index.get_level_values(submarket_column)
+
+        dates = frame.index.get_level_values('date') if isinstance(frame.index, pd.MultiIndex) else frame.index
+
+        return self.add(series, submarkets, dates, flag_duplicates)
+
+    # Queries
+
+    def keys(self, series: Optional[str] = None) -> List[Tuple[str, str]]:
+        return sorted(key for key in self.held if series is None or key[0] == series)
+
+    def _bounds(self, start_date, end_date) -> Tuple[int, int]:
+        """Hour range [start, end) of the timeline, end_date included."""
+        return int(self._hours([start_date])[0]), int(self._hours([end_date])[0]) + 1
+
+    @staticmethod
+    def _count_before(words: np.ndarray, hours: np.ndarray) -> np.ndarray:
+        """Number of set bits before each hour: whole words through a prefix sum, plus the bits of the last partial word."""
+        prefix = np.concatenate([[0], np.cumsum(_popcount(words))])
+
+        word = np.clip(hours >> 6, 0, len(words))
+        count = prefix[word]
+
+        inside = (hours >= 0) & ((hours >> 6) < len(words))
+        partial = words[word[inside]] & (np.left_shift(np.uint64(1), (hours[inside] & 63).astype('uint64')) - np.uint64(1))
+        count[inside] += _popcount(partial)
+
+        return count
+
+    @staticmethod
+    def _bits(words: np.ndarray, start: int, end: int, value: bool) -> np.ndarray:
+        """Hours in [start, end) whose bit equals value, unpacking only the words that are not all (not value)."""
+        word_start, word_end = start >> 6, (end + 63) >> 6
+        window = np.zeros(word_end - word_start, dtype='uint64')
+
+        available = words[word_start:min(word_end, len(words))]
+        window[:len(available)] = available
+
+        candidates = np.flatnonzero(window != (np.uint64(0) if value else FULL_WORD))
+
+        bits = np.unpackbits(window[candidates].view(np.uint8), bitorder='little').reshape(-1, 64).astype(bool)
+        word_hours = (candidates + word_start)[:, None] * 64 + np.arange(64)
+
+        hours = word_hours[bits == value]
+
+        return hours[(hours >= start) & (hours < end)]
+
+    def _to_dates(self, hours: np.ndarray) -> pd.DatetimeIndex:
+        return pd.DatetimeIndex(self.origin + hours * HOUR)
+
+    def gaps(self, series: str, submarket: str, start_date, end_date) -> pd.DataFrame:
+        """Runs of consecutive missing hours between start_date and end_date (both included): start, end and hours."""
+        start, end = self._bounds(start_date, end_date)
+        missing = self._bits(self.held.get((series, submarket), np.zeros(0, dtype='uint64')), start, end, value=False)
+
+        if not len(missing):
+            return pd.DataFrame(columns=['start', 'end', 'hours'])
+
+        breaks = np.flatnonzero(np.diff(missing) > 1) + 1
+        run_start, run_end = missing[np.concatenate([[0], breaks])], missing[np.concatenate([breaks - 1, [len(missing) - 1]])]
+
+        return pd.DataFrame({'start': self._to_dates(run_start), 'end': self._to_dates(run_end), 'hours': run_end - run_start + 1})
+
+    def duplicates(self, series: str, submarket: str, start_date=None, end_date=None) -> pd.DatetimeIndex:
+        """Hours of series and submarket that arrived more than once in an ingestion batch."""
+        words = self.duplicated.get((series, submarket), np.zeros(0, dtype='uint64'))
+        start = self._bounds(start_date, start_date)[0] if start_date is not None else 0
+        end = self._bounds(end_date, end_date)[1] if end_date is not None else len(words) * 64
+
+        return self._to_dates(self._bits(words, start, end, value=True))
+
+    def mask(self, series: str, submarkets, dates) -> np.ndarray:
+        """Boolean array telling whether each (submarket, date) cell is held for series."""
+        hours = self._hours(dates)
+        submarket_codes, submarket_names = pd.factorize(np.asarray(submarkets))
+
+        held = np.zeros(len(hours), dtype=bool)
+
+        for code, submarket in enumerate(submarket_names):
+            words = self.held.get((series, submarket))
+            if words is None:
+                continue
+
+            rows = np.flatnonzero(submarket_codes == code)
+            row_hours = hours[rows]
+            inside = (row_hours >= 0) & ((row_hours >> 6) < len(words))
+
+            bits = words[row_hours[inside] >> 6] >> (row_hours[inside] & 63).astype('uint64')
+            held[rows[inside]] = (bits & np.uint64(1)).astype(bool)
+
+        return held
+
+    def report(self, start_date, end_date, freq: str = 'M', series: Optional[str] = None) -> pd.DataFrame:
+        """
+        Coverage per (series, submarket, period) between start_date and end_date (both included): expected hours,
+        held hours, coverage fraction and duplicated hours.
+        """
+        periods = pd.period_range(pd.Timestamp(start_date), pd.Timestamp(end_date), freq=freq)
+
+        if not len(periods) or not self.held:
+            return pd.DataFrame()
+
+        start, end = self._bounds(start_date, end_date)
+        period_start = np.clip(self._hours(periods.start_time), start, end)
+        period_end = np.clip(self._hours(periods.end_time) + 1, start, end)
+
+        frames = {}
+
+        for key in self.keys(series):
+            held = self._count_before(self.held[key], period_end) - self._count_before(self.held[key], period_start)
+
+            duplicated_words = self.duplicated.get(key)
+            duplicated = (self._count_before(duplicated_words, period_end) - self._count_before(duplicated_words, period_start)
+                          if duplicated_words is not None else np.zeros(len(periods), dtype='int64'))
+
+            frames[key] = pd.DataFrame({'expected_hours': period_end - period_start, 'held_hours': held,
+                                        'duplicated_hours': duplicated}, index=periods.rename('period'))
+
+        report = pd.concat(frames, names=['series', 'submarket'])
+        report['coverage'] = report['held_hours'] / report['expected_hours']
+
+        return report
+
+    def incomplete_months(self, series: str, start_date, end_date, submarkets: Optional[Iterable[str]] = None,
+                          trailing_only: bool = False) -> List[Tuple[int, int]]:
+        """
+        (year, month) pairs between start_date and end_date where some submarket of series misses hours. With
+        trailing_only, only months that hold some hours but not their last one (up to end_date), i.e. months that
+        were ingested before they were complete, which is what an incremental refresh has to fetch again.
+        """
+        keys = [key for key in self.keys(series) if submarkets is None or key[1] in set(submarkets)]
+        months = pd.period_range(pd.Timestamp(start_date), pd.Timestamp(end_date), freq='M')
+
+        if not keys or not len(months):
+            return []
+
+        start, end = self._bounds(start_date, end_date)
+        month_start = np.clip(self._hours(months.start_time), start, end)
+        month_end = np.clip(self._hours(months.end_time) + 1, start, end)
+
+        incomplete = np.zeros(len(months), dtype=bool)
+
+        for key in keys:
+            words = self.held[key]
+            held = self._count_before(words, month_end) - self._count_before(words, month_start)
+
+            if trailing_only:
+                last_held = self.mask(series, [key[1]] * len(months), self._to_dates(month_end - 1))
+                incomplete |= (held > 0) & ~last_held
+            else:
+                incomplete |= held < month_end - month_start
+
+        return list(zip(months.year[incomplete], months.month[incomplete]))
+
+    # Persistence
+
+    def save(self, path: Union[str, Path]) -> None:
+        """Saves the bitmaps to a .npz file."""
+        arrays = {f"held|{series}|{submarket}": words for (series, submarket), words in self.held.items()}
+        arrays.update({f"duplicated|{series}|{submarket}": words for (series, submarket), words in self.duplicated.items()})
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(path, origin=np.array(str(self.origin)), **arrays)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> 'HourCoverageIndex':
+        """Loads bitmaps saved by save."""
+        with np.load(path) as data:
+            index = cls(origin=str(data['origin']))
+
+            for name in data.files:
+                if name == 'origin':
+                    continue
+                kind, series, submarket = name.split('|')
+                getattr(index, kind)[(series, submarket)] = data[name]
+
+        return index
@@ -0,0 +1,362 @@
+import asyncio
+import contextlib
+import threading
+import time
+import pandas as pd
+from collections import deque
+from typing import TYPE_CHECKING, Dict, Optional
+from urllib.parse import urlparse
+import general_input
+
+if TYPE_CHECKING:
+    import httpx
+
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit of one host: the number of requests in flight grows by one per `limit` fast successes
+    (additive increase) and is multiplied by `backoff` (multiplicative decrease) when the time to first byte of a
+    request exceeds target_latency or the error rate of the last `window` requests exceeds error_threshold.
+    The latency is measured up to the response headers, so the size of the body (e.g. a large ONS file) does not
+    count as congestion. Decreases are at most one per `cooldown` seconds, so a burst of failures of requests
+    already in flight counts once.
+    """
+
+    def __init__(self, initial: int = 4, min_limit: int = 1, max_limit: int = 32, target_latency: float = 10.0,
+                 backoff: float = 0.5, error_threshold: float = 0.1, window: int = 20, cooldown: float = 1.0):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.error_threshold = error_threshold
+        self.cooldown = cooldown
+
+        self.in_flight = 0
+        self._results = deque(maxlen=window)
+        self._last_decrease = 0.0
+        self._condition: Optional[asyncio.Condition] = None
+        self._loop = None
+
+    def _bound_condition(self) -> asyncio.Condition:
+        """asyncio primitives belong to one event loop; each asyncio.run gets fresh ones."""
+        loop = asyncio.get_running_loop()
+
+        if self._loop is not loop:
+            self._condition, self._loop, self.in_flight = asyncio.Condition(), loop, 0
+
+        return self._condition # type: ignore
+
+    async def acquire(self) -> None:
+        condition = self._bound_condition()
+
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self) -> None:
+        condition = self._bound_condition()
+
+        async with condition:
+            self.in_flight -= 1
+            condition.notify_all()
+
+    def record(self, latency: float, failed: bool) -> None:
+        """Updates the limit with the outcome of a request (latency: time to first byte, in seconds)."""
+        self._results.append(failed)
+        error_rate = sum(self._results) / len(self._results)
+
+        if failed or latency > self.target_latency:
+            if error_rate > self.error_threshold or latency > self.target_latency:
+                now = time.monotonic()
+                if now - self._last_decrease >= self.cooldown:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self._last_decrease = now
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+
+class RateLimiter:
+    """Spaces the requests to a host at least 1 / rate seconds apart (rate in requests per second; None: no limit)."""
+
+    def __init__(self, rate: Optional[float] = None):
+        self.rate = rate
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def _delay(self) -> float:
+        if not self.rate:
+            return 0.0
+
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + 1 / self.rate
+
+        return slot - now
+
+    async def wait(self) -> None:
+        delay = self._delay()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def wait_sync(self) -> None:
+        delay = self._delay()
+        if delay > 0:
+            time.sleep(delay)
+
+    def __getstate__(self):
+        return {'rate': self.rate}
+
+    def __setstate__(self, state):
+        self.__init__(state['rate'])
+
+
+class HttpTransport:
+    """
+    HTTP layer shared by the downloaders (ElectricSectorOpenData, ONSHourlyGeneration).
+
+    Requests go through one pooled httpx client (keep-alive connections, optional HTTP/2), an AdaptiveLimiter
+    and a RateLimiter per host, and are retried with exponential backoff on connection errors, timeouts and
+    429/5xx responses (honouring Retry-After). Per-host statistics are returned by stats().
+
+    The asynchronous client lives for a session() block: the downloaders open one around each download, so all
+    its requests share the pool, and the client is closed when the block exits. A get() outside a session opens
+    a client for that call only.
+    """
+
+    def __init__(self, max_connections: int = general_input.HTTP_MAX_CONNECTIONS, http2: bool = False, timeout: float = 30,
+                 max_retries: int = 3, retry_backoff: float = 1.0,
+                 rate_limits: Optional[Dict[str, float]] = general_input.HTTP_HOST_RATE_LIMITS,
+                 concurrency_limits: Dict[str, int] = general_input.HTTP_CONCURRENCY_LIMITS, target_latency: float = 10.0):
+        """
+        Args:
+            max_connections (int): Size of the connection pool.
+            http2 (bool): Negotiates HTTP/2 if the h2 package is installed.
+            timeout (float): Default timeout of each request, in seconds.
+            max_retries (int): Retries of a failed request.
+            retry_backoff (float): Wait before the first retry, doubled at each retry.
+            rate_limits (dict): Maximum requests per second per host.
+            concurrency_limits (dict): 'initial', 'min' and 'max' concurrency per host.
+            target_latency (float): Time to first byte above which the concurrency of a host is reduced.
+        """
+        self.max_connections = max_connections
+        self.http2 = http2
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.rate_limits = dict(rate_limits or {})
+        self.concurrency_limits = dict(concurrency_limits)
+        self.target_latency = target_latency
+
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                print("h2 is not installed. Using HTTP/1.1.")
+                self.http2 = False
+
+        self._init_runtime()
+
+    def _init_runtime(self) -> None:
+        self._limiters: Dict[str, AdaptiveLimiter] = {}
+        self._rate_limiters: Dict[str, RateLimiter] = {}
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self._client = None
+        self._client_loop = None
+        self._client_users = 0
+        self._sync_client = None
+
+    def __getstate__(self):
+        """Clients, locks and statistics are not pickled (e.g. when sent to worker processes)."""
+        state = self.__dict__.copy()
+        for key in ['_limiters', '_rate_limiters', '_stats', '_lock', '_client', '_client_loop', '_client_users', '_sync_client']:
+            state.pop(key)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_runtime()
+
+    def _host(self, url: str) -> str:
+        host = urlparse(url).netloc
+
+        with self._lock:
+            if host not in self._limiters:
+                self._limiters[host] = AdaptiveLimiter(self.concurrency_limits.get('initial', 4), self.concurrency_limits.get('min', 1),
+                                                       self.concurrency_limits.get('max', 32), self.target_latency)
+                self._rate_limiters[host] = RateLimiter(self.rate_limits.get(host))
+                self._stats[host] = dict.fromkeys(['requests', 'errors', 'retries', 'bytes', 'latency', 'first_byte', 'max_in_flight'], 0)
+
+        return host
+
+    def _limits(self):
+        import httpx
+        return httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+
+    @contextlib.asynccontextmanager
+    async def session(self):
+        """
+        Keeps one pooled asynchronous client open for the requests made inside the block (nested blocks of the same
+        event loop share it) and closes it when the outermost block exits.
+        """
+        import httpx
+
+        loop = asyncio.get_running_loop()
+
+        # A client cannot outlive the loop that opened its connections, so each event loop gets its own
+        if self._client is None or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(limits=self._limits(), http2=self.http2, timeout=self.timeout, follow_redirects=True)
+            self._client_loop, self._client_users = loop, 0
+
+        client = self._client
+        self._client_users += 1
+
+        try:
+            yield client
+        finally:
+            self._client_users -= 1
+
+            if self._client is client and self._client_users == 0:
+                self._client, self._client_loop = None, None
+                await client.aclose()
+
+    def _sync(self) -> "httpx.Client":
+        import httpx
+
+        if self._sync_client is None:
+            self._sync_client = httpx.Client(limits=self._limits(), http2=self.http2, timeout=self.timeout, follow_redirects=True)
+
+        return self._sync_client
+
+    def _retry_delay(self, attempt: int, response=None) -> float:
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+
+        if retry_after is not None and retry_after.isdigit():
+            return float(retry_after)
+
+        return self.retry_backoff * 2 ** attempt
+
+    def _record(self, host: str, latency: float, failed: bool, size: int = 0, retry: bool = False,
+                first_byte: Optional[float] = None) -> None:
+        """Records a request: latency is the whole request, first_byte the time to the response headers (None: failed before them)."""
+        limiter, stats = self._limiters[host], self._stats[host]
+        limiter.record(latency if first_byte is None else first_byte, failed)
+
+        stats['requests'] += 1
+        stats['errors'] += failed
+        stats['retries'] += retry
+        stats['bytes'] += size
+        stats['latency'] += latency
+        stats['first_byte'] += latency if first_byte is None else first_byte
+        stats['max_in_flight'] = max(stats['max_in_flight'], limiter.in_flight)
+
+    async def get(self, url: str, **kwargs) -> "httpx.Response":
+        """
+        Asynchronous GET through the host's limiters, with retries. Returns the last response (the caller checks
+        its status) or raises the last httpx error.
+        """
+        import httpx
+
+        host = self._host(url)
+        limiter, rate_limiter = self._limiters[host], self._rate_limiters[host]
+
+        async with self.session() as client:
+            for attempt in range(self.max_retries + 1):
+                await rate_limiter.wait()
+                await limiter.acquire()
+                start = time.monotonic()
+                first_byte = None
+
+                try:
+                    async with client.stream('GET', url, **kwargs) as response:
+                        first_byte = time.monotonic() - start
+                        await response.aread()
+                except httpx.TransportError:
+                    self._record(host, time.monotonic() - start, True, retry=attempt < self.max_retries, first_byte=first_byte)
+                    if attempt == self.max_retries:
+                        raise
+                    response = None
+                else:
+                    failed = response.status_code in RETRY_STATUS
+                    self._record(host, time.monotonic() - start, failed, len(response.content),
+                                 retry=failed and attempt < self.max_retries, first_byte=first_byte)
+                    if not failed or attempt == self.max_retries:
+                        return response
+                finally:
+                    await limiter.release()
+
+                await asyncio.sleep(self._retry_delay(attempt, response))
+
+        raise RuntimeError("Unreachable")
+
+    def get_sync(self, url: str, **kwargs) -> "httpx.Response":
+        """Blocking GET on the same pool settings, rate limits, retries and statistics (for small API calls)."""
+        import httpx
+
+        host = self._host(url)
+        rate_limiter = self._rate_limiters[host]
+
+        for attempt in range(self.max_retries + 1):
+            rate_limiter.wait_sync()
+            start = time.monotonic()
+            first_byte = None
+
+            try:
+                with self._sync().stream('GET', url, **kwargs) as response:
+                    first_byte = time.monotonic() - start
+                    response.read()
+            except httpx.TransportError:
+                self._record(host, time.monotonic() - start, True, retry=attempt < self.max_retries, first_byte=first_byte)
+                if attempt == self.max_retries:
+                    raise
+                response = None
+            else:
+                failed = response.status_code in RETRY_STATUS
+                self._record(host, time.monotonic() - start, failed, len(response.content),
+                             retry=failed and attempt < self.max_retries, first_byte=first_byte)
+                if not failed or attempt == self.max_retries:
+                    return response
+
+            time.sleep(self._retry_delay(attempt, response))
+
+        raise RuntimeError("Unreachable")
+
+    def stats(self) -> pd.DataFrame:
+        """
+        Per-host requests, errors, retries, bytes, mean latency, mean time to first byte, current concurrency limit
+        and peak concurrency.
+        """
+        if not self._stats:
+            return pd.DataFrame()
+
+        stats = pd.DataFrame.from_dict(self._stats, orient='index')
+        stats['mean_latency'] = stats['latency'] / stats['requests']
+        stats['mean_first_byte'] = stats['first_byte'] / stats['requests']
+        stats['concurrency_limit'] = pd.Series({host: limiter.limit for host, limiter in self._limiters.items()})
+        stats.index.name = 'host'
+
+        return stats.drop(columns=['latency', 'first_byte'])
+
+    def close(self) -> None:
+        """Closes the blocking client (the asynchronous one is closed when its session() block exits)."""
+        if self._sync_client is not None:
+            self._sync_client.close()
+            self._sync_client = None
+
+
+_shared_transport: Optional[HttpTransport] = None
+
+
+def shared_transport() -> HttpTransport:
+    """Process-wide transport used by the downloaders when none is given."""
+    global _shared_transport
+
+    if _shared_transport is None:
+        _shared_transport = HttpTransport()
+
+    return _shared_transport
@@ -0,0 +1,405 @@
+import json
+import shutil
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Tuple, Union
+import general_input
+
+
+class PriceScenarioStore:
+    """
+    Single partitioned Parquet dataset of hourly price scenarios.
+
+    Layout (under path):
+        time_axis.parquet                   year, month, day, hour of every hour of the horizon, stored once
+        submarket=<tag>/part-<k>.parquet    one file per chunk of scenario_nw, one row group per scenario_nw,
+                                            rows sorted by (scenario_nw, simulated_scenario, t)
+
+    Part files hold the dictionary-encoded scenario_nw and simulated_scenario keys, the delta-encoded position t
+    on the time axis and float32 prices. Their footer indexes each scenario_nw to its row group, so a subset of
+    scenarios is read without scanning the rest of the dataset.
+    """
+
+    TIME_AXIS_FILE = 'time_axis.parquet'
+    INDEX_KEY = b'price_scenario_index'
+
+    def __init__(self, path: Union[str, Path] = general_input.price_scenarios_path):
+        """
+        Args:
+            path (Path): Root directory of the dataset.
+        """
+        self.path = Path(path)
+        self._time_axis: Optional[pd.DataFrame] = None
+
+    @staticmethod
+    def submarket_tag(submarket: str) -> str:
+        """Returns the directory-safe name of a submarket (e.g. 'SE/CO' -> 'SE_CO')."""
+        return submarket.replace('/', '_')
+
+    def exists(self) -> bool:
+        """Returns True if path holds a dataset in this layout."""
+        return (self.path / self.TIME_AXIS_FILE).exists()
+
+    def submarket_path(self, submarket: str) -> Path:
+        return self.path / f"submarket={self.submarket_tag(submarket)}"
+
+    def write_time_axis(self, full_date: pd.DatetimeIndex) -> bool:
+        """
+        Writes the shared hourly time axis of the dataset if it differs from the stored one. The positions t of the
+        part files refer to the axis, so when it changes the parts of every submarket are removed, not only the ones
+        about to be regenerated. Returns True if the axis was written.
+        """
+        time_axis = pd.DataFrame({
+            'year': full_date.year.to_numpy().astype('int16'),
+            'month': full_date.month.to_numpy().astype('int8'),
+            'day': full_date.day.to_numpy().astype('int8'),
+            'hour': full_date.hour.to_numpy().astype('int8'),
+        })
+
+        if self.exists() and self.time_axis()[list(time_axis.columns)].equals(time_axis):
+            return False
+
+        for submarket_path in self.path.glob('submarket=*'):
+            shutil.rmtree(submarket_path, ignore_errors=True)
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        time_axis.to_parquet(self.path / self.TIME_AXIS_FILE, index=False)
+
+        self._time_axis = None
+
+        return True
+
+    def reset_submarket(self, submarket: str) -> None:
+        """Removes every part file of a submarket before it is regenerated."""
+        shutil.rmtree(self.submarket_path(submarket), ignore_errors=True)
+
+    def write_part(self, submarket: str, part_id: int, scenario_ids: Sequence[int],
+                   simulated_scenarios: Sequence[int], hourly_price: np.ndarray) -> Path:
+        """
+        Writes one part file from a (scenarios, simulated_scenarios, hours) price array, one row group per scenario_nw.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        n_profiles, n_hours = hourly_price.shape[1], hourly_price.shape[2]
+
+        simulated_column = pa.array(np.repeat(np.asarray(simulated_scenarios, dtype='int32'), n_hours))
+        t_column = pa.array(np.tile(np.arange(n_hours, dtype='int32'), n_profiles))
+
+        index = {
+            'submarket': submarket,
+            'n_hours': int(n_hours),
+            'simulated_scenarios': [int(sim) for sim in simulated_scenarios],
+            'row_groups': {str(int(scenario)): position for position, scenario in enumerate(scenario_ids)},
+        }
+
+        schema = pa.schema([
+            ('scenario_nw', pa.int16()),
+            ('simulated_scenario', pa.int32()),
+            ('t', pa.int32()),
+            ('hourly_price', pa.float32()),
+        ]).with_metadata({self.INDEX_KEY: json.dumps(index).encode()})
+
+        output_directory = self.submarket_path(submarket)
+        output_directory.mkdir(parents=True, exist_ok=True)
+        output_filename = output_directory / f"part-{part_id:05d}.parquet"
+
+        with pq.ParquetWriter(
+            output_filename, schema,
+            compression='zstd',
+            use_dictionary=['scenario_nw', 'simulated_scenario'],
+            column_encoding={'t': 'DELTA_BINARY_PACKED', 'hourly_price': 'BYTE_STREAM_SPLIT'},
+        ) as writer:
+            for position, scenario in enumerate(scenario_ids):
+                table = pa.Table.from_arrays([
+                    pa.array(np.full(n_profiles * n_hours, scenario, dtype='int16')),
+                    simulated_column,
+                    t_column,
+                    pa.array(np.ascontiguousarray(hourly_price[position], dtype='float32').ravel()),
+                ], schema=schema)
+                writer.write_table(table, row_group_size=n_profiles * n_hours)
+
+        return output_filename
+
+    def time_axis(self) -> pd.DataFrame:
+        """Returns the shared time axis with a 'date' column."""
+        if self._time_axis is None:
+            time_axis = pd.read_parquet(self.path / self.TIME_AXIS_FILE)
+            time_axis['date'] = pd.to_datetime(time_axis[['year', 'month', 'day', 'hour']])
+            self._time_axis = time_axis
+
+        return self._time_axis
+
+    def index(self) -> pd.DataFrame:
+        """Returns the (submarket, scenario_nw) -> (file, row_group) index read from the part file footers."""
+        import pyarrow.parquet as pq
+
+        records = []
+
+        for part_file in sorted(self.path.glob('submarket=*/part-*.parquet')):
+            part_index = json.loads(pq.read_schema(part_file).metadata[self.INDEX_KEY])
+
+            for scenario, row_group in part_index['row_groups'].items():
+                records.append((part_index['submarket'], int(scenario), str(part_file), row_group))
+
+        return pd.DataFrame(records, columns=['submarket', 'scenario_nw', 'file', 'row_group'])
+
+    def _time_mask(self, days: Optional[Sequence[int]], start_date: Optional[str], end_date: Optional[str]) -> np.ndarray:
+
+        time_axis = self.time_axis()
+        mask = np.ones(len(time_axis), dtype=bool)
+
+        if days is not None:
+            mask &= time_axis['day'].isin(list(days)).to_numpy()
+
+        # Month range, both ends included
+        month_id = time_axis['year'].to_numpy(dtype='int64') * 12 + time_axis['month'].to_numpy(dtype='int64')
+
+        if start_date is not None:
+            start = pd.Timestamp(start_date)
+            mask &= month_id >= start.year * 12 + start.month
+
+        if end_date is not None:
+            end = pd.Timestamp(end_date)
+            mask &= month_id <= end.year * 12 + end.month
+
+        return mask
+
+    def iter_read(self, submarkets: Optional[Sequence[str]] = None, scenario_nw: Optional[Sequence[int]] = None,
+                  simulated_scenario: Optional[Sequence[int]] = None, days: Optional[Sequence[int]] = None,
+                  start_date: Optional[str] = None, end_date: Optional[str] = None) -> Iterator[pd.DataFrame]:
+        """
+        Yields one DataFrame per selected scenario_nw (date index; submarket, scenario_nw, simulated_scenario and
+        hourly_price columns). Only the row groups of the requested scenarios are read.
+        """
+        import pyarrow.parquet as pq
+
+        index = self.index()
+
+        if submarkets is not None:
+            index = index.loc[index['submarket'].isin(list(submarkets))]
+        if scenario_nw is not None:
+            index = index.loc[index['scenario_nw'].isin(list(scenario_nw))]
+
+        time_mask = self._time_mask(days, start_date, end_date)
+        dates = self.time_axis()['date'].to_numpy()
+
+        for (submarket, part_file), row_groups in index.groupby(['submarket', 'file'], sort=False)['row_group']:
+
+            parquet_file = pq.ParquetFile(part_file)
+
+            for row_group in sorted(row_groups):
+                table = parquet_file.read_row_group(row_group)
+
+                t = table.column('t').to_numpy()
+                simulated = table.column('simulated_scenario').to_numpy()
+
+                mask = time_mask[t]
+                if simulated_scenario is not None:
+                    mask &= np.isin(simulated, list(simulated_scenario))
+
+                yield pd.DataFrame({
+                    'submarket': submarket,
+                    'scenario_nw': table.column('scenario_nw').to_numpy()[mask],
+                    'simulated_scenario': simulated[mask],
+                    'hourly_price': table.column('hourly_price').to_numpy()[mask],
+                }, index=pd.DatetimeIndex(dates[t[mask]], name='date'))
+
+    def read(self, submarkets: Optional[Sequence[str]] = None, scenario_nw: Optional[Sequence[int]] = None,
+             simulated_scenario: Optional[Sequence[int]] = None, days: Optional[Sequence[int]] = None,
+             start_date: Optional[str] = None, end_date: Optional[str] = None) -> pd.DataFrame:
+        """Reads the selected scenarios into one DataFrame (see iter_read)."""
+
+        frames: List[pd.DataFrame] = list(self.iter_read(submarkets, scenario_nw, simulated_scenario, days, start_date, end_date))
+
+        if not frames:
+            return pd.DataFrame(columns=['submarket', 'scenario_nw', 'simulated_scenario', 'hourly_price'])
+
+        return pd.concat(frames)
+
+
+def hourly_price_kernel(pld: np.ndarray, profile: np.ndarray, month_position: np.ndarray, hour: np.ndarray,
+                        lower: float, upper: float) -> np.ndarray:
+    """
+    Broadcasts (scenarios x months) PLD against (24 x profiles) PU profiles into clipped hourly prices
+    with shape (scenarios, profiles, hours). Leading axes (e.g. submarkets: (submarkets, scenarios, months) PLD
+    and (submarkets, 24, profiles) profiles) are broadcast as well.
+    """
+    hourly_price = pld[..., :, None, month_position] * np.swapaxes(profile, -1, -2)[..., None, :, hour]
+
+    return np.clip(hourly_price, lower, upper, out=hourly_price)
+
+
+class VirtualPriceScenarioStore:
+    """
+    Factorized price scenario store. Keeps only the factors of the hourly prices, the NEWAVE PLD tensor
+    (submarket x scenario_nw x month, before clipping) and the (24 x simulated_scenario) PU profile matrix (or one
+    matrix per submarket, (submarket x 24 x simulated_scenario)), and
+    computes any slice of hourly prices on demand:
+
+        hourly price = clip(clip(PLD[submarket, scenario, month]) x profile[hour of day, simulated_scenario])
+
+    The PLD limits are applied at query time (general_input.MONTHLY_PLD_LIMITS unless others are given).
+    """
+
+    def __init__(self, pld: np.ndarray, profile: np.ndarray, submarkets: Sequence[str], scenario_ids: Sequence[int],
+                 simulated_scenarios: Sequence[int], months: pd.PeriodIndex):
+        """
+        Args:
+            pld (np.ndarray): (submarkets, scenarios, months) monthly PLD, before clipping.
+            profile (np.ndarray): (24, simulated_scenarios) PU profiles, or (submarkets, 24, simulated_scenarios).
+            submarkets (list): Submarket names of the first axis of pld.
+            scenario_ids (list): scenario_nw of the second axis of pld.
+            simulated_scenarios (list): simulated_scenario of the columns of profile.
+            months (pd.PeriodIndex): Months of the third axis of pld.
+        """
+        self.pld = np.asarray(pld, dtype='float32')
+        self.profile = np.asarray(profile, dtype='float32')
+        self.submarkets = list(submarkets)
+        self.scenario_ids = np.asarray(scenario_ids, dtype='int64')
+        self.simulated_scenarios = np.asarray(simulated_scenarios, dtype='int64')
+        self.months = pd.PeriodIndex(months, freq='M')
+
+        month_start = self.months.to_timestamp()
+        hours_in_month = month_start.days_in_month.to_numpy() * 24
+
+        self.month_position = np.repeat(np.arange(len(self.months)), hours_in_month).astype('int32')
+        hour_offset = np.arange(len(self.month_position)) - np.repeat(np.cumsum(hours_in_month) - hours_in_month, hours_in_month)
+        self.dates = month_start.to_numpy()[self.month_position] + hour_offset * np.timedelta64(1, 'h')
+        self.hour = (hour_offset % 24).astype('int8')
+
+    @classmethod
+    def from_newave(cls, pld_data: pd.DataFrame, scenarios: pd.DataFrame) -> 'VirtualPriceScenarioStore':
+        """
+        Builds the factors from NEWAVE PLD rows (date index; scenario_nw, submarket and pld_nw columns) and the
+        (24 x simulated_scenario) PU scenarios of ScenarioGenerator.generate_scenarios.
+        """
+        pld_tensor = pld_data.pivot_table(
+            index=['submarket', pld_data['scenario_nw'].astype(int)],
+            columns=pd.DatetimeIndex(pld_data.index).to_period('M'),
+            values='pld_nw',
+            aggfunc='mean'
+        ).sort_index()
+
+        submarkets = list(pld_tensor.index.get_level_values('submarket').unique())
+        scenario_ids = np.sort(pld_tensor.index.get_level_values('scenario_nw').unique().to_numpy())
+        pld_tensor = pld_tensor.reindex(pd.MultiIndex.from_product([submarkets, scenario_ids], names=['submarket', 'scenario_nw']))
+
+        return cls(
+            pld=pld_tensor.to_numpy(dtype='float32').reshape(len(submarkets), len(scenario_ids), -1),
+            profile=scenarios.to_numpy(dtype='float32'),
+            submarkets=submarkets,
+            scenario_ids=scenario_ids,
+            simulated_scenarios=scenarios.columns.astype(int).to_numpy(),
+            months=pld_tensor.columns
+        )
+
+    def save(self, path: Union[str, Path] = general_input.price_factors_path) -> None:
+        """Persists the factors to a compressed .npz file."""
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+        np.savez_compressed(
+            path,
+            pld=self.pld,
+            profile=self.profile,
+            submarkets=np.asarray(self.submarkets, dtype=str),
+            scenario_ids=self.scenario_ids,
+            simulated_scenarios=self.simulated_scenarios,
+            months=self.months.year.to_numpy() * 12 + self.months.month.to_numpy() - 1,
+        )
+
+    @classmethod
+    def load(cls, path: Union[str, Path] = general_input.price_factors_path) -> 'VirtualPriceScenarioStore':
+        """Loads factors persisted with save."""
+        with np.load(path) as factors:
+            months = factors['months']
+
+            return cls(
+                pld=factors['pld'],
+                profile=factors['profile'],
+                submarkets=factors['submarkets'].tolist(),
+                scenario_ids=factors['scenario_ids'],
+                simulated_scenarios=factors['simulated_scenarios'],
+                months=pd.PeriodIndex([pd.Period(year=month // 12, month=month % 12 + 1, freq='M') for month in months], freq='M')
+            )
+
+    def _time_mask(self, days: Optional[Sequence[int]], start_date: Optional[str], end_date: Optional[str]) -> np.ndarray:
+
+        dates = pd.DatetimeIndex(self.dates)
+        mask = np.ones(len(dates), dtype=bool)
+
+        if days is not None:
+            mask &= np.isin(dates.day, list(days))
+
+        # Month range, both ends included
+        month_id = dates.year.to_numpy() * 12 + dates.month.to_numpy()
+
+        if start_date is not None:
+            start = pd.Timestamp(start_date)
+            mask &= month_id >= start.year * 12 + start.month
+
+        if end_date is not None:
+            end = pd.Timestamp(end_date)
+            mask &= month_id <= end.year * 12 + end.month
+
+        return mask
+
+    def prices(self, submarket: str, scenario_nw: Optional[Sequence[int]] = None, simulated_scenario: Optional[Sequence[int]] = None,
+               days: Optional[Sequence[int]] = None, start_date: Optional[str] = None, end_date: Optional[str] = None,
+               limits: Optional[dict] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Computes a slice of hourly prices of one submarket.
+
+        Returns:
+            hourly_price (np.ndarray): (scenarios, simulated_scenarios, hours) float32 prices.
+            scenario_ids, simulated_scenarios, dates (np.ndarray): Labels of the three axes.
+        """
+        limits = limits if limits is not None else general_input.MONTHLY_PLD_LIMITS
+        lower, upper = limits['min'][0], limits['max'][0]
+
+        scenario_position = np.arange(len(self.scenario_ids)) if scenario_nw is None else np.flatnonzero(np.isin(self.scenario_ids, list(scenario_nw)))
+        profile_position = np.arange(len(self.simulated_scenarios)) if simulated_scenario is None else np.flatnonzero(np.isin(self.simulated_scenarios, list(simulated_scenario)))
+        time_position = np.flatnonzero(self._time_mask(days, start_date, end_date))
+
+        submarket_position = self.submarkets.index(submarket)
+        monthly_pld = np.clip(self.pld[submarket_position][scenario_position], lower, upper)
+        profile = self.profile[submarket_position] if self.profile.ndim == 3 else self.profile
+
+        hourly_price = hourly_price_kernel(
+            monthly_pld, profile[:, profile_position], self.month_position[time_position], self.hour[time_position], lower, upper
+        )
+
+        return hourly_price, self.scenario_ids[scenario_position], self.simulated_scenarios[profile_position], self.dates[time_position]
+
+    def iter_read(self, submarkets: Optional[Sequence[str]] = None, scenario_nw: Optional[Sequence[int]] = None,
+                  simulated_scenario: Optional[Sequence[int]] = None, days: Optional[Sequence[int]] = None,
+                  start_date: Optional[str] = None, end_date: Optional[str] = None,
+                  limits: Optional[dict] = None) -> Iterator[pd.DataFrame]:
+        """Yields one DataFrame per scenario_nw in the layout of PriceScenarioStore.iter_read."""
+
+        for submarket in (self.submarkets if submarkets is None else [sub for sub in submarkets if sub in self.submarkets]):
+
+            selected = self.scenario_ids if scenario_nw is None else self.scenario_ids[np.isin(self.scenario_ids, list(scenario_nw))]
+
+            for scenario in selected:
+                hourly_price, _, simulated, dates = self.prices(submarket, [scenario], simulated_scenario, days, start_date, end_date, limits)
+
+                yield pd.DataFrame({
+                    'submarket': submarket,
+                    'scenario_nw': np.int16(scenario),
+                    'simulated_scenario': np.repeat(simulated.astype('int32'), len(dates)),
+                    'hourly_price': hourly_price[0].ravel(),
+                }, index=pd.DatetimeIndex(np.tile(dates, len(simulated)), name='date'))
+
+    def read(self, submarkets: Optional[Sequence[str]] = None, scenario_nw: Optional[Sequence[int]] = None,
+             simulated_scenario: Optional[Sequence[int]] = None, days: Optional[Sequence[int]] = None,
+             start_date: Optional[str] = None, end_date: Optional[str] = None, limits: Optional[dict] = None) -> pd.DataFrame:
+        """Computes the selected scenarios into one DataFrame (see iter_read)."""
+
+        frames = list(self.iter_read(submarkets, scenario_nw, simulated_scenario, days, start_date, end_date, limits))
+
+        if not frames:
+            return pd.DataFrame(columns=['submarket', 'scenario_nw', 'simulated_scenario', 'hourly_price'])
+
+        return pd.concat(frames)
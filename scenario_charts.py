@@ -0,0 +1,192 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Union
+import general_input
+
+
+DEFAULT_BANDS = ((5, 95), (25, 75))
+HIGHLIGHT_COLORS = ['tab:orange', 'tab:green', 'tab:red', 'tab:purple', 'tab:brown', 'tab:pink']
+
+
+def downsample_paths(x: np.ndarray, paths: np.ndarray, max_points: int = 1000):
+    """
+    Reduces (paths x points) to at most max_points points per path by averaging consecutive points. Returns the
+    first x of each bin and the binned paths.
+    """
+    n_points = paths.shape[1]
+
+    if n_points <= max_points:
+        return x, paths
+
+    edges = np.linspace(0, n_points, max_points + 1).astype(int)[:-1]
+    counts = np.diff(np.append(edges, n_points))
+
+    return x[edges], np.add.reduceat(paths, edges, axis=1) / counts
+
+
+def draw_fan_chart(ax, x, paths: np.ndarray, bands: Sequence[Sequence[float]] = DEFAULT_BANDS, n_sample_paths: int = 30,
+                   max_points: int = 1000, color: str = 'tab:blue', seed: int = 0, highlight: Optional[Dict[str, np.ndarray]] = None):
+    """
+    Draws a fan chart of (paths x points) on ax: percentile bands as a single PolyCollection, the median and a random
+    sample of n_sample_paths paths as LineCollections, after downsampling to max_points points. highlight optionally
+    maps labels to single paths drawn on top (e.g. the anchor profiles), one value per x, downsampled with the same bins.
+    """
+    from matplotlib.collections import LineCollection, PolyCollection
+    import matplotlib.dates as mdates
+
+    x = np.asarray(x)
+    paths = np.asarray(paths, dtype='float64')
+
+    is_date = np.issubdtype(x.dtype, np.datetime64)
+    x_numeric = mdates.date2num(x) if is_date else x.astype('float64')
+
+    x_numeric, binned = downsample_paths(x_numeric, paths, max_points)
+
+    percentiles = sorted({p for band in bands for p in band} | {50})
+    values = dict(zip(percentiles, np.nanpercentile(binned, percentiles, axis=0)))
+
+    # One polygon per band: lower edge forward, upper edge backward
+    polygons = [np.column_stack([np.concatenate([x_numeric, x_numeric[::-1]]),
+                                 np.concatenate([values[low], values[high][::-1]])]) for low, high in bands]
+    alphas = np.linspace(0.2, 0.45, len(bands))
+    ax.add_collection(PolyCollection(polygons, facecolors=[(*_rgb(color), alpha) for alpha in alphas], edgecolors='none', zorder=1))
+
+    if n_sample_paths and len(binned):
+        sample = np.random.default_rng(seed).choice(len(binned), size=min(n_sample_paths, len(binned)), replace=False)
+        segments = np.stack([np.broadcast_to(x_numeric, binned[sample].shape), binned[sample]], axis=-1)
+        ax.add_collection(LineCollection(segments, colors='gray', linewidths=0.5, alpha=0.5, zorder=2))
+
+    ax.add_collection(LineCollection([np.column_stack([x_numeric, values[50]])], colors=[color], linewidths=1.5, zorder=3, label='P50'))
+
+    for position, (label, line) in enumerate((highlight or {}).items()):
+        line = np.asarray(line, dtype='float64')[None, :]
+
+        if line.shape[1] != len(x):
+            raise ValueError(f"Highlight {label} has {line.shape[1]} points, but x has {len(x)}.")
+
+        line = downsample_paths(x, line, max_points)[1]
+        ax.add_collection(LineCollection([np.column_stack([x_numeric, line[0]])], colors=[HIGHLIGHT_COLORS[position % len(HIGHLIGHT_COLORS)]],
+                                         linewidths=1.5, zorder=4, label=label))
+
+    ax.autoscale_view()
+
+    if is_date:
+        ax.xaxis_date()
+
+    return ax
+
+
+def _rgb(color: str):
+    from matplotlib.colors import to_rgb
+    return to_rgb(color)
+
+
+def render_fan_chart(output_path: Union[str, Path], x, paths: np.ndarray, title: str = '', xlabel: str = '', ylabel: str = '',
+                     figsize=(10, 6), dpi: int = 100, **fan_kwargs) -> Path:
+    """
+    Renders a fan chart straight to a file without pyplot (Agg canvas), so it can run headless and in worker
+    processes.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+
+    draw_fan_chart(ax, x, paths, **fan_kwargs)
+
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.grid(True, alpha=0.3)
+    ax.legend(loc='upper left', fontsize='small')
+    fig.tight_layout()
+
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    fig.savefig(output_path)
+
+    return output_path
+
+
+def _render_job(job: Dict[str, Any]) -> Path:
+    return render_fan_chart(**job)
+
+
+def render_fan_charts(jobs: List[Dict[str, Any]], workers: Optional[int] = None) -> List[Path]:
+    """
+    Renders a batch of fan charts (keyword arguments of render_fan_chart) over a process pool of `workers`
+    processes (default: all cores; 1 renders in-process).
+    """
+    if workers == 1:
+        return [_render_job(job) for job in jobs]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_render_job, jobs))
+
+
+def deck_chart_jobs(store, deck: str, output_dir: Union[str, Path] = general_input.charts_path,
+                    submarkets: Optional[Sequence[str]] = None, **fan_kwargs) -> List[Dict[str, Any]]:
+    """
+    Builds the report chart jobs of a NEWAVE deck from a PriceScenarioStore or VirtualPriceScenarioStore: per
+    submarket, the fan of monthly average prices and the fan of average prices by hour of day across all
+    (scenario_nw, simulated_scenario) paths. The store is streamed scenario by scenario into (paths x months) and
+    (paths x 24) arrays, so the hourly prices are never held in memory at once.
+    """
+    output_dir = Path(output_dir) / deck
+    jobs = []
+
+    available = store.submarkets if hasattr(store, 'submarkets') else list(store.index()['submarket'].unique())
+
+    for submarket in (available if submarkets is None else [sub for sub in submarkets if sub in available]):
+        monthly_paths, hourly_paths, months, cached_dates = [], [], None, None
+
+        for frame in store.iter_read(submarkets=[submarket], days=None):
+            dates = frame.index.to_numpy()
+
+            # Scenarios of a submarket share their dates
+            if cached_dates is None or not np.array_equal(cached_dates, dates):
+                month_codes, months = pd.factorize(dates.astype('datetime64[M]'), sort=True)
+                hour = pd.DatetimeIndex(dates).hour.to_numpy()
+                cached_dates = dates
+
+            path_codes, _ = pd.factorize(frame['simulated_scenario'].to_numpy())
+            price = frame['hourly_price'].to_numpy(dtype='float64')
+
+            n_paths, n_months = path_codes.max() + 1, len(months)
+
+            def path_mean(codes, n_cells):
+                cells = path_codes * n_cells + codes
+                return (np.bincount(cells, weights=price, minlength=n_paths * n_cells)
+                        / np.bincount(cells, minlength=n_paths * n_cells)).reshape(n_paths, n_cells)
+
+            monthly_paths.append(path_mean(month_codes, n_months))
+            hourly_paths.append(path_mean(hour, 24))
+
+        if not monthly_paths:
+            print(f"No price scenarios for submarket {submarket}. Skipping its charts.")
+            continue
+
+        tag = submarket.replace('/', '_')
+
+        jobs.append(dict(
+            output_path=output_dir / f"monthly_price_{tag}.png", x=np.asarray(months, dtype='datetime64[D]'),
+            paths=np.vstack(monthly_paths), title=f"{deck} - PLD médio mensal - {submarket}",
+            xlabel='Mês', ylabel='R$/MWh', **fan_kwargs
+        ))
+        jobs.append(dict(
+            output_path=output_dir / f"hourly_profile_{tag}.png", x=np.arange(24),
+            paths=np.vstack(hourly_paths), title=f"{deck} - PLD médio por hora - {submarket}",
+            xlabel='Hora', ylabel='R$/MWh', **fan_kwargs
+        ))
+
+    return jobs
+
+
+def render_deck_charts(store, deck: str, output_dir: Union[str, Path] = general_input.charts_path,
+                       submarkets: Optional[Sequence[str]] = None, workers: Optional[int] = None, **fan_kwargs) -> List[Path]:
+    """Builds and renders the report chart set of a NEWAVE deck (see deck_chart_jobs) in a worker pool."""
+    return render_fan_charts(deck_chart_jobs(store, deck, output_dir, submarkets, **fan_kwargs), workers=workers)
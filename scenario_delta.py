@@ -0,0 +1,393 @@
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Tuple, Union
+import general_input
+from price_scenario_store import PriceScenarioStore, VirtualPriceScenarioStore
+from scenario_sketches import ScenarioRiskSketch
+
+
+AGGREGATES = ['price_sum', 'hours', 'wind_gp', 'wind_g', 'solar_gp', 'solar_g']
+MISSING = np.uint64(0)
+INACTIVE = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _mix(h: np.ndarray, value) -> np.ndarray:
+    """Combines value into the uint64 hashes h (splitmix64 finalizer)."""
+    with np.errstate(over='ignore'):
+        z = (np.asarray(h, dtype='uint64') ^ np.asarray(value, dtype='uint64')) + INACTIVE
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        z = z ^ (z >> np.uint64(31))
+
+    # 0 marks cells without a fingerprint
+    return np.where(z == MISSING, np.uint64(1), z)
+
+
+def _bits(values: np.ndarray) -> np.ndarray:
+    """Raw bits of float32 or float64 values as uint64."""
+    values = np.ascontiguousarray(values)
+    return (values.view('uint32') if values.dtype == np.float32 else values.view('uint64')).astype('uint64')
+
+
+def _hash_columns(values: np.ndarray) -> np.ndarray:
+    """One hash per column of a (rows x columns) array."""
+    h = np.zeros(values.shape[1], dtype='uint64')
+    for row in _bits(values):
+        h = _mix(h, row)
+    return h
+
+
+class IncrementalScenarioResults:
+    """
+    Dependency-tracked store of the hourly price scenarios and future capture aggregates of one NEWAVE deck.
+
+    A cell is (scenario_nw, simulated_scenario, submarket, month) of the deck. Its price fingerprint hashes what the
+    hourly prices of the cell depend on: the clipped monthly PLD, the 24-hour PU profile of the simulated scenario
+    and the PLD limits that are active on the cell (the lower limit only if some hour of the cell falls below it,
+    the upper one only if some hour exceeds it). Its capture fingerprint adds the hour-of-day sums of the future
+    wind and solar generation of the (submarket, month), which is all the capture aggregates use, since the price
+    of a cell only varies with the hour of day.
+
+    update compares the fingerprints with the stored ones and recomputes only the cells that changed: the part
+    files (one per submarket and block of chunk_size scenario_nw) holding a changed cell are rewritten, and the
+    additive capture aggregates of changed cells are replaced in the stored tensor. A new deck, an edited anchor
+    profile, new PLD limits or a new month of generation shapes cost time in proportion to the cells they touch.
+
+    Layout (under path / deck=<deck>):
+        state.npz           axes, fingerprints and (submarket, scenario_nw, simulated_scenario, month) aggregates
+        prices/             PriceScenarioStore dataset of the deck
+    """
+
+    STATE_FILE = 'state.npz'
+    PRICES_DIR = 'prices'
+
+    def __init__(self, deck: str, path: Union[str, Path] = general_input.scenario_results_path, chunk_size: int = 8):
+        """
+        Args:
+            deck (str): Name of the NEWAVE deck.
+            path (Path): Root directory of the results of every deck.
+            chunk_size (int): Number of scenario_nw per part file.
+        """
+        self.deck = deck
+        self.path = Path(path) / f"deck={deck}"
+        self.chunk_size = chunk_size
+        self.store = PriceScenarioStore(self.path / self.PRICES_DIR)
+
+        self.state: Dict[str, np.ndarray] = self._load_state()
+
+    # State
+
+    def _load_state(self) -> Dict[str, np.ndarray]:
+        state_path = self.path / self.STATE_FILE
+
+        if not state_path.exists():
+            return {}
+
+        with np.load(state_path) as state:
+            return {name: state[name] for name in state.files}
+
+    def _save_state(self) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        np.savez(self.path / self.STATE_FILE, **self.state)
+
+    @staticmethod
+    def _month_ids(months: pd.PeriodIndex) -> np.ndarray:
+        return months.year.to_numpy() * 12 + months.month.to_numpy() - 1
+
+    def _align(self, array: np.ndarray, axes: Dict[str, np.ndarray], fill, prefix: str = '') -> np.ndarray:
+        """
+        Reindexes a stored (submarket, scenario_nw, simulated_scenario, month, ...) array onto new axes (prefix
+        selects the stored axes it was built on: '' for the last update, 'part_' for the part files on disk).
+        """
+        positions = [pd.Index(self.state[prefix + name]).get_indexer(axes[name]) for name in ['submarkets', 'scenario_ids', 'simulated_scenarios', 'months']]
+
+        aligned = np.full(tuple(len(position) for position in positions) + array.shape[4:], fill, dtype=array.dtype)
+        found = [position >= 0 for position in positions]
+
+        aligned[np.ix_(*[np.flatnonzero(mask) for mask in found])] = array[np.ix_(*[position[mask] for position, mask in zip(positions, found)])]
+
+        return aligned
+
+    # Fingerprints
+
+    @staticmethod
+    def _profiles(virtual_store: VirtualPriceScenarioStore) -> np.ndarray:
+        """(submarkets, 24, simulated_scenarios) profiles."""
+        profile = virtual_store.profile
+        return profile if profile.ndim == 3 else np.broadcast_to(profile, (len(virtual_store.submarkets),) + profile.shape)
+
+    def price_fingerprints(self, virtual_store: VirtualPriceScenarioStore, limits: dict) -> np.ndarray:
+        """(submarkets, scenario_nw, simulated_scenarios, months) fingerprints of the hourly prices of each cell."""
+        lower, upper = limits['min'][0], limits['max'][0]
+
+        monthly_pld = np.clip(virtual_store.pld, lower, upper)                      # (sub, nw, month)
+        profiles = self._profiles(virtual_store)                                    # (sub, 24, sim)
+
+        profile_hash = np.stack([_hash_columns(profile) for profile in profiles])   # (sub, sim)
+        profile_min, profile_max = profiles.min(axis=1), profiles.max(axis=1)        # (sub, sim)
+
+        lowest = monthly_pld[:, :, None, :] * profile_min[:, None, :, None]
+        highest = monthly_pld[:, :, None, :] * profile_max[:, None, :, None]
+
+        fingerprint = _mix(_bits(monthly_pld)[:, :, None, :], profile_hash[:, None, :, None])
+        fingerprint = _mix(fingerprint, np.where(lowest < lower, _bits(np.float64([lower]))[0], INACTIVE))
+        fingerprint = _mix(fingerprint, np.where(highest > upper, _bits(np.float64([upper]))[0], INACTIVE))
+
+        return fingerprint
+
+    @staticmethod
+    def generation_hour_sums(virtual_store: VirtualPriceScenarioStore, future_hourly_re_gen: pd.DataFrame) -> np.ndarray:
+        """
+        (submarkets, months, 24, 2) wind and solar generation summed by hour of day over the hours of the store,
+        with NEWAVE submarkets matched through general_input.NEWAVE_RE_SUBMARKET_MAP.
+        """
+        n_months = len(virtual_store.months)
+        cells = virtual_store.month_position.astype('int64') * 24 + virtual_store.hour
+        sums = np.zeros((len(virtual_store.submarkets), n_months, 24, 2))
+
+        generation_submarkets = future_hourly_re_gen.index.get_level_values('submarket')
+
+        for position, submarket in enumerate(virtual_store.submarkets):
+            re_submarket = general_input.NEWAVE_RE_SUBMARKET_MAP.get(submarket, submarket)
+            generation = future_hourly_re_gen.loc[generation_submarkets == re_submarket].droplevel('submarket')
+
+            if generation.empty:
+                print(f"No future RE generation for submarket {submarket}. Its capture prices are NaN.")
+                continue
+
+            hour_position = generation.index.get_indexer(virtual_store.dates)
+            aligned = hour_position >= 0
+
+            for column, technology in enumerate(['wind_generation_MWh', 'solar_generation_MWh']):
+                values = generation[technology].to_numpy(dtype='float64')[hour_position[aligned]]
+                known = ~np.isnan(values)
+                sums[position, :, :, column] = np.bincount(cells[aligned][known], weights=values[known], minlength=n_months * 24).reshape(n_months, 24)
+
+        return sums
+
+    # Recomputation
+
+    def _chunk(self, scenario_ids: np.ndarray) -> np.ndarray:
+        return scenario_ids // self.chunk_size
+
+    def _write_parts(self, virtual_store: VirtualPriceScenarioStore, changed: np.ndarray, limits: dict,
+                     full: bool) -> Tuple[Dict[str, int], np.ndarray]:
+        """
+        Rewrites the part files holding changed cells (every part file if full, or if the file is missing) and removes
+        the parts of scenarios no longer in the deck. Returns the number of parts written per submarket and a
+        (submarkets, scenario_nw) mask of the scenarios whose parts were written.
+        """
+        if full:
+            self.store.write_time_axis(pd.DatetimeIndex(virtual_store.dates))
+
+        chunks = self._chunk(virtual_store.scenario_ids)
+        part_names = {chunk: f"part-{int(chunk) * self.chunk_size:05d}.parquet" for chunk in np.unique(chunks)}
+        written = {}
+        written_scenarios = np.zeros((len(virtual_store.submarkets), len(chunks)), dtype=bool)
+
+        # Parts whose set of scenario_nw changed (scenarios added to or removed from the deck) are rewritten too
+        regrouped = np.zeros(len(chunks), dtype=bool)
+        if not full:
+            old_ids = self.state['part_scenario_ids']
+            old_chunks = self._chunk(old_ids)
+            for chunk in part_names:
+                regrouped[chunks == chunk] = not np.array_equal(virtual_store.scenario_ids[chunks == chunk], old_ids[old_chunks == chunk])
+
+        for position, submarket in enumerate(virtual_store.submarkets):
+            if full:
+                self.store.reset_submarket(submarket)
+
+            rewrite = full | changed[position].any(axis=(1, 2)) | regrouped
+            for chunk, part_name in part_names.items():
+                if not (self.store.submarket_path(submarket) / part_name).exists():
+                    rewrite[chunks == chunk] = True
+
+            rewrite_chunks = np.unique(chunks[rewrite])
+
+            for chunk in rewrite_chunks:
+                scenario_ids = virtual_store.scenario_ids[chunks == chunk]
+                hourly_price, _, simulated, _ = virtual_store.prices(submarket, scenario_ids, limits=limits)
+                self.store.write_part(submarket, int(chunk) * self.chunk_size, scenario_ids, simulated, hourly_price)
+
+            for part_file in self.store.submarket_path(submarket).glob('part-*.parquet'):
+                if part_file.name not in part_names.values():
+                    part_file.unlink()
+
+            written[submarket] = len(rewrite_chunks)
+            written_scenarios[position] = rewrite
+
+        for submarket_path in self.store.path.glob('submarket=*'):
+            if submarket_path.name not in {self.store.submarket_path(sub).name for sub in virtual_store.submarkets}:
+                self.store.reset_submarket(submarket_path.name.split('=', 1)[1])
+
+        return written, written_scenarios
+
+    @staticmethod
+    def _cell_aggregates(virtual_store: VirtualPriceScenarioStore, profiles: np.ndarray, hour_sums: np.ndarray, limits: dict,
+                         submarket: int, cells: np.ndarray, batch_size: int = 200_000) -> np.ndarray:
+        """
+        (cells x AGGREGATES) capture aggregates of the (scenario, simulated scenario, month) positions in cells: the
+        hourly price of a cell is clip(monthly PLD x profile[hour of day]), so every sum over the hours of the month
+        reduces to 24 hour-of-day terms.
+        """
+        lower, upper = limits['min'][0], limits['max'][0]
+        days = virtual_store.months.to_timestamp().days_in_month.to_numpy()
+
+        monthly_pld = np.clip(virtual_store.pld[submarket], lower, upper)
+        aggregates = np.empty((len(cells), len(AGGREGATES)))
+
+        for start in range(0, len(cells), batch_size):
+            scenario, simulated, month = cells[start:start + batch_size].T
+
+            price = np.clip(monthly_pld[scenario, month][:, None] * profiles[submarket][:, simulated].T, lower, upper).astype('float64')
+            wind, solar = hour_sums[submarket, month, :, 0], hour_sums[submarket, month, :, 1]
+
+            aggregates[start:start + batch_size] = np.column_stack([
+                days[month] * price.sum(axis=1), days[month] * 24.0,
+                (wind * price).sum(axis=1), wind.sum(axis=1),
+                (solar * price).sum(axis=1), solar.sum(axis=1),
+            ])
+
+        return aggregates
+
+    def update(self, virtual_store: VirtualPriceScenarioStore, future_hourly_re_gen: Optional[pd.DataFrame] = None,
+               limits: Optional[dict] = None, write_prices: bool = True) -> pd.DataFrame:
+        """
+        Brings the stored results of the deck up to date with virtual_store (the factors of
+        ScenarioGenerator.build_virtual_price_store), the PLD limits (default general_input.MONTHLY_PLD_LIMITS) and the
+        future RE generation (EnergyAnalysisService.calculate_final_monthly_generation layout; without it the capture
+        aggregates are left as stored). Returns, per submarket, the number of cells and of changed price and capture
+        cells, and the number of part files written.
+        """
+        limits = limits if limits is not None else general_input.MONTHLY_PLD_LIMITS
+
+        axes = {
+            'submarkets': np.asarray(virtual_store.submarkets, dtype=str),
+            'scenario_ids': virtual_store.scenario_ids,
+            'simulated_scenarios': virtual_store.simulated_scenarios,
+            'months': self._month_ids(virtual_store.months),
+        }
+
+        price_fingerprint = self.price_fingerprints(virtual_store, limits)
+
+        stored = bool(self.state)
+        old_price = self._align(self.state['price_fingerprint'], axes, MISSING) if stored else np.zeros_like(price_fingerprint)
+        changed_prices = price_fingerprint != old_price
+
+        summary = pd.DataFrame(index=pd.Index(virtual_store.submarkets, name='submarket'))
+        summary['cells'] = int(np.prod(price_fingerprint.shape[1:]))
+        summary['price_cells_changed'] = changed_prices.sum(axis=(1, 2, 3))
+
+        new_state = dict(axes, price_fingerprint=price_fingerprint)
+
+        # The part files are tracked apart (part_* axes and part_fingerprint), since update(write_prices=False) leaves them as they are
+        if write_prices:
+            # Parts hold every simulated scenario on the shared time axis, so changing either rewrites them all
+            full = (not self.store.exists() or 'part_fingerprint' not in self.state
+                    or not np.array_equal(self.state['part_months'], axes['months'])
+                    or not np.array_equal(self.state['part_simulated_scenarios'], axes['simulated_scenarios']))
+
+            old_part = np.zeros_like(price_fingerprint) if full else self._align(self.state['part_fingerprint'], axes, MISSING, prefix='part_')
+
+            written, written_scenarios = self._write_parts(virtual_store, price_fingerprint != old_part, limits, full)
+            summary['parts_written'] = pd.Series(written)
+
+            new_state.update({f"part_{name}": values for name, values in axes.items()})
+            new_state['part_fingerprint'] = np.where(written_scenarios[:, :, None, None], price_fingerprint, old_part)
+
+        elif 'part_fingerprint' in self.state:
+            new_state.update({name: values for name, values in self.state.items() if name.startswith('part_')})
+
+        if future_hourly_re_gen is not None:
+            hour_sums = self.generation_hour_sums(virtual_store, future_hourly_re_gen)
+            generation_hash = _hash_columns(hour_sums.reshape(-1, 48).T).reshape(hour_sums.shape[:2])  # (sub, month)
+
+            capture_fingerprint = _mix(price_fingerprint, generation_hash[:, None, None, :])
+
+            if stored and 'capture_fingerprint' in self.state:
+                old_capture = self._align(self.state['capture_fingerprint'], axes, MISSING)
+                aggregates = self._align(self.state['aggregates'], axes, np.nan)
+            else:
+                old_capture = np.zeros_like(capture_fingerprint)
+                aggregates = np.full(capture_fingerprint.shape + (len(AGGREGATES),), np.nan)
+
+            changed_capture = capture_fingerprint != old_capture
+            profiles = self._profiles(virtual_store)
+
+            for submarket in range(len(virtual_store.submarkets)):
+                cells = np.argwhere(changed_capture[submarket])
+                if len(cells):
+                    aggregates[submarket][tuple(cells.T)] = self._cell_aggregates(virtual_store, profiles, hour_sums, limits, submarket, cells)
+
+            summary['capture_cells_changed'] = changed_capture.sum(axis=(1, 2, 3))
+            new_state.update(capture_fingerprint=capture_fingerprint, aggregates=aggregates)
+
+        elif stored and 'capture_fingerprint' in self.state:
+            # Prices changed without new generation: keep the aggregates of the cells whose prices did not change
+            old_capture = self._align(self.state['capture_fingerprint'], axes, MISSING)
+            aggregates = self._align(self.state['aggregates'], axes, np.nan)
+            aggregates[changed_prices] = np.nan
+            old_capture[changed_prices] = MISSING
+            new_state.update(capture_fingerprint=old_capture, aggregates=aggregates)
+
+        self.state = new_state
+        self._save_state()
+
+        return summary
+
+    # Results
+
+    def capture_cells(self) -> pd.DataFrame:
+        """Stored capture aggregates per (submarket, scenario_nw, simulated_scenario, month)."""
+        if 'aggregates' not in self.state:
+            return pd.DataFrame()
+
+        index = pd.MultiIndex.from_product([
+            self.state['submarkets'], self.state['scenario_ids'], self.state['simulated_scenarios'],
+            pd.PeriodIndex([pd.Period(year=month // 12, month=month % 12 + 1, freq='M') for month in self.state['months']], freq='M'),
+        ], names=['submarket', 'scenario_nw', 'simulated_scenario', 'month'])
+
+        return pd.DataFrame(self.state['aggregates'].reshape(-1, len(AGGREGATES)), index=index, columns=AGGREGATES)
+
+    def capture_summary(self, freq: Union[str, Sequence[str]] = 'M', quantiles: Sequence[float] = (0.05, 0.5, 0.95),
+                        alpha: float = 0.05) -> pd.DataFrame:
+        """
+        Distribution across (scenario_nw, simulated_scenario) of base price and wind and solar capture prices and rates
+        per (metric, submarket, period), in the layout of CaptureIndicators.future_capture_rate_calculate (without
+        the hourly_price metric, which needs the hourly values). Built from the stored aggregates only.
+        """
+        if 'aggregates' not in self.state:
+            print("No capture aggregates stored. Run update with the future RE generation first.")
+            return pd.DataFrame()
+
+        sketch = ScenarioRiskSketch()
+        months = pd.PeriodIndex([pd.Period(year=month // 12, month=month % 12 + 1, freq='M') for month in self.state['months']], freq='M')
+
+        for period_freq in ([freq] if isinstance(freq, str) else freq):
+            period_codes, period_labels = pd.factorize(months.asfreq(period_freq), sort=True)
+            n_periods = len(period_labels)
+
+            for submarket, aggregates in zip(self.state['submarkets'], self.state['aggregates']):
+                # Sum the months of each period -> (scenario, simulated, period, aggregate)
+                totals = np.zeros(aggregates.shape[:2] + (n_periods, len(AGGREGATES)))
+                for month, code in enumerate(period_codes):
+                    totals[:, :, code] += aggregates[:, :, month]
+
+                price_sum, hours, wind_gp, wind_g, solar_gp, solar_g = np.moveaxis(totals, -1, 0)
+
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    base_price = price_sum / hours
+                    metrics = {
+                        'base_price': base_price,
+                        'wind_cap_price': wind_gp / wind_g,
+                        'solar_cap_price': solar_gp / solar_g,
+                    }
+                    metrics['wind_cap_rate'] = metrics['wind_cap_price'] / base_price
+                    metrics['solar_cap_rate'] = metrics['solar_cap_price'] / base_price
+
+                codes = np.broadcast_to(np.arange(n_periods), base_price.shape).ravel()
+                for metric, values in metrics.items():
+                    sketch.update([(metric, str(submarket), str(period)) for period in period_labels], codes, values.ravel())
+
+        return sketch.to_frame(key_names=('metric', 'submarket', 'month' if freq == 'M' else 'period'), quantiles=quantiles, alpha=alpha)
@@ -1,10 +1,14 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 from pathlib import Path
-from typing import List
+from typing import Any, Dict, List, Optional, Tuple, Union
 import general_input
 from NEWAVE_Outputs_Data import NewaveDataProcessor
+from price_scenario_store import PriceScenarioStore, VirtualPriceScenarioStore, hourly_price_kernel
+from scenario_delta import IncrementalScenarioResults
+from shape_statistics import ShapeStatisticsStore
 
 class ScenarioGenerator:
     
@@ -70,9 +74,87 @@ class ScenarioGenerator:
 
               return scenarios
 
-       def plot_scenarios(self, scenarios: pd.DataFrame):
+       @staticmethod
+       def average_anchor(shape_store: Optional[ShapeStatisticsStore] = None, submarket: str = general_input.average_scenario_submarket,
+                          start_date: str = general_input.average_scenario_window[0],
+                          end_date: str = general_input.average_scenario_window[1]) -> List[float]:
               """
-              Plots the generated scenarios.
+              Returns the average anchor profile: the 24-hour Hourly_PLD shape of the submarket over the window, from the
+              shape statistics store (default: the one at general_input.shape_statistics_path). Falls back to
+              general_input.average_scenario_full while the store holds no PLD of the submarket and window.
+              """
+
+              shape_store = shape_store if shape_store is not None else ShapeStatisticsStore()
+              profile = shape_store.anchor_profile(submarket, start_date, end_date)
+
+              if not profile or np.isnan(profile).any():
+                     print(f"No complete Hourly_PLD shape of {submarket} between {start_date} and {end_date} in the shape store. "
+                           "Using general_input.average_scenario_full.")
+                     return list(general_input.average_scenario_full)
+
+              return profile
+
+       def fit_profile_noise(self, historical_hourly_price: pd.DataFrame, submarket: Optional[str] = None) -> np.ndarray:
+              """
+              Fits the (24 x 24) covariance of daily PU shape deviations from the hourly prices (date x submarket)
+              returned by EnergyAnalysisService.calculate_price_historical_shape. All submarkets are pooled unless
+              one is given.
+              """
+
+              prices = historical_hourly_price if submarket is None else historical_hourly_price[[submarket]]
+              
+              daily = prices.groupby([prices.index.normalize(), prices.index.hour]).mean() # type: ignore
+              daily = daily.stack().unstack(1).dropna() # (day, submarket) x hour, complete days only
+
+              daily_shapes = daily.to_numpy(dtype='float64')
+              daily_shapes = daily_shapes / daily_shapes.mean(axis=1, keepdims=True)
+
+              return np.cov(daily_shapes, rowvar=False)
+
+       def sample_profiles(self, n_samples: int, anchors: Optional[List[List[float]]] = None, noise_cov: Optional[np.ndarray] = None,
+                           noise_scale: float = 1.0, seed: Optional[int] = None, evenly_spaced: bool = False,
+                           normalize: bool = True) -> pd.DataFrame:
+              """
+              Samples n_samples 24-hour PU profiles at once.
+
+              Each profile is a point on the piecewise-linear path through the anchors (default: base, average, duck
+              curve and canyon curve), parameterized by cumulative L1 distance as in generate_scenarios, at a uniform
+              random position (or evenly spaced positions). Optional multivariate normal noise with covariance
+              noise_cov (see fit_profile_noise) scaled by noise_scale is added, negative values are clipped and each
+              profile is renormalized to mean 1. Reproducible for a given seed.
+              """
+
+              rng = np.random.default_rng(seed)
+              anchor_array = np.asarray(anchors if anchors is not None else self.anchor_list, dtype='float64')
+
+              if len(anchor_array) == 1:
+                     profiles = np.repeat(anchor_array, n_samples, axis=0)
+              else:
+                     segment_length = np.abs(np.diff(anchor_array, axis=0)).sum(axis=1)
+                     cumulative = np.concatenate([[0.0], np.cumsum(segment_length)]) / segment_length.sum()
+
+                     position = np.linspace(0, 1, n_samples) if evenly_spaced else rng.uniform(size=n_samples)
+                     segment = np.clip(np.searchsorted(cumulative, position, side='right') - 1, 0, len(anchor_array) - 2)
+                     weight = (position - cumulative[segment]) / np.maximum(cumulative[segment + 1] - cumulative[segment], 1e-12)
+
+                     profiles = (1 - weight)[:, None] * anchor_array[segment] + weight[:, None] * anchor_array[segment + 1]
+
+              if noise_cov is not None:
+                     profiles = profiles + noise_scale * rng.multivariate_normal(np.zeros(self.hours_n), noise_cov, size=n_samples, method='eigh')
+                     profiles = np.clip(profiles, 0, None)
+
+              if normalize:
+                     profiles = profiles / profiles.mean(axis=1, keepdims=True)
+
+              return pd.DataFrame(profiles.T, 
+                                  index=self.index_range, 
+                                  columns=np.arange(1, n_samples + 1).astype(str))
+
+       def plot_scenarios(self, scenarios: pd.DataFrame, output_path: Optional[Union[str, Path]] = None):
+              """
+              Plots the generated scenarios. With output_path, the chart is rendered headless to that file as a fan
+              chart (percentile bands, sampled profiles and the anchors drawn as collections), which stays fast for
+              thousands of sampled profiles.
               """
 
               anchor_indices = [1, 2, 10, 21]
@@ -84,6 +166,22 @@ class ScenarioGenerator:
               ]
               map_anchor = dict(zip(anchor_indices, anchor_list_name))
 
+              if output_path is not None:
+                     from scenario_charts import render_fan_chart
+
+                     # Anchor profiles themselves, since sampled profiles have no fixed anchor columns
+                     highlight = dict(zip(anchor_list_name, self.anchor_list))
+
+                     return render_fan_chart(output_path, 
+                                             x=scenarios.index.astype(int).to_numpy(), 
+                                             paths=scenarios.to_numpy(dtype='float64').T, 
+                                             title='Evolução dos Cenários', 
+                                             xlabel='Hora', 
+                                             ylabel='PU (%)', 
+                                             highlight=highlight)
+
+              import matplotlib.pyplot as plt
+
               plt.style.use('seaborn-v0_8-whitegrid')
               fig, ax = plt.subplots(figsize=(10, 6))
 
@@ -113,13 +211,40 @@ class ScenarioGenerator:
               plt.tight_layout()
               plt.show()
 
-       def hourly_price_scenario_optimized(self, start_date) -> None: # Retun None due to chunked processing
+       def _submarket_profiles(self, scenarios: pd.DataFrame, submarkets: List[str],
+                               profiles: Optional[Dict[str, pd.DataFrame]] = None) -> np.ndarray:
+              """
+              Returns the (submarkets, 24, simulated_scenarios) PU profile tensor. Submarkets without a specific
+              profile in profiles use the generated scenarios.
+              """
+
+              profiles = profiles or {}
+
+              return np.stack([
+                     profiles[submarket].reindex(index=scenarios.index, columns=scenarios.columns).to_numpy(dtype='float32')
+                     if submarket in profiles else scenarios.to_numpy(dtype='float32')
+                     for submarket in submarkets
+              ])
+
+       def hourly_price_scenario_optimized(self, start_date, workers: Optional[int] = None, chunk_size: int = 8,
+                                           submarkets: Optional[List[str]] = None,
+                                           profiles: Optional[Dict[str, pd.DataFrame]] = None,
+                                           scenarios: Optional[pd.DataFrame] = None) -> None: # Retun None due to chunked processing
               """
-              Converts PU scenarios to hourly price scenarios using chunked processing
-              by price scenario (scenario_nw) and saves each to Parquet to avoid MemoryErrors.
+              Converts PU scenarios to hourly price scenarios and saves them to the PriceScenarioStore dataset
+              in general_input.price_scenarios_path (one part file per submarket and chunk of price scenarios).
+
+              hourly price[submarket, scenario, simulated_scenario, hour] =
+                     clip(monthly PLD[submarket, scenario, month] x PU profile[submarket, hour of day, simulated_scenario])
+              is computed by NumPy broadcasting on compact arrays, for every submarket in submarkets (default: ['SE/CO'])
+              from a single NEWAVE load. profiles optionally maps submarkets to their own
+              (24 x simulated_scenario) PU profiles, and scenarios replaces the generated ones (e.g. with
+              sample_profiles). Chunks of chunk_size scenarios are spread over a process pool of
+              `workers` processes (default: all cores; 1 runs in-process) that share the PLD and profile arrays through
+              shared memory.
               """
 
-              scenarios = self.generate_scenarios() 
+              scenarios = scenarios if scenarios is not None else self.generate_scenarios() 
               processor = NewaveDataProcessor(
                      newave_csv_path=general_input.newave_csv, 
                      re_excel_path=general_input.re_excel, 
@@ -127,86 +252,207 @@ class ScenarioGenerator:
               )
               processor.process_all_data()
 
+              submarkets = submarkets if submarkets is not None else ['SE/CO']
+
+              # A submarket missing from the deck would otherwise become all-NaN prices
+              deck_submarkets = list(processor.pld_data['submarket'].unique())
+              unknown_submarkets = [submarket for submarket in submarkets if submarket not in deck_submarkets]
+
+              if unknown_submarkets:
+                     raise ValueError(f"Submarket(s) {unknown_submarkets} not in the NEWAVE deck. Valid submarkets: {deck_submarkets}.")
+
               price_lookup = processor.pld_data.loc[
-                     processor.pld_data['submarket'] == 'SE/CO'
-              ].copy()
+                     processor.pld_data['submarket'].isin(submarkets)
+              ]
 
-              price_lookup['year'] = price_lookup.index.year.astype(int)    # type: ignore
-              price_lookup['month'] = price_lookup.index.month.astype(int)  # type: ignore
+              # (submarket, scenario_nw) x month PLD matrix
+              pld_matrix = price_lookup.pivot_table(
+                     index=['submarket', price_lookup['scenario_nw'].astype(int)], 
+                     columns=price_lookup.index.to_period('M'), # type: ignore
+                     values='pld_nw', 
+                     aggfunc='mean'
+              )
 
-              price_lookup['scenario_nw'] = price_lookup['scenario_nw'].astype(int)
-              price_lookup['pld_nw'] = price_lookup['pld_nw'].astype('float32')
-              
-              price_lookup = price_lookup[
-                     ['year', 'month', 'scenario_nw', 'pld_nw']
-              ].drop_duplicates()
+              price_scenarios_list = np.sort(pld_matrix.index.get_level_values('scenario_nw').unique().to_numpy())
+              pld_matrix = pld_matrix.reindex(pd.MultiIndex.from_product([submarkets, price_scenarios_list]))
 
               first_date = processor.pld_data.index.min()
               last_date = pd.to_datetime(f'{processor.pld_data.index.max().year}-{processor.pld_data.index.max().month}-01') + pd.DateOffset(months=1) - pd.DateOffset(hours=1)
               full_date = pd.date_range(start=first_date, end=last_date, freq='h')
 
-              hourly_df = pd.DataFrame(index=full_date)
-              hourly_df['year'] = hourly_df.index.year.astype('int16')  # type: ignore
-              hourly_df['month'] = hourly_df.index.month.astype('int8') # type: ignore
-              hourly_df['day'] = hourly_df.index.day.astype('int8')     # type: ignore
-              hourly_df['hour'] = hourly_df.index.hour.astype('int8')   # type: ignore
-              
-              scenarios['hour'] = scenarios.index.astype('int8')
+              month_position = pld_matrix.columns.get_indexer(full_date.to_period('M')).astype('int32')
+
+              # -1 would silently index the last month's PLD
+              if (month_position < 0).any():
+                     missing_months = full_date.to_period('M')[month_position < 0].unique()
+                     raise ValueError(f"No NEWAVE PLD for month(s) {', '.join(str(month) for month in missing_months)} of the horizon.")
+
+              shared_arrays = {
+                     'pld': pld_matrix.to_numpy(dtype='float32').reshape(len(submarkets), len(price_scenarios_list), -1),
+                     'profile': self._submarket_profiles(scenarios, submarkets, profiles),
+                     'month_position': month_position,
+                     'hour': full_date.hour.to_numpy().astype('int8'),
+              }
+
+              simulated_scenarios = scenarios.columns.astype(int).to_numpy()
+
+              store = PriceScenarioStore(general_input.price_scenarios_path)
+              # Rewritten only if the horizon changed, in which case the parts of every submarket are removed
+              store.write_time_axis(full_date)
+              for submarket in submarkets:
+                     store.reset_submarket(submarket)
+
+              chunks = [(start, min(start + chunk_size, len(price_scenarios_list))) for start in range(0, len(price_scenarios_list), chunk_size)]
               
-              hourly_df = hourly_df.merge(scenarios, on='hour', how='left')
+              print(f"Starting chunked processing for {len(price_scenarios_list)} price scenarios and {len(submarkets)} submarket(s)...")
+
+              shared_memory_blocks = []
+
+              try:
+                     specs = {}
+                     for name, array in shared_arrays.items():
+                            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+                            shared_memory_blocks.append(block)
+                            specs[name] = (block.name, array.shape, array.dtype.str)
+
+                     initargs = (specs, price_scenarios_list, simulated_scenarios, submarkets, str(store.path))
+
+                     if workers == 1:
+                            _init_price_worker(*initargs)
+                            processed = [_price_scenario_chunk(chunk) for chunk in chunks]
+                     else:
+                            with ProcessPoolExecutor(max_workers=workers, initializer=_init_price_worker, initargs=initargs) as executor:
+                                   processed = []
+                                   for n_done in executor.map(_price_scenario_chunk, chunks):
+                                          processed.append(n_done)
+                                          print(f"Processed and saved: {sum(processed)}/{len(price_scenarios_list)} price scenarios")
+
+              finally:
+                     _WORKER_STATE.clear()
+                     for block in shared_memory_blocks:
+                            block.close()
+                            block.unlink()
+
+              return None
+
+
+       def build_virtual_price_store(self, start_date, save: bool = True,
+                                     profiles: Optional[Dict[str, pd.DataFrame]] = None,
+                                     scenarios: Optional[pd.DataFrame] = None) -> VirtualPriceScenarioStore:
+              """
+              Builds the factorized price scenario store (NEWAVE PLD tensor of every submarket and the PU profiles,
+              optionally submarket-specific, or scenarios in place of the generated ones) instead of materializing
+              the hourly prices, and saves it to general_input.price_factors_path.
+              """
 
-              profile_base_long = hourly_df.melt(
-                     id_vars=['year', 'month', 'day', 'hour'], 
-                     var_name='simulated_scenario', 
-                     value_name='hourly_profile'
+              scenarios = scenarios if scenarios is not None else self.generate_scenarios()
+              processor = NewaveDataProcessor(
+                     newave_csv_path=general_input.newave_csv, 
+                     re_excel_path=general_input.re_excel, 
+                     start_date=start_date
               )
-              profile_base_long['simulated_scenario'] = profile_base_long['simulated_scenario'].astype('int8')
-              profile_base_long['hourly_profile'] = profile_base_long['hourly_profile'].astype('float32')
+              processor.process_all_data()
 
-              
-              price_scenarios_list = price_lookup['scenario_nw'].unique()
-              
-              output_directory = "cenarios_horarios_finais"
-              Path(output_directory).mkdir(exist_ok=True)
-              
-              print(f"Starting chunked processing for {len(price_scenarios_list)} price scenarios...")
+              # PLD limits are applied at query time, so the factors keep the unclipped NEWAVE PLD
+              raw_pld = processor.raw_data.loc[processor.raw_data.index >= start_date, ['scenario_nw', 'submarket', 'pld_nw']]
+
+              virtual_store = VirtualPriceScenarioStore.from_newave(raw_pld, scenarios)
+
+              if profiles:
+                     virtual_store.profile = self._submarket_profiles(scenarios, virtual_store.submarkets, profiles)
 
-              for price_id in price_scenarios_list:
-                     
-                     current_price_scenario = price_lookup[price_lookup['scenario_nw'] == price_id]
+              if save:
+                     virtual_store.save(general_input.price_factors_path)
+                     print(f"Price scenario factors saved to {general_input.price_factors_path}")
 
-                     temp_df = profile_base_long.merge(
-                     current_price_scenario,
-                     on=['year', 'month'],
-                     how='left' )
+              return virtual_store
 
-                     temp_df['hourly_price'] = temp_df['pld_nw'] * temp_df['hourly_profile']
 
-                     temp_df['hourly_price'] = temp_df['hourly_price'].clip(
+       def update_scenario_results(self, start_date, deck: Optional[str] = None,
+                                   future_hourly_re_gen: Optional[pd.DataFrame] = None,
+                                   profiles: Optional[Dict[str, pd.DataFrame]] = None,
+                                   scenarios: Optional[pd.DataFrame] = None,
+                                   limits: Optional[dict] = None, write_prices: bool = True) -> pd.DataFrame:
+              """
+              Incremental alternative to hourly_price_scenario_optimized: rebuilds the price factors of the deck
+              (default: the stem of general_input.newave_csv) and recomputes only the price part files and capture
+              aggregates of the (scenario_nw, simulated_scenario, submarket, month) cells whose inputs changed since
+              the last update (see IncrementalScenarioResults). Returns the per-submarket change summary.
+              """
+
+              virtual_store = self.build_virtual_price_store(start_date, save=False, profiles=profiles, scenarios=scenarios)
+              results = IncrementalScenarioResults(deck if deck is not None else Path(general_input.newave_csv).stem)
+
+              summary = results.update(virtual_store, future_hourly_re_gen=future_hourly_re_gen, limits=limits, write_prices=write_prices)
+              print(f"Updated deck {results.deck}: {int(summary['price_cells_changed'].sum())} price cells changed.")
+
+              return summary
+
+
+_WORKER_STATE: Dict[str, Any] = {}
+
+
+def _init_price_worker(specs: Dict[str, Tuple[str, Tuple[int, ...], str]], price_scenarios_list: np.ndarray,
+                       simulated_scenarios: np.ndarray, submarkets: List[str], store_path: str) -> None:
+       """Keeps the shared array specs and the output store (the arrays are attached per chunk)."""
+
+       _WORKER_STATE['specs'] = specs
+       _WORKER_STATE['price_scenarios_list'] = price_scenarios_list
+       _WORKER_STATE['simulated_scenarios'] = simulated_scenarios
+       _WORKER_STATE['submarkets'] = submarkets
+       _WORKER_STATE['store'] = PriceScenarioStore(store_path)
+
+
+def _price_scenario_chunk(chunk: Tuple[int, int]) -> int:
+       """
+       Computes the hourly prices of the scenarios in positions [start, end) for every submarket at once and
+       saves them as one part file per submarket.
+       """
+
+       start, end = chunk
+
+       # The shared blocks are attached for the chunk and closed before returning, so no worker keeps a handle open
+       blocks = {name: shared_memory.SharedMemory(name=block_name) for name, (block_name, _, _) in _WORKER_STATE['specs'].items()}
+
+       try:
+              arrays = {name: np.ndarray(shape, dtype=np.dtype(dtype), buffer=blocks[name].buf)
+                        for name, (_, shape, dtype) in _WORKER_STATE['specs'].items()}
+
+              hourly_price = hourly_price_kernel(
+                     arrays['pld'][:, start:end], 
+                     arrays['profile'], 
+                     arrays['month_position'], 
+                     arrays['hour'],
                      lower=general_input.MONTHLY_PLD_LIMITS['min'][0],
                      upper=general_input.MONTHLY_PLD_LIMITS['max'][0]
-                     )
+              )
 
-                     final_chunk = temp_df[[
-                     'year', 'month', 'day', 'hour', 
-                     'scenario_nw', 'simulated_scenario', 
-                     'hourly_price'
-                     ]].copy()
+              # Views on the blocks must be released before closing them
+              del arrays
 
-                     output_filename = f"{output_directory}/price_scenario_{price_id}.parquet"
-                     final_chunk.to_parquet(output_filename, index=False)
+       finally:
+              for block in blocks.values():
+                     block.close()
+
+       for position, submarket in enumerate(_WORKER_STATE['submarkets']):
+              _WORKER_STATE['store'].write_part(
+                     submarket, 
+                     start, 
+                     _WORKER_STATE['price_scenarios_list'][start:end], 
+                     _WORKER_STATE['simulated_scenarios'], 
+                     hourly_price[position]
+              )
+
+       return end - start
 
-                     if int(price_id) % 100 == 0: 
-                            print(f"Processed and saved: price scenario {price_id}/{len(price_scenarios_list)}")
-              
-              return None
 
 if __name__ == "__main__":
 
        generator = ScenarioGenerator(
               scenarios_n=general_input.scenarios_n,
               base_scenario=general_input.base_scenario, # type: ignore
-              average_scenario=general_input.average_scenario_full,
+              average_scenario=ScenarioGenerator.average_anchor(),
               duck_curve_scenario=general_input.duck_curve_scenario,
               canyon_curve_scenario=general_input.canyon_curve_scenario
        )
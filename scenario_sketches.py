@@ -0,0 +1,197 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, Sequence, Tuple
+
+
+class ScenarioRiskSketch:
+    """
+    Mergeable streaming summary of a distribution per key (e.g. (metric, submarket, month)).
+
+    Each key keeps exact moments (count, mean, M2, min, max; merged with Chan's formulas) and a log-bucketed
+    quantile sketch in the style of DDSketch: a value v > 0 falls in bucket ceil(log(v) / log(gamma)), with
+    gamma = (1 + a) / (1 - a), so every quantile and tail mean is returned with relative error at most
+    a = relative_accuracy. Values are assumed non-negative (prices, capture prices and rates); values below
+    min_value are counted as 0 and values above max_value in the last bucket.
+
+    Memory depends on the number of keys only, not on the number of values, and two sketches built on disjoint
+    data (scenario files, parallel workers) are merged exactly by adding their buckets.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, min_value: float = 1e-4, max_value: float = 1e5):
+        """
+        Args:
+            relative_accuracy (float): Relative error bound of quantiles and tail means.
+            min_value (float): Smallest positive value resolved by the buckets.
+            max_value (float): Largest value resolved by the buckets.
+        """
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.max_value = max_value
+
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = np.log(self.gamma)
+        self.min_key = int(np.ceil(np.log(min_value) / self.log_gamma))
+        self.n_buckets = int(np.ceil(np.log(max_value) / self.log_gamma)) - self.min_key + 2 # bucket 0 holds values below min_value
+
+        self.keys: Dict[Tuple, int] = {}
+        self.buckets = np.zeros((0, self.n_buckets), dtype='int64')
+        self.count = np.zeros(0, dtype='int64')
+        self.mean = np.zeros(0)
+        self.m2 = np.zeros(0)
+        self.min = np.zeros(0)
+        self.max = np.zeros(0)
+
+    def _rows(self, keys: Sequence[Tuple]) -> np.ndarray:
+        """Returns the row of each key, adding rows for new keys."""
+        new_keys = [key for key in dict.fromkeys(keys) if key not in self.keys]
+
+        if new_keys:
+            for key in new_keys:
+                self.keys[key] = len(self.keys)
+
+            n_new = len(new_keys)
+            self.buckets = np.vstack([self.buckets, np.zeros((n_new, self.n_buckets), dtype='int64')])
+            self.count = np.concatenate([self.count, np.zeros(n_new, dtype='int64')])
+            self.mean = np.concatenate([self.mean, np.zeros(n_new)])
+            self.m2 = np.concatenate([self.m2, np.zeros(n_new)])
+            self.min = np.concatenate([self.min, np.full(n_new, np.inf)])
+            self.max = np.concatenate([self.max, np.full(n_new, -np.inf)])
+
+        return np.array([self.keys[key] for key in keys], dtype='int64')
+
+    def _bucket(self, values: np.ndarray) -> np.ndarray:
+        bucket = np.zeros(len(values), dtype='int64')
+        positive = values >= self.min_value
+
+        key = np.ceil(np.log(np.minimum(values[positive], self.max_value)) / self.log_gamma).astype('int64')
+        bucket[positive] = np.clip(key - self.min_key + 1, 1, self.n_buckets - 1)
+
+        return bucket
+
+    def _bucket_values(self) -> np.ndarray:
+        """Representative value of each bucket (0 for the bucket below min_value)."""
+        key = np.arange(1, self.n_buckets) + self.min_key - 1
+        return np.concatenate([[0.0], 2 * self.gamma ** key / (self.gamma + 1)])
+
+    def _merge_moments(self, rows: np.ndarray, count, mean, m2, minimum, maximum) -> None:
+        total = self.count[rows] + count
+        delta = mean - self.mean[rows]
+        ratio = np.divide(count, total, out=np.zeros(len(rows)), where=total > 0)
+
+        self.m2[rows] += m2 + delta ** 2 * self.count[rows] * ratio
+        self.mean[rows] += delta * ratio
+        self.count[rows] = total
+        self.min[rows] = np.minimum(self.min[rows], minimum)
+        self.max[rows] = np.maximum(self.max[rows], maximum)
+
+    def update(self, keys: Sequence[Tuple], codes: np.ndarray, values: np.ndarray) -> None:
+        """
+        Adds values to the sketch. codes gives the position in keys of the key of each value; NaN values are skipped.
+        A key repeated in keys is counted once, with the values of all its positions.
+        """
+        values = np.asarray(values, dtype='float64')
+        codes = np.asarray(codes, dtype='int64')
+
+        # Rows are updated with fancy indexing, which needs every row once
+        unique_keys = list(dict.fromkeys(keys))
+        if len(unique_keys) < len(keys):
+            position = {key: index for index, key in enumerate(unique_keys)}
+            codes = np.array([position[key] for key in keys], dtype='int64')[codes]
+            keys = unique_keys
+
+        valid = ~np.isnan(values)
+        values, codes = values[valid], codes[valid]
+
+        if not len(values):
+            return
+
+        rows = self._rows(keys)
+        n_keys = len(keys)
+
+        cells = codes * self.n_buckets + self._bucket(values)
+        self.buckets[rows] += np.bincount(cells, minlength=n_keys * self.n_buckets).reshape(n_keys, self.n_buckets)
+
+        count = np.bincount(codes, minlength=n_keys)
+        mean = np.divide(np.bincount(codes, weights=values, minlength=n_keys), count, out=np.zeros(n_keys), where=count > 0)
+        m2 = np.bincount(codes, weights=(values - mean[codes]) ** 2, minlength=n_keys)
+
+        minimum, maximum = np.full(n_keys, np.inf), np.full(n_keys, -np.inf)
+        np.minimum.at(minimum, codes, values)
+        np.maximum.at(maximum, codes, values)
+
+        self._merge_moments(rows, count, mean, m2, minimum, maximum)
+
+    def merge(self, other: 'ScenarioRiskSketch') -> 'ScenarioRiskSketch':
+        """Merges another sketch with the same bucket parameters into this one and returns it."""
+        if (other.relative_accuracy, other.min_value, other.max_value) != (self.relative_accuracy, self.min_value, self.max_value):
+            raise ValueError("Sketches with different relative_accuracy, min_value or max_value cannot be merged.")
+
+        other_keys = list(other.keys)
+
+        if not other_keys:
+            return self
+
+        rows = self._rows(other_keys)
+        other_rows = np.array([other.keys[key] for key in other_keys], dtype='int64')
+
+        self.buckets[rows] += other.buckets[other_rows]
+        self._merge_moments(rows, other.count[other_rows], other.mean[other_rows], other.m2[other_rows],
+                            other.min[other_rows], other.max[other_rows])
+
+        return self
+
+    def quantiles(self, quantiles: Sequence[float] = (0.05, 0.5, 0.95)) -> np.ndarray:
+        """Returns the (keys x quantiles) approximate quantiles."""
+        cumulative = np.cumsum(self.buckets, axis=1)
+        rank = np.asarray(quantiles)[None, :] * (self.count[:, None] - 1)
+
+        bucket = (cumulative[:, None, :] > rank[:, :, None]).argmax(axis=2)
+        values = self._bucket_values()[bucket]
+
+        # Exact extremes, and representative values kept inside [min, max]
+        values = np.clip(values, self.min[:, None], self.max[:, None])
+        values[self.count == 0] = np.nan
+
+        return values
+
+    def tail_mean(self, alpha: float = 0.05, lower: bool = True) -> np.ndarray:
+        """
+        Returns the mean of the lowest (lower=True, CVaR of a long position) or highest alpha fraction of the
+        values of each key.
+        """
+        bucket_values = np.clip(self._bucket_values()[None, :], self.min[:, None], self.max[:, None])
+
+        buckets = self.buckets if lower else self.buckets[:, ::-1]
+        bucket_values = bucket_values if lower else bucket_values[:, ::-1]
+
+        tail_count = np.maximum(alpha * self.count, 1)[:, None]
+        before = np.cumsum(buckets, axis=1) - buckets
+
+        taken = np.clip(tail_count - before, 0, buckets)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            tail = (taken * bucket_values).sum(axis=1) / taken.sum(axis=1)
+
+        return tail
+
+    def to_frame(self, key_names: Sequence[str] = ('metric', 'submarket', 'month'),
+                 quantiles: Sequence[float] = (0.05, 0.5, 0.95), alpha: float = 0.05) -> pd.DataFrame:
+        """
+        Summary per key: count, mean, std, min, max, the quantiles (columns p5, p50, p95, ...) and the lower and upper
+        tail means at level alpha (cvar_low, tail_high).
+        """
+        index = pd.MultiIndex.from_tuples(list(self.keys), names=list(key_names))
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std = np.sqrt(self.m2 / (self.count - 1))
+
+        summary = pd.DataFrame({'count': self.count, 'mean': self.mean, 'std': std, 'min': self.min, 'max': self.max}, index=index)
+
+        quantile_values = self.quantiles(quantiles)
+        for position, quantile in enumerate(quantiles):
+            summary[f"p{round(quantile * 100, 2):g}"] = quantile_values[:, position]
+
+        summary['cvar_low'] = self.tail_mean(alpha, lower=True)
+        summary['tail_high'] = self.tail_mean(alpha, lower=False)
+
+        return summary.sort_index()
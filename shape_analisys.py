@@ -1,19 +1,25 @@
+import numpy as np
 import pandas as pd
-from typing import Tuple, Dict, Any
-from matplotlib import cm
-import os
-from main import ElectricSectorOpenData, ONSHourlyGeneration, HistoricalDataProcessor, general_input
+from typing import Tuple, Dict, Any, List, Optional, Sequence, Iterator, Union
+from pathlib import Path
+import general_input
+from historical_data import HistoricalDataProcessor
 from NEWAVE_Outputs_Data import NewaveDataProcessor
+from price_scenario_store import PriceScenarioStore, VirtualPriceScenarioStore
+from shape_statistics import DAY_TYPES, ShapeStatisticsStore, day_type_codes
+from generation_sampler import GenerationPathSampler
 
 
 class EnergyAnalysisService:
 
     def __init__(self, 
                  historical_data_processor: HistoricalDataProcessor, 
-                 newave_processor: NewaveDataProcessor):
+                 newave_processor: NewaveDataProcessor,
+                 shape_store: Optional[ShapeStatisticsStore] = None):
 
         self.historical_data_processor = historical_data_processor
         self.newave_processor = newave_processor
+        self.shape_store = shape_store
 
         self.total_shape: pd.DataFrame = pd.DataFrame()
         self.wind_shape: pd.DataFrame = pd.DataFrame()
@@ -21,6 +27,9 @@ class EnergyAnalysisService:
         self.total_avg: pd.DataFrame = pd.DataFrame()
         self.wind_avg: pd.DataFrame = pd.DataFrame()
         self.solar_avg: pd.DataFrame = pd.DataFrame()
+        self.wind_day_type_shape: pd.DataFrame = pd.DataFrame()
+        self.solar_day_type_shape: pd.DataFrame = pd.DataFrame()
+        self.day_type_shape_holidays: Optional[frozenset] = None
         self.historical_hourly_price: pd.DataFrame = pd.DataFrame()
         self.avg_historical_shape: pd.DataFrame = pd.DataFrame()
         self.avg_historical_prices: pd.DataFrame = pd.DataFrame()
@@ -43,42 +52,153 @@ class EnergyAnalysisService:
         
         return avg_hourly_shape_final, avg_hourly_data
 
-    def _apply_monthly_shape(self, monthly_gen_nw: pd.DataFrame, final_shape: pd.DataFrame) -> pd.DataFrame:
+    def _resolve_holidays(self, holidays: Optional[List[str]]) -> Optional[List[str]]:
+        """Holidays of a call: None stands for the shape statistics store's, when there is one."""
+        if holidays is None and self.shape_store is not None:
+            return self.shape_store.holidays
+        return holidays
 
-        monthly_gen = monthly_gen_nw.copy()
-        monthly_gen['year'] = monthly_gen.index.year # type: ignore
-        monthly_gen['month'] = monthly_gen.index.month # type: ignore
-        monthly_gen = monthly_gen.rename(columns={'Submarket': 'submarket'})
+    @staticmethod
+    def _holiday_key(holidays: Optional[List[str]]) -> frozenset:
+        return frozenset(pd.to_datetime(holidays).normalize()) if holidays else frozenset()
 
-        lookup_gen = monthly_gen[['year', 'month', 'submarket', 'generation_MWh']]
+    def _calculate_day_type_shapes(self, filtered_series: pd.Series, holidays: Optional[List[str]] = None) -> pd.DataFrame:
 
-        gen_shape = final_shape.copy()
-        
-        df_shape_long = gen_shape.stack().reset_index()
-        df_shape_long = df_shape_long.rename(columns={
-            'level_2': 'submarket', 
-            0: 'hourly_profile'
-        })
-        
-        df_final = lookup_gen.merge(
-            df_shape_long,
-            on=['month', 'submarket'],
-            how='left'
+        pivoted_data = filtered_series.unstack('submarket')
+
+        day_type = day_type_codes(pivoted_data.index, holidays) # type: ignore
+
+        avg_hourly_data = pivoted_data.groupby(
+            [np.asarray(DAY_TYPES)[day_type], pivoted_data.index.month, pivoted_data.index.hour] # type: ignore
+        ).mean()
+
+        avg_hourly_data.index.names = ['day_type', 'month', 'hour']
+
+        # Daily sums are normalized against the month's mean daily sum, so the relative
+        # level between weekdays and weekends is kept in the shape.
+        daily_sum = avg_hourly_data.groupby(level=['day_type', 'month']).sum()
+        day_type_shape = avg_hourly_data / daily_sum.groupby(level='month').mean()
+
+        return day_type_shape
+
+    def _apply_monthly_shape(self, monthly_gen_nw: pd.DataFrame, final_shape: pd.DataFrame,
+                             day_type_shape: Optional[pd.DataFrame] = None, holidays: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Disaggregates monthly generation into every hour of every day of the horizon.
+
+        hourly = monthly total x profile[day_type, month, hour] / sum of the profile over the days of the month,
+        computed by broadcasting over (hours x submarkets) arrays. Without day types the profile of each day
+        sums to 1 and the denominator reduces to the number of days in the month.
+        """
+
+        monthly_gen = monthly_gen_nw.rename(columns={'Submarket': 'submarket'})
+        monthly_gen.index.name = 'date'
+
+        shape = final_shape if day_type_shape is None else day_type_shape
+
+        totals = monthly_gen.pivot_table(index='date', columns='submarket', values='generation_MWh', aggfunc='sum')
+        submarkets = [sub for sub in totals.columns if sub in shape.columns]
+        totals = totals[submarkets].sort_index()
+
+        if totals.empty:
+            print("No submarket in common between monthly generation and shape. Returning an empty DataFrame.")
+            return pd.DataFrame(columns=['submarket', 'hourly_generation'])
+
+        # Profile tensor (day_type, calendar month, hour, submarket)
+        if day_type_shape is None:
+            day_types = ['weekday']
+            profile_index = pd.MultiIndex.from_product([range(1, 13), range(24)], names=['month', 'hour'])
+            profile = shape[submarkets].reindex(profile_index).to_numpy(dtype='float64').reshape(1, 12, 24, len(submarkets))
+        else:
+            day_types = list(DAY_TYPES)
+            profile_index = pd.MultiIndex.from_product([day_types, range(1, 13), range(24)], names=['day_type', 'month', 'hour'])
+            profile = shape[submarkets].reindex(profile_index).to_numpy(dtype='float64').reshape(len(day_types), 12, 24, len(submarkets))
+
+        month_start = totals.index.to_period('M').to_timestamp()
+        days_in_month = month_start.days_in_month.to_numpy()
+        calendar_month = month_start.month.to_numpy() - 1
+        n_months = len(month_start)
+
+        # Day axis
+        day_month_pos = np.repeat(np.arange(n_months), days_in_month)
+        day_offset = np.arange(len(day_month_pos)) - np.repeat(np.cumsum(days_in_month) - days_in_month, days_in_month)
+        day_dates = pd.DatetimeIndex(month_start.to_numpy()[day_month_pos] + day_offset * np.timedelta64(1, 'D'))
+
+        if day_type_shape is None:
+            day_type = np.zeros(len(day_dates), dtype=np.int8)
+        else:
+            day_type = day_type_codes(day_dates, holidays)
+
+        # Sum of the profile over all days of each month -> (month, submarket)
+        day_type_count = np.bincount(day_month_pos * len(day_types) + day_type,
+                                     minlength=n_months * len(day_types)).reshape(n_months, len(day_types))
+        daily_profile_sum = profile.sum(axis=2)[:, calendar_month, :]
+        denominator = np.einsum('md,dms->ms', day_type_count, daily_profile_sum)
+
+        # Hour axis
+        hour_month_pos = np.repeat(day_month_pos, 24)
+        hour_day_type = np.repeat(day_type, 24)
+        hour_of_day = np.tile(np.arange(24), len(day_dates))
+        dates = np.repeat(day_dates.to_numpy(), 24) + hour_of_day * np.timedelta64(1, 'h')
+
+        hourly_generation = (
+            (totals.to_numpy(dtype='float64') / denominator)[hour_month_pos]
+            * profile[hour_day_type, calendar_month[hour_month_pos], hour_of_day, :]
         )
 
-        df_final['hourly_generation'] = df_final['generation_MWh'] * df_final['hourly_profile']
-        
-        df_final['day'] = 1
-        
-        df_final['date'] = pd.to_datetime(df_final[['year', 'month', 'day', 'hour']])
-        
-        final_gen = df_final.set_index('date')[[
-            'submarket', 'hourly_generation'
-        ]]
+        final_gen = pd.DataFrame({
+            'submarket': np.tile(np.asarray(submarkets, dtype=object), len(dates)),
+            'hourly_generation': hourly_generation.ravel(),
+        }, index=pd.DatetimeIndex(np.repeat(dates, len(submarkets)), name='date'))
+
+        return final_gen
 
-        return final_gen.sort_index()
+    def _calculate_generation_monthly_shapes_from_store(self, start_date: str, end_date: str) -> Tuple[pd.DataFrame, ...]:
+        """
+        Builds the generation shapes from the shape statistics store. Only the months of the window missing
+        from the store are fetched from raw hourly data; day types follow the store's holidays.
+        """
 
-    def calculate_generation_monthly_shapes(self, start_date: str, end_date: str) -> Tuple[pd.DataFrame, ...]:
+        series_names = ['total_generation_MWh', 'wind_generation_MWh', 'solar_generation_MWh']
+
+        missing_months = pd.PeriodIndex([], freq='M')
+        for series_name in series_names:
+            missing_months = missing_months.union(self.shape_store.missing_months(series_name, start_date, end_date)) # type: ignore
+
+        if not missing_months.empty:
+            historical_hourly_generation = self.historical_data_processor.historical_hourly_generation_processing(
+                start_date=str(missing_months.min().start_time),
+                end_date=str(missing_months.max().end_time.floor('h'))
+            )
+            total_generation, generation_RE, hourly_data = self.historical_data_processor.hourly_data_treatment(historical_hourly_generation)
+
+            new_data = total_generation.join(generation_RE, how='outer') # type: ignore
+            new_months = pd.DatetimeIndex(new_data.index.get_level_values('date')).to_period('M')
+            new_data = new_data.loc[new_months.isin(missing_months)]
+
+            for series_name in series_names:
+                self.shape_store.update(series_name, new_data[series_name]) # type: ignore
+
+            self.shape_store.save() # type: ignore
+
+        (self.total_shape, self.total_avg) = self.shape_store.monthly_avg_and_shape('total_generation_MWh', start_date, end_date) # type: ignore
+        (self.wind_shape, self.wind_avg) = self.shape_store.monthly_avg_and_shape('wind_generation_MWh', start_date, end_date) # type: ignore
+        (self.solar_shape, self.solar_avg) = self.shape_store.monthly_avg_and_shape('solar_generation_MWh', start_date, end_date) # type: ignore
+
+        self.wind_day_type_shape = self.shape_store.day_type_shape('wind_generation_MWh', start_date, end_date) # type: ignore
+        self.solar_day_type_shape = self.shape_store.day_type_shape('solar_generation_MWh', start_date, end_date) # type: ignore
+        self.day_type_shape_holidays = self._holiday_key(self.shape_store.holidays) # type: ignore
+
+        return (
+            self.total_shape, self.wind_shape, self.solar_shape,
+            self.total_avg, self.wind_avg, self.solar_avg
+        )
+
+    def calculate_generation_monthly_shapes(self, start_date: str, end_date: str, holidays: Optional[List[str]] = None) -> Tuple[pd.DataFrame, ...]:
+
+        if self.shape_store is not None:
+            self.shape_store.check_holidays(holidays)
+            return self._calculate_generation_monthly_shapes_from_store(start_date, end_date)
 
         historical_hourly_generation = self.historical_data_processor.historical_hourly_generation_processing(
             start_date=start_date, 
@@ -101,16 +221,27 @@ class EnergyAnalysisService:
         gen_solar = generation_RE_filtered['solar_generation_MWh']
         (self.solar_shape, self.solar_avg) = self._calculate_monthly_avg_and_shape(gen_solar)        
 
+        self.wind_day_type_shape = self._calculate_day_type_shapes(gen_wind, holidays)
+        self.solar_day_type_shape = self._calculate_day_type_shapes(gen_solar, holidays)
+        self.day_type_shape_holidays = self._holiday_key(holidays)
+
         return (
             self.total_shape, self.wind_shape, self.solar_shape,
             self.total_avg, self.wind_avg, self.solar_avg
         )
     
 
-    def calculate_final_monthly_generation(self, solar_shape: pd.DataFrame, wind_shape: pd.DataFrame, start_date: str = '2024-01-01' , end_date: str = '2024-12-31') -> pd.DataFrame:
+    def calculate_final_monthly_generation(self, solar_shape: pd.DataFrame, wind_shape: pd.DataFrame, start_date: str = '2024-01-01' , end_date: str = '2024-12-31',
+                                           day_type_shapes: bool = False, holidays: Optional[List[str]] = None) -> pd.DataFrame:
+
+        holidays = self._resolve_holidays(holidays)
 
-        if solar_shape.empty or wind_shape.empty:
-            (total_shape, wind_shape, solar_shape, total_avg, wind_avg, solar_avg) = self.calculate_generation_monthly_shapes( start_date=start_date, end_date=end_date )         
+        # Day type shapes are reused only if they were classified with the same holidays as this call
+        stale_day_types = day_type_shapes and (self.wind_day_type_shape.empty or self.solar_day_type_shape.empty
+                                               or self.day_type_shape_holidays != self._holiday_key(holidays))
+
+        if solar_shape.empty or wind_shape.empty or stale_day_types:
+            (total_shape, wind_shape, solar_shape, total_avg, wind_avg, solar_avg) = self.calculate_generation_monthly_shapes( start_date=start_date, end_date=end_date, holidays=holidays )         
 
         self.newave_processor.process_all_data()
             
@@ -120,8 +251,11 @@ class EnergyAnalysisService:
         final_solar_shape = solar_shape.reset_index().groupby(by = ['month','hour']).mean().drop('year',axis = 1)
         final_wind_shape = wind_shape.reset_index().groupby(by = ['month','hour']).mean().drop('year',axis = 1)
 
-        monthly_wind_gen = self._apply_monthly_shape(eol_nw_gen, final_wind_shape)
-        monthly_solar_gen = self._apply_monthly_shape(solar_nw_gen, final_solar_shape)
+        wind_day_type_shape = self.wind_day_type_shape if day_type_shapes else None
+        solar_day_type_shape = self.solar_day_type_shape if day_type_shapes else None
+
+        monthly_wind_gen = self._apply_monthly_shape(eol_nw_gen, final_wind_shape, wind_day_type_shape, holidays)
+        monthly_solar_gen = self._apply_monthly_shape(solar_nw_gen, final_solar_shape, solar_day_type_shape, holidays)
 
         monthly_solar_gen = monthly_solar_gen.set_index('submarket', append=True).rename(columns = {'hourly_generation':'solar_generation_MWh'})
         monthly_wind_gen = monthly_wind_gen.set_index('submarket', append=True).rename(columns = {'hourly_generation': 'wind_generation_MWh'})
@@ -131,19 +265,49 @@ class EnergyAnalysisService:
         return future_hourly_re_gen
 
 
+    def generation_path_sampler(self, start_date: str = '2022-01-01', end_date: str = '2024-12-31', block_length: int = 3,
+                                seed: int = 0) -> GenerationPathSampler:
+        """
+        Bootstrap sampler of hourly wind and solar paths over the NEWAVE horizon: historical days between start_date
+        and end_date, rescaled to the NEWAVE monthly RE generation. It is the stochastic counterpart of
+        calculate_final_monthly_generation, which spreads the same totals with one averaged shape.
+        """
+
+        historical_hourly_generation = self.historical_data_processor.historical_hourly_generation_processing(
+            start_date=start_date,
+            end_date=end_date
+        )
+        total_generation, generation_RE, hourly_data = self.historical_data_processor.hourly_data_treatment(historical_hourly_generation)
+
+        if self.newave_processor.re_generation_data.empty:
+            self.newave_processor.process_all_data()
+
+        return GenerationPathSampler(generation_RE, self.newave_processor.re_generation_data, block_length=block_length, seed=seed) # type: ignore
+
+
     def calculate_price_historical_shape(self, start_date: str, end_date: str) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
 
         historical_hourly_price = self.historical_data_processor.historical_hourly_pld_processing()
+
+        if self.shape_store is not None:
+            self._fold_missing_prices(self.shape_store, start_date, end_date, historical_hourly_price)
+
         historical_hourly_price = historical_hourly_price[(historical_hourly_price.index >= start_date) & (historical_hourly_price.index <= end_date)]
 
         price_aggregated = historical_hourly_price.groupby([historical_hourly_price.index, 'submarket'])['Hourly_PLD'].mean()
 
         pivoted_prices = price_aggregated.unstack('submarket')
+        self.historical_hourly_price = pivoted_prices
+
+        if self.shape_store is not None:
+            (self.avg_historical_prices, self.avg_historical_shape) = self.shape_store.hourly_avg_and_shape('Hourly_PLD', start_date, end_date)
+
+            return self.historical_hourly_price, self.avg_historical_shape, self.avg_historical_prices
+
         avg_historical_prices = pivoted_prices.groupby(pivoted_prices.index.hour).mean()
         avg_historical_prices.index.name = None
         avg_historical_shape = avg_historical_prices / avg_historical_prices.mean()
 
-        self.historical_hourly_price = pivoted_prices
         self.avg_historical_shape = avg_historical_shape
         self.avg_historical_prices = avg_historical_prices
 
@@ -151,34 +315,309 @@ class EnergyAnalysisService:
     
 
 
-    def consolidate_future_price_scenarios(self,path_scenarios:str = r'C:\Code_TCC_UFF\TCC_Eng_Elet_UFF\cenarios_horarios_finais') -> pd.DataFrame:
+    def _fold_missing_prices(self, shape_store: ShapeStatisticsStore, start_date: str, end_date: str,
+                             historical_hourly_price: Optional[pd.DataFrame] = None) -> None:
+        """Folds the whole months of hourly PLD of the window missing from the store (or held incomplete)."""
 
-        list_of_processed_dfs = []
-        
-        for pqt in os.listdir(path_scenarios):
-            file_path = os.path.join(path_scenarios, pqt)
-            df_price = pd.read_parquet(file_path)
+        missing_months = shape_store.missing_months('Hourly_PLD', start_date, end_date)
 
-            df_price_filtered = df_price.query('day == 1').copy()
+        if missing_months.empty:
+            return
 
-            df_price_filtered['date'] = pd.to_datetime(
-            df_price_filtered[['year', 'month', 'day', 'hour']]
-            )
+        if historical_hourly_price is None:
+            historical_hourly_price = self.historical_data_processor.historical_hourly_pld_processing()
 
-            df_processed = df_price_filtered.set_index('date').drop(
-            columns=['year', 'month', 'day', 'hour']
-            )
+        new_prices = historical_hourly_price.loc[historical_hourly_price.index.to_period('M').isin(missing_months)]
+        new_prices = new_prices.groupby([new_prices.index.rename('date'), 'submarket'])['Hourly_PLD'].mean()
+
+        if not new_prices.empty:
+            shape_store.update('Hourly_PLD', new_prices)
+            shape_store.save()
+
+    def calculate_price_seasonal_shapes(self, start_date: str, end_date: str,
+                                        granularities: Sequence[Tuple[str, ...]] = ShapeStatisticsStore.DEFAULT_GRANULARITIES) -> Dict[str, pd.DataFrame]:
+        """
+        Returns the hourly PLD shapes of every requested granularity (e.g. month x day type x hour, year x hour)
+        over the months of the window, from the Hourly_PLD statistics of the shape store (a default
+        ShapeStatisticsStore if none was given). Only months missing from the store are read from the hourly PLD.
+        """
+
+        shape_store = self.shape_store if self.shape_store is not None else ShapeStatisticsStore()
+
+        self._fold_missing_prices(shape_store, start_date, end_date)
+
+        return shape_store.shapes('Hourly_PLD', granularities, start_date, end_date)
+
+    @staticmethod
+    def _scenario_filter(days: Optional[Sequence[int]] = None, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                         scenario_nw: Optional[Sequence[int]] = None, simulated_scenario: Optional[Sequence[int]] = None):
+
+        import pyarrow.dataset as ds
 
-            list_of_processed_dfs.append(df_processed)
+        conditions = []
 
-            print(f"Processed file: {pqt}")
+        if days is not None:
+            conditions.append(ds.field('day').isin(list(days)))
 
-        self.future_prices = pd.concat(list_of_processed_dfs)
+        # Month range, both ends included
+        if start_date is not None:
+            start = pd.Timestamp(start_date)
+            conditions.append((ds.field('year') > start.year) | ((ds.field('year') == start.year) & (ds.field('month') >= start.month)))
+
+        if end_date is not None:
+            end = pd.Timestamp(end_date)
+            conditions.append((ds.field('year') < end.year) | ((ds.field('year') == end.year) & (ds.field('month') <= end.month)))
+
+        if scenario_nw is not None:
+            conditions.append(ds.field('scenario_nw').isin(list(scenario_nw)))
+
+        if simulated_scenario is not None:
+            conditions.append(ds.field('simulated_scenario').isin(list(simulated_scenario)))
+
+        if not conditions:
+            return None
+
+        expression = conditions[0]
+        for condition in conditions[1:]:
+            expression = expression & condition
+
+        return expression
+
+    @staticmethod
+    def _scenario_batch_to_frame(batch) -> pd.DataFrame:
+
+        df_price = batch.to_pandas()
+
+        month_start = ((df_price['year'].to_numpy(dtype='int64') - 1970) * 12 + df_price['month'].to_numpy(dtype='int64') - 1).astype('datetime64[M]')
+        dates = (
+            (month_start.astype('datetime64[D]') + (df_price['day'].to_numpy(dtype='int64') - 1)).astype('datetime64[h]')
+            + df_price['hour'].to_numpy(dtype='int64')
+        ).astype('datetime64[ns]')
+
+        df_processed = df_price.drop(columns=['year', 'month', 'day', 'hour'])
+        df_processed.index = pd.DatetimeIndex(dates, name='date')
+
+        return df_processed
+
+    def consolidate_future_price_scenarios(self, path_scenarios: Union[str, Path] = general_input.price_scenarios_path,
+                                           days: Optional[Sequence[int]] = (1,), start_date: Optional[str] = None, end_date: Optional[str] = None,
+                                           scenario_nw: Optional[Sequence[int]] = None, simulated_scenario: Optional[Sequence[int]] = None,
+                                           columns: Optional[Sequence[str]] = None, lazy: bool = False,
+                                           use_threads: bool = True, submarkets: Optional[Sequence[str]] = None) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
+        """
+        Reads the hourly price scenarios with filters on day, month range (start_date/end_date, both included),
+        scenario_nw and simulated_scenario, and a column selection. Use days=None to keep every day.
+
+        Datasets written by ScenarioGenerator (PriceScenarioStore layout) are read through the footer index, row
+        group by row group, optionally restricted to submarkets. A .npz path of price scenario factors
+        (VirtualPriceScenarioStore) computes the same prices on demand. Legacy directories of price_scenario_*.parquet
+        files are scanned as a single dataset with the filters pushed down to the Parquet reader, which reads the
+        files in parallel.
+
+        With lazy=True an iterator of DataFrames is returned instead of one concatenated frame, one per scenario_nw
+        (per submarket), as future_capture_prices_calculate expects.
+
+        Note that the default days=(1,) keeps only the first day of each month; capture prices over whole months
+        need days=None.
+        """
+
+        if Path(path_scenarios).suffix == '.npz':
+            store = VirtualPriceScenarioStore.load(path_scenarios)
+        else:
+            store = PriceScenarioStore(path_scenarios)
+
+        if isinstance(store, VirtualPriceScenarioStore) or store.exists():
+            if lazy:
+                frames = store.iter_read(submarkets, scenario_nw, simulated_scenario, days, start_date, end_date)
+                return frames if columns is None else (frame[list(columns)] for frame in frames)
+
+            # read returns an empty frame (with the columns) when no scenario matches the selection
+            self.future_prices = store.read(submarkets, scenario_nw, simulated_scenario, days, start_date, end_date)
+
+            if columns is not None:
+                self.future_prices = self.future_prices[list(columns)]
+
+            return self.future_prices
+
+        import pyarrow.dataset as ds
+
+        scenario_files = sorted(str(file) for file in Path(path_scenarios).glob('price_scenario_*.parquet'))
+
+        if not scenario_files:
+            print(f"No price scenario files found in {path_scenarios}. Returning an empty DataFrame.")
+            return iter([]) if lazy else pd.DataFrame()
+
+        dataset = ds.dataset(scenario_files, format='parquet')
+
+        value_columns = list(columns) if columns is not None else ['scenario_nw', 'simulated_scenario', 'hourly_price']
+
+        scan_columns = ['year', 'month', 'day', 'hour'] + value_columns
+        scan_filter = self._scenario_filter(days, start_date, end_date, scenario_nw, simulated_scenario)
+
+        if lazy:
+            # One frame per file (one scenario_nw each), so a scenario is never split across frames
+            tables = (fragment.to_table(columns=scan_columns, filter=scan_filter, use_threads=use_threads) for fragment in dataset.get_fragments())
+            return (self._scenario_batch_to_frame(table) for table in tables if table.num_rows)
+
+        scanner = dataset.scanner(columns=scan_columns, filter=scan_filter, use_threads=use_threads)
+
+        self.future_prices = self._scenario_batch_to_frame(scanner.to_table())
+
+        print(f"Processed {len(scenario_files)} price scenario files.")
 
         return self.future_prices
 
+    @staticmethod
+    def _kmeans_plus_plus(features: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+
+        centers_idx = [int(rng.integers(len(features)))]
+        min_distance = ((features - features[centers_idx[0]]) ** 2).sum(axis=1)
+
+        for _ in range(1, k):
+            probabilities = min_distance / min_distance.sum() if min_distance.sum() > 0 else None
+            centers_idx.append(int(rng.choice(len(features), p=probabilities)))
+            min_distance = np.minimum(min_distance, ((features - features[centers_idx[-1]]) ** 2).sum(axis=1))
+
+        return np.asarray(centers_idx)
+
+    @staticmethod
+    def _squared_distances(features: np.ndarray, centers: np.ndarray) -> np.ndarray:
+
+        distances = (features ** 2).sum(axis=1)[:, None] - 2 * features @ centers.T + (centers ** 2).sum(axis=1)[None, :]
+
+        return np.maximum(distances, 0)
+
+    def _cluster_days(self, features: np.ndarray, k: int, method: str, seed: int, n_iter: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Clusters the rows of features (days x features) into k groups with vectorized k-means (Lloyd) or
+        k-medoids (alternating) iterations. Returns the labels of each day and the index of the day that
+        represents each cluster (the medoid, or the member closest to the k-means centroid).
+        """
+
+        rng = np.random.default_rng(seed)
+        k = min(k, len(features))
+        medoids_idx = self._kmeans_plus_plus(features, k, rng)
+        centers = features[medoids_idx]
+        labels = np.full(len(features), -1)
+
+        for _ in range(n_iter):
+            distances = self._squared_distances(features, centers)
+            new_labels = distances.argmin(axis=1)
+
+            # Empty clusters restart at the day farthest from its center
+            for cluster in np.setdiff1d(np.arange(k), new_labels):
+                farthest = int(distances[np.arange(len(features)), new_labels].argmax())
+                new_labels[farthest] = cluster
+                distances[farthest] = 0
+
+            if np.array_equal(new_labels, labels):
+                break
+            labels = new_labels
+
+            if method == 'kmeans':
+                one_hot = (labels[None, :] == np.arange(k)[:, None]).astype(features.dtype)
+                centers = (one_hot @ features) / one_hot.sum(axis=1, keepdims=True)
+            else:
+                for cluster in range(k):
+                    members = np.flatnonzero(labels == cluster)
+                    within = np.sqrt(self._squared_distances(features[members], features[members]))
+                    medoids_idx[cluster] = members[within.sum(axis=1).argmin()]
+                centers = features[medoids_idx]
+
+        if method == 'kmeans':
+            medoids_idx = np.asarray([
+                np.flatnonzero(labels == cluster)[self._squared_distances(features[labels == cluster], centers[[cluster]])[:, 0].argmin()]
+                for cluster in range(k)
+            ])
+
+        return labels, medoids_idx
+
+    def calculate_representative_days(self, hourly_data: pd.DataFrame, k: int = 12, method: str = 'kmeans',
+                                      seed: int = 0, n_iter: int = 100) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Clusters the historical days of joint (PLD, wind, solar, load) hourly profiles of each submarket into
+        k representative days. hourly_data is the (date, submarket) frame from HistoricalDataProcessor.hourly_data_treatment.
+
+        Returns:
+            representative_days: (submarket, cluster) -> representative date, weight (number of days) and the
+                cluster's 24-hour profiles (centroid for 'kmeans', medoid day for 'kmedoids').
+            day_clusters: (date, submarket) -> cluster of every complete historical day.
+        """
+
+        if method not in ('kmeans', 'kmedoids'):
+            raise ValueError("Method must be 'kmeans' or 'kmedoids'.")
+
+        variables = ['Hourly_PLD', 'wind_generation_MWh', 'solar_generation_MWh', 'total_generation_MWh']
+
+        representative_list = []
+        day_clusters_list = []
+
+        for submarket, data in hourly_data[variables].groupby(level='submarket'):
+
+            dates = pd.DatetimeIndex(data.index.get_level_values('date'))
+            data = data.droplevel('submarket').groupby(dates).mean()
+
+            # Complete days only -> (days, 24, variables)
+            days = data.index.normalize()
+            complete_days = days.value_counts().loc[lambda count: count == 24].index.sort_values()
+            data = data.loc[days.isin(complete_days)].sort_index()
+            day_profiles = data.to_numpy(dtype='float64').reshape(len(complete_days), 24, len(variables))
+
+            if len(complete_days) == 0:
+                print(f"[{submarket}] No complete day to cluster.")
+                continue
+
+            scale = day_profiles.reshape(-1, len(variables)).std(axis=0)
+            scale[scale == 0] = 1
+            features = (day_profiles / scale).reshape(len(complete_days), -1)
+
+            labels, medoids_idx = self._cluster_days(features, k, method, seed, n_iter)
+            n_clusters = len(medoids_idx)
+
+            weights = np.bincount(labels, minlength=n_clusters)
+
+            if method == 'kmeans':
+                one_hot = (labels[None, :] == np.arange(n_clusters)[:, None]).astype('float64')
+                profiles = np.einsum('cd,dhv->chv', one_hot, day_profiles) / weights[:, None, None]
+            else:
+                profiles = day_profiles[medoids_idx]
+
+            representative = pd.DataFrame({
+                'submarket': submarket,
+                'cluster': np.repeat(np.arange(n_clusters), 24),
+                'date': np.repeat(complete_days[medoids_idx].to_numpy(), 24),
+                'hour': np.tile(np.arange(24), n_clusters),
+                'weight': np.repeat(weights, 24),
+            })
+            representative[variables] = profiles.reshape(-1, len(variables))
+            representative_list.append(representative)
+
+            day_clusters_list.append(pd.DataFrame({'date': complete_days, 'submarket': submarket, 'cluster': labels}))
+
+        if not representative_list:
+            return pd.DataFrame(), pd.DataFrame()
+
+        representative_days = pd.concat(representative_list, ignore_index=True).set_index(['submarket', 'cluster'])
+        day_clusters = pd.concat(day_clusters_list, ignore_index=True).set_index(['date', 'submarket'])
+
+        return representative_days, day_clusters
+
+    def reduce_hourly_data(self, representative_days: pd.DataFrame) -> pd.DataFrame:
+        """
+        Converts the representative days into a reduced hourly frame with the layout of hourly_data plus a
+        'weight' column, which CaptureIndicators uses to weight each representative hour.
+        """
+
+        reduced = representative_days.reset_index()
+        reduced['date'] = reduced['date'] + pd.to_timedelta(reduced['hour'], unit='h')
+
+        return reduced.drop(columns=['cluster', 'hour']).set_index(['date', 'submarket']).sort_index()
+
 if __name__ == "__main__":
 
+    from OpenDataSEB import ElectricSectorOpenData
+    from ONS_Hourly_Generation import ONSHourlyGeneration
+
     electric_sector_client_ccee = ElectricSectorOpenData("ccee")
     electric_sector_client_ons = ElectricSectorOpenData("ons")
     ons_generation_client = ONSHourlyGeneration()
@@ -0,0 +1,273 @@
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+import general_input
+
+
+DAY_TYPES = ('weekday', 'weekend')
+
+
+def day_type_codes(dates: pd.DatetimeIndex, holidays: Optional[List[str]] = None) -> np.ndarray:
+    """
+    Returns the day type code (position in DAY_TYPES) of each date. Holidays are counted as weekends.
+    """
+    day_type = np.asarray(dates.dayofweek >= 5, dtype=np.int8) # type: ignore
+
+    if holidays:
+        holiday_days = pd.to_datetime(holidays).normalize()
+        day_type[dates.normalize().isin(holiday_days)] = DAY_TYPES.index('weekend')
+
+    return day_type
+
+
+class ShapeStatisticsStore:
+    """
+    Stores the sufficient statistics (sum, count and M2 per year, month, day type, hour and submarket) of the
+    hourly series used to build generation and price shapes, and persists them to Parquet between runs.
+    Any coarser granularity (hour, month x hour, month x day type x hour, year x hour, ...) is derived from the
+    cells, with the cell variances merged by Chan's parallel formula.
+    """
+
+    KEYS = ['series', 'year', 'month', 'day_type', 'hour', 'submarket']
+    AXES = ('year', 'month', 'day_type', 'hour')
+
+    DEFAULT_GRANULARITIES = (
+        ('hour',),
+        ('month', 'hour'),
+        ('day_type', 'hour'),
+        ('month', 'day_type', 'hour'),
+        ('year', 'hour'),
+        ('year', 'month', 'hour'),
+    )
+
+    def __init__(self, path: Union[str, Path] = general_input.shape_statistics_path, holidays: Optional[List[str]] = None):
+        """
+        Initializes the store, loading the statistics already persisted in path.
+
+        Args:
+            path (Path): Parquet file where the statistics are persisted.
+            holidays (list): Dates counted as weekend when classifying day types.
+        """
+        self.path = Path(path)
+        self.holidays = holidays
+
+        self.statistics: pd.DataFrame = pd.DataFrame(
+            {'sum': pd.Series(dtype='float64'), 'count': pd.Series(dtype='int64'), 'm2': pd.Series(dtype='float64')},
+            index=pd.MultiIndex.from_tuples([], names=self.KEYS)
+        )
+
+        if self.path.exists():
+            self.load()
+
+    def load(self) -> None:
+        """Loads the persisted statistics (stores saved without M2 get NaN variances)."""
+        self.statistics = pd.read_parquet(self.path).set_index(self.KEYS).sort_index()
+
+        if 'm2' not in self.statistics.columns:
+            self.statistics['m2'] = np.nan
+
+    def save(self) -> None:
+        """Persists the statistics to Parquet."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.statistics.reset_index().to_parquet(self.path, index=False)
+
+    def update(self, series_name: str, hourly_series: pd.Series) -> None:
+        """
+        Folds an hourly series indexed by (date, submarket) into the store. Only the cells of the months present
+        in hourly_series are touched: they are replaced, so re-ingesting a month never double counts it.
+        """
+        values = pd.to_numeric(hourly_series, errors='coerce').dropna()
+
+        if values.empty:
+            print(f"[{series_name}] No data to update the shape statistics.")
+            return
+
+        dates = pd.DatetimeIndex(values.index.get_level_values('date'))
+
+        keys = [
+            dates.year.rename('year'),
+            dates.month.rename('month'),
+            pd.Index(day_type_codes(dates, self.holidays), name='day_type'),
+            dates.hour.rename('hour'),
+            values.index.get_level_values('submarket').rename('submarket')
+        ]
+
+        grouped = values.groupby(keys).agg(['sum', 'count'])
+        grouped['m2'] = ((values - values.groupby(keys).transform('mean')) ** 2).groupby(keys).sum()
+
+        new_statistics = pd.concat({series_name: grouped}, names=['series'])
+
+        updated_months = pd.MultiIndex.from_arrays([
+            np.full(len(new_statistics), series_name, dtype=object),
+            new_statistics.index.get_level_values('year'),
+            new_statistics.index.get_level_values('month')
+        ]).unique()
+
+        stored_months = pd.MultiIndex.from_arrays([
+            self.statistics.index.get_level_values('series'),
+            self.statistics.index.get_level_values('year'),
+            self.statistics.index.get_level_values('month')
+        ])
+
+        self.statistics = pd.concat([
+            self.statistics.loc[~stored_months.isin(updated_months)],
+            new_statistics
+        ]).sort_index()
+
+        print(f"[{series_name}] Shape statistics updated for {len(updated_months)} month(s).")
+
+    def available_months(self, series_name: str) -> pd.PeriodIndex:
+        """Returns the months held in the store for a series."""
+        if series_name not in self.statistics.index.get_level_values('series'):
+            return pd.PeriodIndex([], freq='M')
+
+        cells = self.statistics.xs(series_name, level='series')
+        months = cells.index.droplevel(['day_type', 'hour', 'submarket']).unique()
+
+        return pd.PeriodIndex([pd.Period(year=year, month=month, freq='M') for year, month in months], freq='M')
+
+    def incomplete_months(self, series_name: str) -> pd.PeriodIndex:
+        """
+        Returns the months held for a series with fewer hours than the month has in every submarket (e.g. a month
+        folded before it was over), assuming one row per (date, submarket) in the folded series.
+        """
+        if series_name not in self.statistics.index.get_level_values('series'):
+            return pd.PeriodIndex([], freq='M')
+
+        counts = self.statistics.xs(series_name, level='series')['count']
+        held_hours = counts.groupby(level=['year', 'month', 'submarket']).sum().groupby(level=['year', 'month']).max()
+
+        months = pd.PeriodIndex([pd.Period(year=year, month=month, freq='M') for year, month in held_hours.index], freq='M')
+
+        return months[held_hours.to_numpy() < months.days_in_month * 24]
+
+    def missing_months(self, series_name: str, start_date: str, end_date: str) -> pd.PeriodIndex:
+        """Returns the months of the window (both ends included) not yet held in the store, or held incomplete."""
+        window = pd.period_range(pd.Timestamp(start_date), pd.Timestamp(end_date), freq='M')
+
+        return window.difference(self.available_months(series_name)).union(window.intersection(self.incomplete_months(series_name)))
+
+    def check_holidays(self, holidays: Optional[List[str]]) -> None:
+        """Raises if holidays (None: the store's) differ from the ones the store classifies day types with."""
+        if holidays is None:
+            return
+
+        requested = set(pd.to_datetime(holidays).normalize())
+        stored = set(pd.to_datetime(self.holidays).normalize()) if self.holidays else set()
+
+        if requested != stored:
+            raise ValueError("The holidays differ from the ones of the shape statistics store. "
+                             "Use a store built with these holidays (ShapeStatisticsStore(holidays=...)).")
+
+    def _window(self, series_name: str, start_date: Optional[str], end_date: Optional[str]) -> pd.DataFrame:
+        """Cells of a series over the months of the window (both ends included; None leaves that end open)."""
+
+        if series_name not in self.statistics.index.get_level_values('series'):
+            return self.statistics.iloc[0:0].droplevel('series')
+
+        cells = self.statistics.xs(series_name, level='series')
+        month_id = np.asarray(cells.index.get_level_values('year') * 12 + cells.index.get_level_values('month'))
+        in_window = np.ones(len(cells), dtype=bool)
+
+        if start_date is not None:
+            start = pd.Timestamp(start_date)
+            in_window &= month_id >= start.year * 12 + start.month
+
+        if end_date is not None:
+            end = pd.Timestamp(end_date)
+            in_window &= month_id <= end.year * 12 + end.month
+
+        return cells.loc[in_window]
+
+    def monthly_avg_and_shape(self, series_name: str, start_date: str, end_date: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Returns the (year, month, hour) x submarket shape and average of a series over the months of the window,
+        in the same layout as EnergyAnalysisService._calculate_monthly_avg_and_shape.
+        """
+        totals = self._window(series_name, start_date, end_date).groupby(level=['year', 'month', 'hour', 'submarket']).sum()
+
+        avg_hourly_data = (totals['sum'] / totals['count']).unstack('submarket')
+
+        avg_hourly_shape_final = avg_hourly_data / avg_hourly_data.groupby(level=['year', 'month']).sum()
+
+        return avg_hourly_shape_final, avg_hourly_data
+
+    def day_type_shape(self, series_name: str, start_date: str, end_date: str) -> pd.DataFrame:
+        """
+        Returns the (day_type, month, hour) x submarket shape of a series over the months of the window,
+        in the same layout as EnergyAnalysisService._calculate_day_type_shapes.
+        """
+        totals = self._window(series_name, start_date, end_date).groupby(level=['day_type', 'month', 'hour', 'submarket']).sum()
+
+        avg_hourly_data = (totals['sum'] / totals['count']).unstack('submarket')
+        avg_hourly_data.index = avg_hourly_data.index.set_levels(
+            np.asarray(DAY_TYPES)[avg_hourly_data.index.levels[0]], level='day_type' # type: ignore
+        )
+
+        daily_sum = avg_hourly_data.groupby(level=['day_type', 'month']).sum()
+
+        return avg_hourly_data / daily_sum.groupby(level='month').mean()
+
+    def hourly_avg_and_shape(self, series_name: str, start_date: str, end_date: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Returns the 24-hour average and shape (average / daily mean) of a series over the months of the window,
+        in the same layout as EnergyAnalysisService.calculate_price_historical_shape.
+        """
+        totals = self._window(series_name, start_date, end_date).groupby(level=['hour', 'submarket']).sum()
+
+        avg_hourly_data = (totals['sum'] / totals['count']).unstack('submarket')
+        avg_hourly_data.index.name = None
+
+        return avg_hourly_data, avg_hourly_data / avg_hourly_data.mean()
+
+    def shapes(self, series_name: str = 'Hourly_PLD', granularities: Sequence[Tuple[str, ...]] = DEFAULT_GRANULARITIES,
+               start_date: Optional[str] = None, end_date: Optional[str] = None) -> Dict[str, pd.DataFrame]:
+        """
+        Returns, for each granularity (tuple of axes among year, month, day_type and hour), a frame indexed by
+        those axes and submarket with the count, mean, std and shape (mean / mean over the hours of the group)
+        of a series over the months of the window.
+        """
+        cells = self._window(series_name, start_date, end_date)
+        cells = cells.assign(square=cells['sum'] ** 2 / cells['count'])
+
+        results = {}
+
+        for granularity in granularities:
+            if 'hour' not in granularity:
+                raise ValueError("Every granularity must include 'hour'.")
+
+            kept = [axis for axis in self.AXES if axis in granularity]
+            totals = cells.groupby(level=kept + ['submarket']).sum()
+
+            mean = totals['sum'] / totals['count']
+            # Chan: sum of the cell M2 plus the spread of the cell means around the group mean
+            m2 = (totals['m2'] + totals['square'] - totals['sum'] * mean).clip(lower=0)
+            group = [axis for axis in kept if axis != 'hour'] + ['submarket']
+
+            frame = pd.DataFrame({
+                'count': totals['count'],
+                'mean': mean,
+                'std': np.sqrt(m2 / np.maximum(totals['count'] - 1, 1)),
+                'shape': mean / mean.groupby(level=group).transform('mean'),
+            })
+
+            if 'day_type' in kept:
+                frame.index = frame.index.set_levels(np.asarray(DAY_TYPES)[frame.index.levels[kept.index('day_type')]], level='day_type') # type: ignore
+
+            results['_'.join(granularity)] = frame
+
+        return results
+
+    def anchor_profile(self, submarket: str, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                       series_name: str = 'Hourly_PLD') -> List[float]:
+        """
+        Returns the 24-hour shape of a series of a submarket over the window, in the layout of the scenario anchors
+        of general_input (e.g. average_scenario_full). Empty if the store holds no data of the submarket.
+        """
+        hourly_shape = self.shapes(series_name, [('hour',)], start_date, end_date)['hour']
+
+        if submarket not in hourly_shape.index.get_level_values('submarket'):
+            return []
+
+        return hourly_shape.xs(submarket, level='submarket')['shape'].reindex(range(24)).tolist()
@@ -0,0 +1,55 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# Imported only by the functions that plot or download
+DEFERRED_MODULES = {'matplotlib', 'httpx', 'requests'}
+
+# Modules every module needs; they are imported first so the budget covers only the module's own import time
+BASELINE_MODULES = ['numpy', 'pandas']
+
+# Import time of a module on top of the baseline, in seconds (an eager matplotlib.pyplot alone takes ~0.4 s)
+IMPORT_TIME_BUDGET = 0.25
+
+MODULES = ['general_input', 'historical_data', 'historical_backend', 'capture_indicators', 'capture_service',
+           'shape_analisys', 'shape_statistics', 'scenario_generation', 'scenario_delta', 'scenario_sketches',
+           'scenario_charts', 'price_scenario_store', 'generation_sampler', 'hour_coverage', 'http_transport',
+           'OpenDataSEB', 'ONS_Hourly_Generation', 'NEWAVE_Outputs_Data', 'ManualyData', 'main']
+
+
+def _import_times(module: str) -> dict:
+    """
+    Runs `python -X importtime` on the import of module after the baseline modules and returns the cumulative
+    microseconds of each module imported by it.
+    """
+    baseline = ', '.join(BASELINE_MODULES)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {baseline}; import {module}'],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+
+    times = {}
+    lines = result.stderr.splitlines()
+    # The baseline imports end with the line of its last top-level module
+    start = max(position for position, line in enumerate(lines) if line.rstrip().endswith(f'| {BASELINE_MODULES[-1]}')) + 1
+
+    for line in lines[start:]:
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+
+    return times
+
+
+@pytest.mark.parametrize('module', MODULES)
+def test_import_defers_heavy_dependencies(module):
+    times = _import_times(module)
+
+    loaded = {name.split('.')[0] for name in times} & DEFERRED_MODULES
+    assert not loaded, f"import {module} loads {sorted(loaded)}"
+
+    assert times[module] / 1e6 < IMPORT_TIME_BUDGET, f"import {module} takes {times[module] / 1e6:.2f} s on top of {BASELINE_MODULES}"